@@ -0,0 +1,88 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import ctypes
+import ctypes.util
+
+"""
+Clocks that tasks read the current time from. A clock is just a callable
+that returns the current time in seconds.
+
+    WallClock       time.time(), the default
+    MonotonicClock  CLOCK_MONOTONIC, unaffected by NTP/system clock changes
+    VirtualClock    only moves when it is told to, for simulating tasks
+                    faster than real time
+"""
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    _librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1',
+                         use_errno=True)
+    _clock_gettime = _librt.clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+    def monotonic():
+        """ seconds since some arbitrary point, never goes backwards """
+        t = _timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)):
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'clock_gettime failed')
+        return t.tv_sec + t.tv_nsec * 1E-9
+
+
+class WallClock(object):
+
+    def __call__(self):
+        return time.time()
+
+
+class MonotonicClock(object):
+
+    def __call__(self):
+        return monotonic()
+
+
+class VirtualClock(object):
+
+    """
+    A clock that only advances when advance() or set() are called
+
+    Methods:
+        advance(dt)
+        set(t)
+    """
+
+    def __init__(self, t=0.):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, dt):
+        self.t += dt
+        return self.t
+
+    def set(self, t):
+        self.t = t
@@ -0,0 +1,148 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import Queue
+import threading
+import traceback
+from collections import deque, namedtuple
+
+"""
+Task lifecycle events. Tasks publish these from _display(), i.e. from the
+middle of a frame, so publishing only ever enqueues: the handlers (UI
+updates, moving on to the next task, printing reports) run later, either on
+the main loop or on a thread of their own.
+
+    TaskStarted(task, time)
+    StimOnset(task, stim, time)
+    StimOffset(task, stim, time)
+    TaskFinished(task, time, actualstimtimes, theoreticalstimtimes)
+
+'time' is the task's clock at the time of the event. TaskFinished carries
+copies of the task's stimulus times, taken when it was published: by the
+time a handler runs the task may already have been reinitialised.
+
+    >>> bus = EventBus(call=wx.CallAfter)
+    >>> bus.subscribe(onfinished, TaskFinished)
+    >>> bus.subscribe(report, TaskFinished, threaded=True)
+    >>> task = taskcls(canvas, bus=bus)
+"""
+
+TaskStarted = namedtuple('TaskStarted', 'task time')
+StimOnset = namedtuple('StimOnset', 'task stim time')
+StimOffset = namedtuple('StimOffset', 'task stim time')
+TaskFinished = namedtuple('TaskFinished', 'task time actualstimtimes '
+                          'theoreticalstimtimes')
+
+
+def _handle(handler, event):
+    try:
+        handler(event)
+    except Exception:
+        # one broken handler shouldn't stop the others
+        print >> sys.stderr, 'Error handling %s:' % type(event).__name__
+        traceback.print_exc()
+
+
+class _Worker(threading.Thread):
+
+    """ runs one threaded subscriber's handler on its own thread """
+
+    def __init__(self, handler, init=None):
+        super(_Worker, self).__init__()
+        self.daemon = True
+        self.handler = handler
+        self.init = init
+        self.queue = Queue.Queue()
+
+    def run(self):
+        if self.init is not None:
+            self.init()
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            _handle(self.handler, event)
+
+
+class EventBus(object):
+
+    """
+    Delivers events to the handlers subscribed to their type.
+
+    Handlers subscribed with threaded=True get each event on a thread of
+    their own as soon as it is published. The others are queued until
+    dispatch(), which runs them in order on the calling thread. If 'call'
+    is given (e.g. wx.CallAfter) dispatch() is scheduled through it
+    whenever there are events waiting, otherwise it has to be called
+    explicitly. 'thread_init' is called at the start of every worker
+    thread.
+
+    Methods:
+        subscribe(handler, *types, threaded=False)
+        publish(event)
+        dispatch()
+        close()
+    """
+
+    def __init__(self, call=None, thread_init=None):
+        self.call = call
+        self.thread_init = thread_init
+        self.handlers = {}
+        self.workers = {}
+        self.pending = deque()
+        self.scheduled = False
+
+    def subscribe(self, handler, *types, **kwargs):
+        """ call 'handler(event)' for every event of the given types """
+        if kwargs.get('threaded', False):
+            if handler not in self.workers:
+                self.workers[handler] = _Worker(handler, self.thread_init)
+                self.workers[handler].start()
+            target = self.workers[handler].queue
+        else:
+            target = self.pending
+        for eventtype in types:
+            self.handlers.setdefault(eventtype, []).append((handler, target))
+
+    def publish(self, event):
+        """ queue 'event' for its handlers, never blocks """
+        subscribers = self.handlers.get(type(event))
+        if not subscribers:
+            return
+        for handler, target in subscribers:
+            if target is self.pending:
+                self.pending.append((handler, event))
+            else:
+                target.put(event)
+        if self.pending and self.call is not None and not self.scheduled:
+            self.scheduled = True
+            self.call(self.dispatch)
+
+    def dispatch(self):
+        """ run the queued main loop handlers """
+        self.scheduled = False
+        pending = self.pending
+        while pending:
+            handler, event = pending.popleft()
+            _handle(handler, event)
+
+    def close(self):
+        """ stop the worker threads once they've handled their events """
+        for worker in self.workers.itervalues():
+            worker.queue.put(None)
+        self.workers = {}
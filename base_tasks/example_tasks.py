@@ -16,10 +16,15 @@ along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import numpy as np
-from scipy.misc import lena
 from base_tasks.task_classes import *
 
 
+def lena_texture():
+    # scipy is only needed (and imported) when the texture isn't cached yet
+    from scipy.misc import lena
+    return lena()
+
+
 class example_barmap(BarFlash):
 
     taskname = 'example_barmap'
@@ -140,10 +145,10 @@ class example_texture(FlashingTexture):
 
     taskname = 'example_texture'
 
-    # _texdata needs to be float32 and flipped along the row dimension
-    img = lena().astype(np.float64)
-    img = (img - img.min()) / img.ptp()
-    _texdata = np.flipud(img)
+    # the image is normalised and flipped along the row dimension once, then
+    # cached on disk in GPU format
+    texture_source = TextureSource(generator=lena_texture, normalise=True,
+                                   flipud=True)
 
     # stimulus-specific parameters
     texture_color = (0., 1., 1., 1.)
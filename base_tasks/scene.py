@@ -0,0 +1,143 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import OpenGL
+# disable for speed?
+OpenGL.ERROR_CHECKING = False
+OpenGL.ERROR_LOGGING = False
+import OpenGL.GL as gl
+
+"""
+################################################################################
+Batched scene submission
+################################################################################
+
+Rather than drawing primitives directly, a task's _drawstim() can submit
+DrawItems to its Scene. Once the task has finished submitting, the canvas
+calls Scene.flush(), which sorts the items by their GL state and draws them
+with as few state changes as possible - in particular, each stencil
+aperture is only drawn once per frame however many items are drawn through
+it, and GL_STENCIL_TEST is only toggled when we move between masked and
+unmasked items.
+
+Since all of our primitives blend additively, the order in which items are
+drawn within a layer doesn't change the result. Items in a higher 'layer'
+are always drawn after those in lower ones.
+
+DrawItems and Apertures are meant to be created once (in _buildstim) and
+updated in place every frame, e.g.:
+
+    self._baritem.args['x'] = x
+    self._scene.submit(self._baritem)
+"""
+
+
+class Aperture(object):
+
+    """
+    A stencil primitive (CircularStencil, RectangularStencil) plus the
+    arguments to draw it with
+
+    Methods:
+        draw()
+    """
+
+    def __init__(self, stencil, **args):
+        self.stencil = stencil
+        self.args = args
+
+    def draw(self):
+        self.stencil.draw(**self.args)
+
+
+class DrawItem(object):
+
+    """
+    A primitive, the arguments to draw it with, and the state it needs:
+    an optional Aperture to mask it and the layer it is drawn in
+
+    Methods:
+        draw()
+    """
+
+    def __init__(self, primitive, aperture=None, layer=0, **args):
+        self.primitive = primitive
+        self.aperture = aperture
+        self.layer = layer
+        self.args = args
+
+    def draw(self):
+        self.primitive.draw(**self.args)
+
+
+def _state_key(item):
+    ap = item.aperture
+    return (item.layer, 0 if ap is None else id(ap))
+
+
+class Scene(object):
+
+    """
+    Per-frame list of DrawItems
+
+    Methods:
+        submit(item)
+        flush()
+        clear()
+    """
+
+    def __init__(self):
+        self.items = []
+
+    def submit(self, item):
+        self.items.append(item)
+
+    def clear(self):
+        del self.items[:]
+
+    def flush(self):
+        """ draw everything that was submitted this frame, then forget it """
+        items = self.items
+        if not items:
+            return
+
+        # stable, so submission order is preserved within each state group
+        items.sort(key=_state_key)
+
+        current = None
+        stencil_on = False
+        for item in items:
+            ap = item.aperture
+            if ap is not current:
+                if ap is None:
+                    gl.glDisable(gl.GL_STENCIL_TEST)
+                    stencil_on = False
+                else:
+                    if not stencil_on:
+                        gl.glEnable(gl.GL_STENCIL_TEST)
+                        stencil_on = True
+                    # wipe the previous aperture (only within the current
+                    # scissor box) before drawing the new one
+                    gl.glClear(gl.GL_STENCIL_BUFFER_BIT)
+                    ap.draw()
+                current = ap
+            item.draw()
+
+        if stencil_on:
+            gl.glDisable(gl.GL_STENCIL_TEST)
+
+        del items[:]
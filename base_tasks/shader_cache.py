@@ -0,0 +1,251 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import struct
+import hashlib
+
+import numpy as np
+
+import OpenGL.GL as gl
+
+"""
+Linked shader programs, cached on disk as program binaries
+(glGetProgramBinary) so that they don't have to be compiled from source
+every time tadpydoodle starts or a task is first used.
+
+Entries are keyed by the shader sources and the driver's vendor, renderer
+and version strings, and store the binary format alongside the binary. If
+an entry is missing, its format isn't one the driver accepts any more, or
+glProgramBinary rejects it (drivers may do so after any update), the
+program is compiled and linked from source and the entry is rewritten.
+Drivers without program binary support (GL < 4.1 and no
+ARB_get_program_binary) always compile.
+
+    >>> program = shader_cache.program(vshader_str, fshader_str, 'gamma')
+
+A GL context has to be current.
+"""
+
+# bump this if the file layout below changes
+CACHE_VERSION = 1
+
+# where the program binaries live
+cachedir = '~/.tadpydoodle/shader_cache'
+
+# file header: magic, cache version, binary format, binary length
+HEADER = struct.Struct('<4sIII')
+MAGIC = 'TPSC'
+
+
+def _gl_string(name):
+    value = gl.glGetString(name)
+    return value if value is not None else ''
+
+
+def compile_program(vertex, fragment, retrievable=False):
+    """
+    Compile and link a program from source. Returns (program, compile
+    time, link time) in seconds, and raises RuntimeError if either step
+    fails
+    """
+    t0 = time.time()
+    shaders = []
+    for source, shadertype in ((vertex, gl.GL_VERTEX_SHADER),
+                               (fragment, gl.GL_FRAGMENT_SHADER)):
+        shader = gl.glCreateShader(shadertype)
+        gl.glShaderSource(shader, source)
+        gl.glCompileShader(shader)
+        if not gl.glGetShaderiv(shader, gl.GL_COMPILE_STATUS):
+            log = gl.glGetShaderInfoLog(shader)
+            gl.glDeleteShader(shader)
+            raise RuntimeError('Shader compile failure:\n%s' % log)
+        shaders.append(shader)
+    t1 = time.time()
+
+    program = gl.glCreateProgram()
+    for shader in shaders:
+        gl.glAttachShader(program, shader)
+    if retrievable:
+        gl.glProgramParameteri(program,
+                               gl.GL_PROGRAM_BINARY_RETRIEVABLE_HINT,
+                               gl.GL_TRUE)
+    gl.glLinkProgram(program)
+    linked = gl.glGetProgramiv(program, gl.GL_LINK_STATUS)
+    for shader in shaders:
+        gl.glDetachShader(program, shader)
+        gl.glDeleteShader(shader)
+    if not linked:
+        log = gl.glGetProgramInfoLog(program)
+        gl.glDeleteProgram(program)
+        raise RuntimeError('Shader link failure:\n%s' % log)
+    return program, t1 - t0, time.time() - t1
+
+
+class ProgramCache(object):
+
+    """
+    On-disk cache of linked shader programs for the current driver.
+
+    'stats' counts the programs that were loaded from the cache ('hits')
+    or compiled from source ('misses', of which 'rejected' had a cached
+    binary that the driver wouldn't take), and the total time (sec) spent
+    loading, compiling and linking.
+
+    Methods:
+        program(vertex, fragment, name)
+        report()
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.expanduser(cachedir if root is None else root)
+        self.driver = None
+        self.formats = None
+        self.stats = dict(hits=0, misses=0, rejected=0, load=0.,
+                          compile=0., link=0.)
+
+    def _init_driver(self):
+        # needs a current context, so we wait until the first program
+        self.driver = '\n'.join(_gl_string(name) for name in (
+            gl.GL_VENDOR, gl.GL_RENDERER, gl.GL_VERSION))
+        self.formats = set()
+        if bool(gl.glGetProgramBinary) and bool(gl.glProgramBinary):
+            nformats = int(gl.glGetIntegerv(
+                gl.GL_NUM_PROGRAM_BINARY_FORMATS))
+            if nformats:
+                # PyOpenGL doesn't know how many values to expect
+                formats = np.zeros(nformats, dtype=np.int32)
+                gl.glGetIntegerv(gl.GL_PROGRAM_BINARY_FORMATS, formats)
+                self.formats = set(formats.tolist())
+
+    def key(self, vertex, fragment):
+        md5 = hashlib.md5()
+        for part in (str(CACHE_VERSION), self.driver, vertex, fragment):
+            md5.update(part)
+            md5.update('\0')
+        return md5.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key + '.bin')
+
+    def _load(self, key):
+        """ a linked program from the cache, or None """
+        try:
+            with open(self._path(key), 'rb') as f:
+                header = f.read(HEADER.size)
+                binary = f.read()
+        except IOError:
+            return None
+        if len(header) != HEADER.size:
+            return None
+        magic, version, fmt, length = HEADER.unpack(header)
+        if (magic != MAGIC or version != CACHE_VERSION
+                or fmt not in self.formats or length != len(binary)):
+            return None
+
+        program = gl.glCreateProgram()
+        data = np.frombuffer(binary, dtype=np.uint8)
+        gl.glProgramBinary(program, fmt, data, length)
+        if not gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
+            gl.glDeleteProgram(program)
+            self.stats['rejected'] += 1
+            return None
+        return program
+
+    def _save(self, key, program):
+        length = int(gl.glGetProgramiv(program,
+                                       gl.GL_PROGRAM_BINARY_LENGTH))
+        if not length:
+            return
+        binary = np.empty(length, dtype=np.uint8)
+        written = np.zeros(1, dtype=np.int32)
+        fmt = np.zeros(1, dtype=np.uint32)
+        gl.glGetProgramBinary(program, length, written, fmt, binary)
+        nbytes = int(written[0])
+        if not nbytes:
+            return
+        try:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root)
+            # write to a temporary file first so that a crash can't leave a
+            # truncated cache entry behind
+            path = self._path(key)
+            tmp = path + '.%i.tmp' % os.getpid()
+            with open(tmp, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, CACHE_VERSION, int(fmt[0]),
+                                    nbytes))
+                f.write(binary[:nbytes].tostring())
+            os.rename(tmp, path)
+        except (IOError, OSError) as e:
+            print "Couldn't write to the shader cache: %s" % e
+
+    def program(self, vertex, fragment, name=None):
+        """
+        a linked program for the given vertex and fragment shader sources,
+        from the cache if possible
+        """
+        if self.driver is None:
+            self._init_driver()
+        name = name or 'program'
+        key = self.key(vertex, fragment)
+
+        if self.formats:
+            t0 = time.time()
+            program = self._load(key)
+            if program is not None:
+                dt = time.time() - t0
+                self.stats['hits'] += 1
+                self.stats['load'] += dt
+                print "Shader '%s': loaded from cache in %.1fms" % (
+                    name, dt * 1E3)
+                return program
+
+        program, tcompile, tlink = compile_program(
+            vertex, fragment, retrievable=bool(self.formats))
+        self.stats['misses'] += 1
+        self.stats['compile'] += tcompile
+        self.stats['link'] += tlink
+        print "Shader '%s': compiled in %.1fms, linked in %.1fms" % (
+            name, tcompile * 1E3, tlink * 1E3)
+        if self.formats:
+            self._save(key, program)
+        return program
+
+    def report(self):
+        stats = self.stats
+        return ('Shader cache: %i hits, %i misses (%i rejected); %.1fms '
+                'loading, %.1fms compiling, %.1fms linking' % (
+                    stats['hits'], stats['misses'], stats['rejected'],
+                    stats['load'] * 1E3, stats['compile'] * 1E3,
+                    stats['link'] * 1E3))
+
+
+# shared by everything in this process
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ProgramCache()
+    return _cache
+
+
+def program(vertex, fragment, name=None):
+    """ a linked program from the shared ProgramCache """
+    return get_cache().program(vertex, fragment, name)
@@ -0,0 +1,121 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+
+import numpy as np
+
+from base_tasks.clocks import VirtualClock
+
+"""
+Faster-than-real-time task simulation. A task is driven by a VirtualClock
+that is advanced by a fixed (or user-supplied) frame interval before every
+call to _display(), so an hour-long protocol can be stepped through in a
+fraction of a second, with or without a GL context.
+
+    >>> task, log = simulate(bars1, frame_hz=60.)
+    >>> task.actualstimtimes - task.theoreticalstimtimes
+"""
+
+
+class SimulationLog(object):
+
+    """
+    Per-frame record of a simulated task run. All attributes are arrays
+    with one entry per simulated frame:
+
+        time        seconds since the task started
+        frame       the scan frame the task thought it was in
+        stim        the current stimulus index (-1 before the first one)
+        photodiode  whether the photodiode trigger was on
+        drawn       whether the stimulus was drawn
+    """
+
+    fields = ('time', 'frame', 'stim', 'photodiode', 'drawn')
+
+    def __init__(self):
+        for name in self.fields:
+            setattr(self, name, [])
+
+    def record(self, task):
+        self.time.append(task.dt)
+        self.frame.append(task.currentframe)
+        self.stim.append(task.currentstim)
+        self.photodiode.append(task.photodiode_on)
+        self.drawn.append(task.stim_on_last_frame)
+
+    def finalise(self):
+        self.time = np.array(self.time, dtype=np.float64)
+        self.frame = np.array(self.frame, dtype=np.int64)
+        self.stim = np.array(self.stim, dtype=np.int64)
+        self.photodiode = np.array(self.photodiode, dtype=np.bool_)
+        self.drawn = np.array(self.drawn, dtype=np.bool_)
+        return self
+
+
+def simulate(taskcls, frame_hz=60., frame_intervals=None, draw=False,
+             canvas=None, max_time=None):
+    """
+    Step a task through its entire timeline as fast as possible.
+
+    Arguments:
+        taskcls         task class (or LazyTask) to simulate
+        frame_hz        simulated refresh rate, used if 'frame_intervals'
+                        is None
+        frame_intervals iterable of frame durations (sec), e.g. drawn from
+                        a jittered distribution. it is cycled if it runs
+                        out before the task finishes.
+        draw            if True, create the task's GL objects and draw every
+                        frame (requires a current GL context)
+        canvas          passed on to the task, if drawing to a real canvas
+        max_time        give up after this many simulated seconds (default:
+                        twice the task's finishtime, plus one second)
+
+    Returns:
+        task            the finished task instance
+        log             a SimulationLog
+    """
+
+    clock = VirtualClock()
+    task = taskcls(canvas, clock=clock, draw=draw)
+
+    if frame_intervals is None:
+        intervals = itertools.repeat(1. / frame_hz)
+    else:
+        intervals = itertools.cycle(frame_intervals)
+
+    if max_time is None:
+        max_time = 2 * task.finishtime + 1.
+
+    log = SimulationLog()
+
+    # the first call only sets the start time
+    task._display()
+
+    for interval in intervals:
+        clock.advance(interval)
+        task._display()
+        if draw:
+            task._scene.flush()
+        log.record(task)
+        if task.finished:
+            break
+        if clock() - task.starttime > max_time:
+            raise RuntimeError("Task '%s' did not finish within %g sec of "
+                               "simulated time" % (task.taskname, max_time))
+
+    return task, log.finalise()
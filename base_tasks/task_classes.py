@@ -15,8 +15,9 @@ You should have received a copy of the GNU General Public License
 along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import math
+
 import numpy as np
-import time
 
 import OpenGL
 # disable for speed?
@@ -29,9 +30,11 @@ import OpenGL.GL as gl
 if not gl.glBlendFuncSeparate:
     gl.glBlendFuncSeparate = lambda a, b, c, d: None
 
-import wx
-
-import ipdb
+from base_tasks.texture_assets import TextureSource, NoiseSequence
+from base_tasks.scene import Scene, DrawItem, Aperture
+from base_tasks.clocks import WallClock
+from base_tasks import events
+from base_tasks import shader_cache
 
 """
 ################################################################################
@@ -62,6 +65,20 @@ Conventions for stimulus orientation
 #
 # stimulus primitives
 
+def color_buffer(rgb, alpha=1.):
+    """
+    A preallocated RGBA color for _drawstim() to update in place (typically
+    just the alpha channel), rather than building a new tuple every frame.
+
+    N.B. this is deliberately a list of python floats rather than a numpy
+    array - PyOpenGL converts numpy scalars and arrays much more slowly
+    than plain floats (see testing/alloc_benchmark.py)
+    """
+    color = [float(c) for c in rgb]
+    if len(color) == 3:
+        color.append(float(alpha))
+    return color
+
 class StaticBox(object):
     """
     Literally just a quad
@@ -154,15 +171,58 @@ def get_current_bar_xy(frac, angle, radius=1, origin=(0, 0)):
     The optional 'radius' and 'origin' parameters control the length of the
     sweep and the centre point that it passes through respectively.
     """
+    # this gets called every frame, so we stick to python floats rather
+    # than creating numpy scalars
     x0, y0 = origin
-    rads = np.deg2rad(angle)
-    sx = x0 + radius * np.cos(rads + np.pi)
-    sy = y0 + radius * np.sin(rads + np.pi)
-    ex = x0 + radius * np.cos(rads)
-    ey = y0 + radius * np.sin(rads)
+    rads = math.radians(angle)
+    sx = x0 + radius * math.cos(rads + math.pi)
+    sy = y0 + radius * math.sin(rads + math.pi)
+    ex = x0 + radius * math.cos(rads)
+    ey = y0 + radius * math.sin(rads)
     return sx + frac * (ex - sx), sy + frac * (ey - sy)
 
 
+def _ease_in_out(frac, nsteps):
+    # cosine ramp, zero velocity at either end of the sweep
+    return 0.5 - 0.5 * np.cos(np.pi * frac)
+
+
+def _stepwise(frac, nsteps):
+    # apparent motion: the bar jumps between 'nsteps' evenly spaced
+    # positions, including both ends of the sweep
+    return np.minimum(np.floor(frac * nsteps), nsteps - 1) / (nsteps - 1.)
+
+# sweep profiles map the fraction of the sweep duration that has elapsed
+# onto the fraction of the distance covered. 'linear' is handled without a
+# lookup table.
+SWEEP_PROFILES = {
+    'linear': None,
+    'ease_in_out': _ease_in_out,
+    'stepwise': _stepwise,
+}
+
+
+def sweep_table(profile, nsamples=1024, nsteps=8):
+    """
+    Precompute a sweep profile (see SWEEP_PROFILES) as a lookup table of
+    'nsamples' + 1 positions (as fractions of the sweep), so that it can be
+    sampled every frame with a single index. Returns None for 'linear'.
+    """
+    try:
+        func = SWEEP_PROFILES[profile]
+    except KeyError:
+        raise ValueError("sweep_profile must be one of %s"
+                         % sorted(SWEEP_PROFILES))
+    if func is None:
+        return None
+    if profile == 'stepwise' and nsteps < 2:
+        # the bar needs at least a start and an end position to jump between
+        raise ValueError("sweep_steps must be at least 2 for a 'stepwise' "
+                         "sweep_profile (got %r)" % nsteps)
+    frac = np.linspace(0., 1., nsamples + 1)
+    return func(frac, nsteps).tolist()
+
+
 class Dot(object):
 
     """
@@ -316,6 +376,17 @@ class RectangularStencil(object):
         gl.glCallList(self.display_list)
         gl.glPopMatrix()
 
+def texel_type(texdata):
+    """
+    the GL data type to upload 'texdata' as. int16 data (see
+    texture_assets.to_snorm16) is already in GL_R16_SNORM format and can be
+    copied straight into the texture, anything else is uploaded as float.
+    """
+    if texdata.dtype == np.int16:
+        return gl.GL_SHORT
+    return gl.GL_FLOAT
+
+
 class TextureQuad2D(object):
 
     """
@@ -361,9 +432,10 @@ class TextureQuad2D(object):
                            gl.GL_TEXTURE_SWIZZLE_A, gl.GL_ONE)
         h, w = texdata.shape
 
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
         gl.glTexImage2D(
             gl.GL_TEXTURE_2D, 0, gl.GL_R16_SNORM, w, h, 0, gl.GL_LUMINANCE,
-            gl.GL_FLOAT, texdata
+            texel_type(texdata), texdata
         )
 
         # display list for the texture
@@ -468,8 +540,9 @@ class TextureQuad1D(object):
         gl.glTexParameterf(gl.GL_TEXTURE_1D,
                            gl.GL_TEXTURE_SWIZZLE_A, gl.GL_ONE)
 
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
         gl.glTexImage1D(gl.GL_TEXTURE_1D, 0, gl.GL_R16_SNORM, len(texdata),
-                        0, gl.GL_LUMINANCE, gl.GL_FLOAT, texdata)
+                        0, gl.GL_LUMINANCE, texel_type(texdata), texdata)
 
         # display list for the texture
         # --------------------------------------------------------------
@@ -528,10 +601,149 @@ class TextureQuad1D(object):
         gl.glColor4f(*color)
         gl.glCallList(self.display_list)
 
+        # the display list leaves GL_MODELVIEW selected, so we have to
+        # switch back before popping the texture matrix
+        gl.glMatrixMode(gl.GL_TEXTURE)
+
         # we pop and go BACK to the modelview matrix for safety!!!
         gl.glPopMatrix()
         gl.glMatrixMode(gl.GL_MODELVIEW)
 
+class TextureArrayQuad(object):
+
+    """
+    A quad textured with one layer of a 2D texture array, e.g. a
+    pregenerated noise sequence. All layers are uploaded to the GPU in
+    advance, so showing a different frame only means changing the value of
+    the 'layer' uniform in the shader.
+
+    Drivers limit the number of layers in one array texture
+    (GL_MAX_ARRAY_TEXTURE_LAYERS, often 2048), so longer sequences are
+    split across several, and frame 'layer' is layer 'layer % per_texture'
+    of texture 'layer // per_texture'.
+
+    Parameters:
+        frames      (nlayers, h, w) int16 (GL_R16_SNORM) array
+        rect
+        smooth
+        batch       number of layers to upload per glTexSubImage3D call
+
+    Methods:
+        draw(self,layer,color)
+    """
+
+    vshader_str = """
+    #version 130
+    // Vertex program
+    void main() {
+        gl_Position = ftransform();
+        gl_FrontColor = gl_Color;
+        gl_TexCoord[0] = gl_MultiTexCoord0;
+    }
+    """
+
+    fshader_str = """
+    #version 130
+    // Fragment program
+    uniform sampler2DArray frames;
+    uniform int layer;
+    void main() {
+        float l = texture(frames, vec3(gl_TexCoord[0].xy, layer)).r;
+        gl_FragColor = vec4(gl_Color.rgb * l, gl_Color.a);
+    }
+    """
+
+    def __init__(self, frames, rect=(-1., -1., 1., 1.), smooth=False,
+                 batch=256):
+
+        if smooth:
+            filt = gl.GL_LINEAR
+        else:
+            filt = gl.GL_NEAREST
+
+        nlayers, h, w = frames.shape
+        maxlayers = int(gl.glGetIntegerv(gl.GL_MAX_ARRAY_TEXTURE_LAYERS))
+        self.per_texture = min(maxlayers, nlayers) if maxlayers else nlayers
+        self.textures = []
+
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        for first in xrange(0, nlayers, self.per_texture):
+            last = min(first + self.per_texture, nlayers)
+
+            # build the texture
+            texture = gl.glGenTextures(1)
+            gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, texture)
+            gl.glTexParameterf(gl.GL_TEXTURE_2D_ARRAY,
+                               gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+            gl.glTexParameterf(gl.GL_TEXTURE_2D_ARRAY,
+                               gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+            gl.glTexParameterf(gl.GL_TEXTURE_2D_ARRAY,
+                               gl.GL_TEXTURE_MAG_FILTER, filt)
+            gl.glTexParameterf(gl.GL_TEXTURE_2D_ARRAY,
+                               gl.GL_TEXTURE_MIN_FILTER, filt)
+
+            # allocate storage for all of its layers, then fill it in
+            # batches straight from the (memory-mapped) frames
+            gl.glTexImage3D(gl.GL_TEXTURE_2D_ARRAY, 0, gl.GL_R16_SNORM, w,
+                            h, last - first, 0, gl.GL_RED, gl.GL_SHORT, None)
+            for start in xrange(first, last, batch):
+                stop = min(start + batch, last)
+                gl.glTexSubImage3D(gl.GL_TEXTURE_2D_ARRAY, 0, 0, 0,
+                                   start - first, w, h, stop - start,
+                                   gl.GL_RED, gl.GL_SHORT,
+                                   np.ascontiguousarray(frames[start:stop]))
+            self.textures.append(texture)
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, 0)
+
+        self.program = shader_cache.program(self.vshader_str,
+                                            self.fshader_str,
+                                            'texture array')
+        self.layer_location = gl.glGetUniformLocation(self.program, 'layer')
+        gl.glUseProgram(self.program)
+        gl.glUniform1i(gl.glGetUniformLocation(self.program, 'frames'), 0)
+        gl.glUseProgram(0)
+
+        # display list for the quad
+        # --------------------------------------------------------------
+        display_list = gl.glGenLists(1)
+        gl.glNewList(display_list, gl.GL_COMPILE)
+
+        gl.glEnable(gl.GL_BLEND)
+        gl.glBlendFuncSeparate(gl.GL_SRC_ALPHA, gl.GL_ONE,
+                               gl.GL_ONE, gl.GL_ZERO)
+
+        x0, y0, x1, y1 = rect
+
+        gl.glBegin(gl.GL_QUADS)
+        gl.glTexCoord2f(0, 1)
+        gl.glVertex2f(x0, y1)
+        gl.glTexCoord2f(0, 0)
+        gl.glVertex2f(x0, y0)
+        gl.glTexCoord2f(1, 0)
+        gl.glVertex2f(x1, y0)
+        gl.glTexCoord2f(1, 1)
+        gl.glVertex2f(x1, y1)
+        gl.glEnd()
+
+        gl.glDisable(gl.GL_BLEND)
+
+        gl.glEndList()
+        # --------------------------------------------------------------
+
+        self.display_list = display_list
+
+    def draw(self, layer=0, color=(1., 1., 1., 1.)):
+        """ draw the quad textured with the given layer """
+        texture = layer // self.per_texture
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, self.textures[texture])
+        gl.glUseProgram(self.program)
+        gl.glUniform1i(self.layer_location,
+                       layer - texture * self.per_texture)
+        gl.glColor4f(*color)
+        gl.glCallList(self.display_list)
+        gl.glUseProgram(0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D_ARRAY, 0)
+
 #
 # base class
 
@@ -541,25 +753,62 @@ class Task(object):
     """
     Base class for all tasks.
 
+    'clock' is a callable returning the current time in seconds (see
+    base_tasks.clocks), by default the wall clock. If 'draw' is False no GL
+    objects are created and nothing is drawn, but the task still steps
+    through its timeline, so that it can be simulated without a canvas.
+
+    Lifecycle events (see base_tasks.events) are published to 'bus', by
+    default the canvas master's 'eventbus'.
+
+    _display() and _drawstim() run every frame, so they should avoid
+    allocating: per-stimulus values are precomputed as python floats (see
+    _buildtimes and the '_drawargs' of the subclasses) and colors are
+    updated in place in preallocated buffers (see color_buffer).
+
     Implements:
         __init__
         _reinit
+        _schedule
+        _buildconditions
         _buildtimes
         _buildparamsdict
         _display
+        _time_to_next_stim
+        _onfinish
     """
 
     currentframe = -1
     dt = -1
     background_color = (0., 0., 0., 0.)
 
+    # extra attributes to record in the session log when the task starts
+    # (see sessionlog.py), e.g. whatever is needed to regenerate a stimulus
+    log_attrs = ()
+
     # this determines the ratio of width:height for the stimulus box
     area_aspect = 1.
 
-    def __init__(self, canvas=None):
+    def __init__(self, canvas=None, clock=None, draw=True, bus=None):
         self._canvas = canvas
+        if bus is None and canvas is not None:
+            bus = getattr(canvas.master, 'eventbus', None)
+        self._bus = bus
+        if clock is None:
+            clock = WallClock()
+        self._clock = clock
+        self._draw_enabled = draw
+        # _drawstim can submit DrawItems here rather than drawing directly;
+        # the canvas flushes the scene once _display returns
+        self._scene = Scene()
         self.starttime = -1
-        self._buildstim()
+        self._startat = None
+        self._startlag = 0.
+        self.photodiode_on = False
+        if draw:
+            self._buildstim()
+        else:
+            self._buildconditions()
         self._buildtimes()
         self._buildparamsdict()
         pass
@@ -569,8 +818,31 @@ class Task(object):
         return the stimulus to its initialised state
         """
         self.starttime = -1
+        self._startat = None
         self._buildtimes()
-        self._buildstim()
+        if self._draw_enabled:
+            self._buildstim()
+        else:
+            self._buildconditions()
+
+    def _schedule(self, t, align=True):
+        """
+        don't start until time 't' (on this task's clock). if 'align' is
+        set and we start late, the task's timeline is still anchored at
+        't' so that it finishes on time
+        """
+        self._startat = t
+        self._align = align
+
+    def _buildconditions(self):
+        """
+        compute the per-stimulus condition data (positions, orientations
+        etc.) without creating any GL objects
+        """
+        for name in ('_make_positions', '_make_orientations'):
+            method = getattr(self, name, None)
+            if method is not None:
+                method()
 
     def _buildtimes(self):
         """
@@ -589,6 +861,14 @@ class Task(object):
         self.frametimes = np.arange(0., self.finishtime, 1. / self.scan_hz)
         self.nframes = self.frametimes.size
 
+        # python float copies for the per-frame code - indexing these
+        # doesn't create a new numpy scalar every time
+        self._frametimes = self.frametimes.tolist()
+        self._ontimes = self.ontimes.tolist()
+        self._offtimes = self.offtimes.tolist()
+        # absolute start time of each stimulus
+        self._stimstarts = (self.initblanktime + self.ontimes).tolist()
+
         self.actualstimtimes = -1. * np.ones(self.nstim)
         self.finished = False
         self.dt = -1.
@@ -616,29 +896,43 @@ class Task(object):
 
         # we haven't started yet
         if self.starttime == -1:
-            self.starttime = time.time()
+            now = self._clock()
+            startat = self._startat
+            if startat is not None:
+                if now < startat:
+                    # scheduled to start later
+                    return
+                self._startlag = now - startat
+                if self._align:
+                    now = startat
+            self.starttime = now
+            if self._bus is not None:
+                self._bus.publish(events.TaskStarted(self, now))
 
         # we've started
         else:
             # time since we started
-            dt = time.time() - self.starttime
+            dt = self._clock() - self.starttime
 
             # if we haven't displayed all of the frames yet...
             if self.currentframe < (self.nframes - 1):
                 # ...and if it's after the start time of the next frame...
-                if dt > self.frametimes[self.currentframe + 1]:
+                if dt > self._frametimes[self.currentframe + 1]:
                     # ...increment the current frame
                     self.currentframe += 1
 
             # if it's before the end of the photodiode on period,
             # set the photodiode trigger on
             new_photodiode_state = (
-                dt < (self.frametimes[self.currentframe]
+                dt < (self._frametimes[self.currentframe]
                       + self.photodiodeontime)
             )
-            self._canvas.do_refresh_photodiode = (
-                self._canvas.master.show_photodiode != new_photodiode_state)
-            self._canvas.master.show_photodiode = new_photodiode_state
+            self.photodiode_on = new_photodiode_state
+            canvas = self._canvas
+            if canvas is not None:
+                canvas.do_refresh_photodiode = (
+                    canvas.master.show_photodiode != new_photodiode_state)
+                canvas.master.show_photodiode = new_photodiode_state
 
             timeafterinitblank = dt - self.initblanktime
 
@@ -648,21 +942,28 @@ class Task(object):
                 # if we haven't displayed all of the stimuli yet...
                 if self.currentstim < (self.nstim - 1):
                     # and if it's after the start time of the next stimulus...
-                    if timeafterinitblank > self.ontimes[self.currentstim + 1]:
+                    nextstim = self.currentstim + 1
+                    if timeafterinitblank > self._ontimes[nextstim]:
+                        if self.stim_on_last_frame and self._bus is not None:
+                            # no gap between this stimulus and the next
+                            self._bus.publish(events.StimOffset(
+                                self, self.currentstim, self._clock()))
                         # ...increment the current stimulus
                         self.currentstim += 1
                         self.on_flag = False
 
                 # are we in the "ON" period of this stimulus?
-                if timeafterinitblank < self.offtimes[self.currentstim]:
+                if timeafterinitblank < self._offtimes[self.currentstim]:
 
                     # do the actual drawing
                     #-------------------------------
-                    self._drawstim()
+                    if self._draw_enabled:
+                        self._drawstim()
                     #-------------------------------
 
                     # force a re-draw of the stimulus area
-                    self._canvas.do_refresh_stimbox = True
+                    if canvas is not None:
+                        canvas.do_refresh_stimbox = True
 
                     # make sure we re-draw one more time
                     # after the stimulus has finished
@@ -671,37 +972,53 @@ class Task(object):
                     # get the actual ON time for this
                     # stimulus
                     if not self.on_flag:
-                        recalcdt = time.time() - self.starttime
+                        now = self._clock()
+                        recalcdt = now - self.starttime
                         self.actualstimtimes[self.currentstim] = recalcdt
                         self.on_flag = True
+                        if self._bus is not None:
+                            self._bus.publish(events.StimOnset(
+                                self, self.currentstim, now))
 
                 elif self.stim_on_last_frame:
-                    self._canvas.do_refresh_stimbox = True
+                    if canvas is not None:
+                        canvas.do_refresh_stimbox = True
                     self.stim_on_last_frame = False
+                    if self._bus is not None:
+                        self._bus.publish(events.StimOffset(
+                            self, self.currentstim, self._clock()))
 
                 if dt > self.finishtime and not self.finished:
                     self.finished = True
-                    ctrl = self._canvas.master.controlwindow
-                    pd_checkbox = (
-                        ctrl.optionpanel.checkboxes['show_photodiode'])
-                    pd_checkbox.ref.set(False)
-                    self._canvas.master.show_photodiode = False
-                    self._canvas.do_refresh_everything = True
-                    wx.Bell()
-
-                    print "Task '%s' finished: %s" % (
-                        self.taskname, time.asctime())
-                    print("Absolute difference between "
-                          "theoretical and actual stimulus times:")
-                    print np.abs(
-                        self.actualstimtimes - self.theoreticalstimtimes)
-
-                    if not self._canvas.master.auto_start_tasks:
-                        ctrl.playlistpanel.onRunTask()
-                    ctrl.playlistpanel.Next()
+                    self.photodiode_on = False
+                    self._onfinish()
 
             self.dt = dt
 
+    def _time_to_next_stim(self):
+        """
+        seconds until the next stimulus comes on: 0 while one is being
+        drawn, inf once the last one has finished
+        """
+        if self.stim_on_last_frame:
+            return 0.
+        nextstim = self.currentstim + 1
+        if self.finished or nextstim >= self.nstim:
+            return float('inf')
+        # dt is -1 until the task has started
+        return self._stimstarts[nextstim] - max(self.dt, 0.)
+
+    def _onfinish(self):
+        """
+        called once, on the first frame after the task has finished. the
+        reaction to it (switching the photodiode off, moving on to the next
+        task) happens later, in the TaskFinished handlers
+        """
+        if self._bus is not None:
+            self._bus.publish(events.TaskFinished(
+                self, self._clock(), self.actualstimtimes.copy(),
+                self.theoreticalstimtimes.copy()))
+
 #
 # stimulus subtypes
 
@@ -713,6 +1030,7 @@ class DotFlash(Task):
 
     Implements:
         _make_positions
+        _make_drawargs
         _buildstim
         _drawstim
     """
@@ -737,19 +1055,22 @@ class DotFlash(Task):
         construct a generic flashing dot stimulus
         """
         self._make_positions()
+        self._make_drawargs()
 
         # create the dot
         self._dot = Dot(self.nvertices)
         pass
 
+    def _make_drawargs(self):
+        # (x, y, radius, color) for each stimulus
+        color = color_buffer(self.dot_color)
+        self._drawargs = [(x, y, float(self.radius), color) for x, y in
+                          zip(self.xpos.tolist(), self.ypos.tolist())]
+
     def _drawstim(self):
         # draw the dot in the current position
-        self._dot.draw(self.xpos[self.currentstim],
-                       self.ypos[self.currentstim],
-                       0.,
-                       self.radius,
-                       self.dot_color
-                       )
+        x, y, r, color = self._drawargs[self.currentstim]
+        self._dot.draw(x, y, 0., r, color)
 
 
 class WeberDotFlash(DotFlash):
@@ -759,7 +1080,7 @@ class WeberDotFlash(DotFlash):
 
     Implements:
         _make_positions
-        _drawstim
+        _make_drawargs
     """
 
     subclass = 'weber_dot_flash'
@@ -790,14 +1111,11 @@ class WeberDotFlash(DotFlash):
         self.dot_color[:, :3] = self.dot_rgb
         self.dot_color[:, 3] = l
 
-    def _drawstim(self):
-        # draw the dot in the current position
-        self._dot.draw(self.xpos[self.currentstim],
-                       self.ypos[self.currentstim],
-                       0.,
-                       self.radius,
-                       self.dot_color[self.currentstim]
-                       )
+    def _make_drawargs(self):
+        # each stimulus has its own color
+        colors = [color_buffer(c) for c in self.dot_color]
+        self._drawargs = [(x, y, float(self.radius), c) for x, y, c in
+                          zip(self.xpos.tolist(), self.ypos.tolist(), colors)]
 
 class OnOffDotFlash(DotFlash):
     """
@@ -806,7 +1124,7 @@ class OnOffDotFlash(DotFlash):
 
     Implements:
         _make_positions
-        _drawstim
+        _make_drawargs
     """
 
     subclass = 'on_off_dot_flash'
@@ -832,14 +1150,11 @@ class OnOffDotFlash(DotFlash):
         self.dot_color[:, :3] = self.dot_rgb * l[:, None]
         self.dot_color[:, 3] = 1.
 
-    def _drawstim(self):
-        # draw the dot in the current position
-        self._dot.draw(self.xpos[self.currentstim],
-                       self.ypos[self.currentstim],
-                       0.,
-                       self.radius,
-                       self.dot_color[self.currentstim]
-                       )
+    def _make_drawargs(self):
+        # each stimulus has its own color
+        colors = [color_buffer(c) for c in self.dot_color]
+        self._drawargs = [(x, y, float(self.radius), c) for x, y, c in
+                          zip(self.xpos.tolist(), self.ypos.tolist(), colors)]
 
 class MultiSizeDotFlash(DotFlash):
     """
@@ -847,7 +1162,7 @@ class MultiSizeDotFlash(DotFlash):
 
     Implements:
         _make_positions
-        _drawstim
+        _make_drawargs
     """
 
     subclass = 'multi_size_dot_flash'
@@ -873,14 +1188,12 @@ class MultiSizeDotFlash(DotFlash):
         self.ypos = y.flat[self.permutation]
         self.radius = r.flat[self.permutation]
 
-    def _drawstim(self):
-        # draw the dot in the current position
-        self._dot.draw(self.xpos[self.currentstim],
-                       self.ypos[self.currentstim],
-                       0.,
-                       self.radius[self.currentstim],
-                       self.dot_color
-                       )
+    def _make_drawargs(self):
+        # each stimulus has its own radius
+        color = color_buffer(self.dot_color)
+        self._drawargs = [(x, y, r, color) for x, y, r in
+                          zip(self.xpos.tolist(), self.ypos.tolist(),
+                              self.radius.tolist())]
 
 
 
@@ -897,33 +1210,41 @@ class FullFieldFlash(Task):
 
     def _buildstim(self):
         self._box = StaticBox()
+        self._color = color_buffer(self.fullfield_rgb)
+        self._amplitudes = self._make_amplitudes()
+
+    def _make_amplitudes(self):
+        return np.asarray(self.flash_amplitude, float).tolist()
 
     def _drawstim(self):
 
         # update the current polarity
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
+        on_dt = self.dt - self._stimstarts[self.currentstim]
         period = (1. / self.flash_hz)
-        polarity = 2. * ((on_dt % period) < (period / 2.)) - 1
-        alpha = polarity * self.flash_amplitude[self.currentstim]
+        polarity = 1. if (on_dt % period) < (period / 2.) else -1.
+        self._color[3] = polarity * self._amplitudes[self.currentstim]
 
         # draw the texture
-        self._box.draw(color=(self.fullfield_rgb + (alpha,)))
+        self._box.draw(color=self._color)
 
 class FullFieldSinusoid(FullFieldFlash):
     """
     A full field sinusoidal stimulus
     """
 
+    def _make_amplitudes(self):
+        return np.asarray(self.sinusoid_amplitude, float).tolist()
+
     def _drawstim(self):
 
         # current phase
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
-        phase = np.sin(2 * np.pi * on_dt * self.sinusoid_hz +
-                       self.phase_offset)
-        alpha = phase * self.sinusoid_amplitude[self.currentstim]
+        on_dt = self.dt - self._stimstarts[self.currentstim]
+        phase = math.sin(2 * math.pi * on_dt * self.sinusoid_hz +
+                         self.phase_offset)
+        self._color[3] = phase * self._amplitudes[self.currentstim]
 
         # draw the texture
-        self._box.draw(color=(self.fullfield_rgb + (alpha,)))
+        self._box.draw(color=self._color)
 
 class BarFlash(Task):
 
@@ -960,29 +1281,37 @@ class BarFlash(Task):
         self._bar = Bar(width=self.bar_width,
                         height=self.bar_height
                         )
+        # (x, y, angle) for each stimulus
+        self._drawargs = zip(self.xpos.tolist(), self.ypos.tolist(),
+                             self.orientation.tolist())
+        self._color = color_buffer(self.bar_rgb)
 
     def _drawstim(self):
 
         # update the current polarity
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
+        on_dt = self.dt - self._stimstarts[self.currentstim]
         period = (1. / self.flash_hz)
         is_on = (on_dt % period) < (period / 2.)
-        alpha = is_on * self.flash_amplitude
+        self._color[3] = self.flash_amplitude if is_on else 0.
 
         # draw the bar in the current position/orientation
-        self._bar.draw(self.xpos[self.currentstim],
-                       self.ypos[self.currentstim],
-                       angle=self.orientation[self.currentstim],
-                       color=self.bar_rgb + (alpha,))
+        x, y, angle = self._drawargs[self.currentstim]
+        self._bar.draw(x, y, 0., angle, self._color)
 
 
 class DriftingBar(Task):
 
     """
-    Base class for drifting bar stimuli
+    Base class for drifting bar stimuli. The start point, displacement and
+    duration of every sweep are precomputed when the stimulus is built (see
+    _make_sweeps), so that each frame only has to do a multiply-add.
+
+    'sweep_profile' controls how the bar moves along its path, see
+    SWEEP_PROFILES. 'stepwise' sweeps jump between 'sweep_steps' positions.
 
     Implements:
         _make_orientations
+        _make_sweeps
         _buildstim
         _drawstim
 
@@ -990,6 +1319,10 @@ class DriftingBar(Task):
 
     subclass = 'drifting_bar'
 
+    sweep_profile = 'linear'
+    sweep_steps = 8
+    sweep_table_size = 1024
+
     def _make_orientations(self):
 
         assert len(self.permutation) == self.nstim
@@ -1011,29 +1344,54 @@ class DriftingBar(Task):
         self._aperture = CircularStencil(nvertices=self.aperture_nvertices,
                                          polarity=1)
 
+        # the bar is drawn through the aperture
+        self._baritem = DrawItem(
+            self._bar,
+            aperture=Aperture(self._aperture, r=self.aperture_radius),
+            x=0., y=0., z=0., angle=0., color=color_buffer(self.bar_color))
+        self._make_sweeps()
+
+    def _make_sweeps(self):
+        """
+        per-stimulus (x0, y0, dx, dy, 1 / duration, angle), plus the lookup
+        table for the sweep profile
+        """
+        radius = max(1, self.area_aspect)
+        durations = np.resize(np.asarray(self.on_duration, float),
+                              len(self.orientation))
+        self._sweeps = []
+        for angle, duration in zip(self.orientation, durations):
+            angle = float(angle)
+            x0, y0 = get_current_bar_xy(0., angle, radius=radius)
+            x1, y1 = get_current_bar_xy(1., angle, radius=radius)
+            self._sweeps.append((x0, y0, x1 - x0, y1 - y0,
+                                 1. / duration, angle))
+        self._sweep_table = sweep_table(self.sweep_profile,
+                                        self.sweep_table_size,
+                                        self.sweep_steps)
+
+    def _sweep_position(self):
+        """ current (x, y, angle) of the bar """
+        x0, y0, dx, dy, rate, angle = self._sweeps[self.currentstim]
+        frac = (self.dt - self._stimstarts[self.currentstim]) * rate
+        table = self._sweep_table
+        if table is not None:
+            n = self.sweep_table_size
+            idx = int(frac * n)
+            frac = table[0 if idx < 0 else n if idx > n else idx]
+        return x0 + frac * dx, y0 + frac * dy, angle
+
     def _drawstim(self):
 
         # get the current bar position (ROTATED 90o!)
-        bar_dt = self.dt - \
-            (self.initblanktime + self.ontimes[self.currentstim])
-        frac = bar_dt / \
-            (self.offtimes[self.currentstim] - self.ontimes[self.currentstim])
-        x, y = get_current_bar_xy(frac,
-                                  self.orientation[self.currentstim],
-                                  radius=max(1, self.area_aspect))
-
-        # enable stencil test, draw the aperture to the stencil buffer
-        gl.glEnable(gl.GL_STENCIL_TEST)
-        self._aperture.draw(r=self.aperture_radius)
-
-        # draw the bar (ROTATED 90o!), disable stencil test
-        self._bar.draw(x, y, 0,
-                       angle=self.orientation[self.currentstim],
-                       color=self.bar_color
-                       )
-        gl.glDisable(gl.GL_STENCIL_TEST)
+        x, y, angle = self._sweep_position()
 
-        pass
+        # draw the bar (ROTATED 90o!) inside the aperture
+        args = self._baritem.args
+        args['x'] = x
+        args['y'] = y
+        args['angle'] = angle
+        self._scene.submit(self._baritem)
 
 class MultiSpeedBars(DriftingBar):
     """
@@ -1067,19 +1425,6 @@ class MultiSpeedBars(DriftingBar):
 
         pass
 
-    def _buildstim(self):
-
-        self._make_orientations()
-
-        self._bar = Bar(width=self.bar_width,
-                        height=self.bar_height
-                        )
-
-        self._aperture = CircularStencil(nvertices=self.aperture_nvertices,
-                                         polarity=1)
-
-        pass
-
     pass
 
 
@@ -1129,28 +1474,28 @@ class OccludedDriftingBar(DriftingBar):
             height=self.occluder_height,
             polarity=0)
 
+        # the bar is drawn everywhere except behind the occluder
+        self._occluder = Aperture(self._aperture, x=0.)
+        self._baritem = DrawItem(self._bar, aperture=self._occluder,
+                                 x=0., y=0., z=0., angle=0.,
+                                 color=color_buffer(self.bar_color))
+        self._make_sweeps()
+        self._occluder_x = [float(x0) for x0 in self.occluder_pos]
+
     def _drawstim(self):
 
         # get the current bar position (ROTATED 90o!)
-        bar_dt = self.dt - \
-            (self.initblanktime + self.ontimes[self.currentstim])
-        frac = bar_dt / \
-            (self.offtimes[self.currentstim] - self.ontimes[self.currentstim])
-        x, y = get_current_bar_xy(frac,
-                                  self.orientation[self.currentstim],
-                                  radius=max(1, self.area_aspect))
-
-        # enable stencil test, draw the aperture to the stencil buffer
-        gl.glEnable(gl.GL_STENCIL_TEST)
-        self._aperture.draw(x=self.occluder_pos[self.currentstim])
-
-        # draw the bar (ROTATED 90o!), disable stencil test
-        self._bar.draw(x, y, 0,
-                       angle=self.orientation[self.currentstim],
-                       color=self.bar_color)
-        gl.glDisable(gl.GL_STENCIL_TEST)
+        x, y, angle = self._sweep_position()
 
-        pass
+        # move the occluder
+        self._occluder.args['x'] = self._occluder_x[self.currentstim]
+
+        # draw the bar (ROTATED 90o!) around the occluder
+        args = self._baritem.args
+        args['x'] = x
+        args['y'] = y
+        args['angle'] = angle
+        self._scene.submit(self._baritem)
 
 
 class DriftingGrating(Task):
@@ -1186,27 +1531,26 @@ class DriftingGrating(Task):
         self._aperture = CircularStencil(nvertices=self.aperture_nvertices,
                                          polarity=1)
 
+        # the texture is drawn through the aperture
+        self._textureitem = DrawItem(
+            self._texture,
+            aperture=Aperture(self._aperture, r=self.aperture_radius),
+            offset=0., angle=0., color=color_buffer(self.grating_color))
+        self._angles = [float(a) for a in self.orientation]
+
         pass
 
     def _drawstim(self):
 
         # update the current phase angle
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
+        on_dt = self.dt - self._stimstarts[self.currentstim]
         self._phase = on_dt * (self.grating_speed / 90.)
 
-        # enable stencil test, draw the aperture to the stencil buffer
-        gl.glEnable(gl.GL_STENCIL_TEST)
-        self._aperture.draw(r=self.aperture_radius)
-
-        # draw the texture, disable stencil test
-        self._texture.draw(offset=self._phase,
-                           # correction for unit circle
-                           angle=self.orientation[self.currentstim],
-                           color=self.grating_color
-                           )
-        gl.glDisable(gl.GL_STENCIL_TEST)
-
-        pass
+        # draw the texture inside the aperture
+        args = self._textureitem.args
+        args['offset'] = self._phase
+        args['angle'] = self._angles[self.currentstim]
+        self._scene.submit(self._textureitem)
 
 
 class DriftingSinusoid(DriftingGrating):
@@ -1278,32 +1622,29 @@ class MultiSpeedSquarewave(DriftingSquarewave):
 
         self.orientation = ori.flat[self.permutation]
         self.speed = speed.flat[self.permutation]
+        self._speeds = (self.speed / 90.).tolist()
 
         pass
 
     def _drawstim(self):
 
         # update the current phase angle
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
-        self._phase = on_dt * (self.speed[self.currentstim] / 90.)
+        on_dt = self.dt - self._stimstarts[self.currentstim]
+        self._phase = on_dt * self._speeds[self.currentstim]
 
-        # enable stencil test, draw the aperture to the stencil buffer
-        gl.glEnable(gl.GL_STENCIL_TEST)
-        self._aperture.draw(r=self.aperture_radius)
-
-        # draw the texture, disable stencil test
-        self._texture.draw(offset=self._phase,
-                           # correction for unit circle
-                           angle=self.orientation[self.currentstim],
-                           color=self.grating_color
-                           )
-        gl.glDisable(gl.GL_STENCIL_TEST)
+        # draw the texture inside the aperture
+        args = self._textureitem.args
+        args['offset'] = self._phase
+        args['angle'] = self._angles[self.currentstim]
+        self._scene.submit(self._textureitem)
 
     pass
 
 class FlashingTexture(Task):
     """
-    Very basic class for flashing texture stimuli
+    Very basic class for flashing texture stimuli. The texture comes from
+    'texture_source' (a TextureSource, loaded when the stimulus is built)
+    if it is defined, otherwise from '_texdata'.
 
     Implements:
         _make_texdata
@@ -1312,19 +1653,21 @@ class FlashingTexture(Task):
     """
 
     subclass = 'flashing_texture'
+    texture_source = None
 
     def _make_texdata(self):
-        # raise NotImplementedError('Override me in a subclass!')
-        pass
+        if self.texture_source is not None:
+            self._texdata = self.texture_source.load()
 
     def _buildstim(self):
         self._make_texdata()
         self._texture = TextureQuad2D(texdata=self._texdata,
                                       rect=(-1, -1, 1, 1))
+        self._color = color_buffer(self.texture_color)
 
     def _drawstim(self):
         # draw the texture
-        self._texture.draw(color=self.texture_color)
+        self._texture.draw(color=self._color)
 
 def rectwave(t, period=10, duty_cycle=0.5):
     return (t % period) <= period * duty_cycle
@@ -1352,26 +1695,99 @@ class FlashingCheckerboard(FlashingTexture):
         self._make_texdata()
         self._texture = TextureQuad2D(texdata=self._texdata,
                                       rect=(-1, -1, 1, 1), smooth=False)
+        self._color = color_buffer(self.checker_rgb)
+        self._amplitudes = self._make_amplitudes()
+
+    def _make_amplitudes(self):
+        return np.asarray(self.flash_amplitude, float).tolist()
+
     def _drawstim(self):
 
         # update the current polarity
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
+        on_dt = self.dt - self._stimstarts[self.currentstim]
         period = (1. / self.flash_hz)
-        polarity = 2. * ((on_dt % period) < (period / 2.)) - 1
-        alpha = polarity * self.flash_amplitude[self.currentstim]
+        polarity = 1. if (on_dt % period) < (period / 2.) else -1.
+        self._color[3] = polarity * self._amplitudes[self.currentstim]
 
         # draw the texture
-        self._texture.draw(color=(self.checker_rgb + (alpha,)))
+        self._texture.draw(color=self._color)
 
 class SinusoidCheckerboard(FlashingCheckerboard):
 
+    def _make_amplitudes(self):
+        return np.asarray(self.sinusoid_amplitude, float).tolist()
+
     def _drawstim(self):
 
         # current phase
-        on_dt = self.dt - (self.initblanktime + self.ontimes[self.currentstim])
-        phase = np.sin(2 * np.pi * on_dt * self.sinusoid_hz +
-                       self.phase_offset)
-        alpha = phase * self.sinusoid_amplitude[self.currentstim]
+        on_dt = self.dt - self._stimstarts[self.currentstim]
+        phase = math.sin(2 * math.pi * on_dt * self.sinusoid_hz +
+                         self.phase_offset)
+        self._color[3] = phase * self._amplitudes[self.currentstim]
+
+        # draw the texture
+        self._texture.draw(color=self._color)
+
+
+class NoiseTexture(Task):
+    """
+    White noise for receptive field mapping. Each stimulus epoch shows
+    'on_duration * noise_hz' consecutive frames of a noise sequence that
+    is generated in advance (see texture_assets.NoiseSequence) and
+    uploaded to a texture array when the stimulus is built.
+
+    The seed and the hash of the generated sequence are printed and stored
+    as 'noise_seed' and 'noise_sha1', and recorded in the session log along
+    with the other arguments to NoiseSequence, so the exact sequence can be
+    regenerated for reverse correlation.
+
+    needs:
+        self.noise_type ('binary', 'ternary' or 'gaussian')
+        self.gridshape
+        self.noise_hz
+        self.noise_seed
+        self.noise_color
+
+    Implements:
+        _make_frames
+        _buildstim
+        _drawstim
+    """
+
+    subclass = 'white_noise'
+
+    log_attrs = ('noise_type', 'gridshape', 'noise_nframes', 'sparseness',
+                 'noise_sigma', 'noise_seed', 'noise_sha1')
+
+    sparseness = 1.
+    noise_sigma = 0.5
+    _noise = None
+
+    def _make_frames(self):
+        self.frames_per_stim = int(np.ceil(self.on_duration * self.noise_hz))
+        self.noise_nframes = self.nstim * self.frames_per_stim
+        sequence = NoiseSequence(self.noise_type, self.gridshape,
+                                 self.noise_nframes, self.sparseness,
+                                 self.noise_sigma, self.noise_seed)
+        self._frames = sequence.load()
+        self.noise_path = sequence.path
+        self.noise_sha1 = sequence.sha1
+        print "Noise sequence for '%s': seed=%i, sha1=%s" % (
+            self.taskname, self.noise_seed, self.noise_sha1)
+
+    def _buildstim(self):
+        # the noise texture doesn't change, so only upload it once
+        if self._noise is None:
+            self._make_frames()
+            self._noise = TextureArrayQuad(self._frames,
+                                           rect=(-1, -1, 1, 1))
+        self._color = color_buffer(self.noise_color)
+
+    def _drawstim(self):
+        # which frame of the current epoch are we on?
+        on_dt = self.dt - self._stimstarts[self.currentstim]
+        frame = min(int(on_dt * self.noise_hz), self.frames_per_stim - 1)
+        layer = self.currentstim * self.frames_per_stim + frame
 
         # draw the texture
-        self._texture.draw(color=(self.checker_rgb + (alpha,)))
\ No newline at end of file
+        self._noise.draw(layer, color=self._color)
@@ -0,0 +1,295 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import inspect
+import hashlib
+
+import numpy as np
+
+# bump this if the conversion below changes, so that old cache entries are
+# no longer used
+CACHE_VERSION = 1
+
+# where the preprocessed textures live
+cachedir = '~/.tadpydoodle/texture_cache'
+
+SNORM16_MAX = 32767
+
+
+def to_snorm16(data):
+    """
+    Convert floating point texture data in the range [-1, 1] to the int16
+    representation of GL_R16_SNORM, so that it can be uploaded as GL_SHORT
+    without any conversion by the driver
+    """
+    data = np.clip(data, -1., 1.) * SNORM16_MAX
+    return np.ascontiguousarray(np.round(data).astype(np.int16))
+
+
+def read_image(path):
+    """ read a .npy array or an image file as a floating point array """
+    if os.path.splitext(path)[1].lower() == '.npy':
+        return np.load(path)
+    # only needed for image files, so we import it here
+    from matplotlib import image
+    img = image.imread(path)
+    if img.ndim == 3:
+        # convert RGB(A) to luminance
+        img = img[..., :3].mean(2)
+    return img
+
+
+def _function_source(func):
+    """ something that changes whenever the body of 'func' does """
+    try:
+        return inspect.getsource(func)
+    except (IOError, TypeError):
+        code = func.func_code
+        return code.co_code + repr(code.co_consts)
+
+
+class TextureSource(object):
+
+    """
+    Declares where a task's texture data comes from, either a file (an
+    image or a .npy array) or a generator function that returns a 1D or 2D
+    array. Nothing is read or computed until load() is called (normally in
+    the task's _buildstim), so declaring a texture as a class attribute
+    costs nothing at import time.
+
+    The data is converted once to the format we upload to the GPU (int16
+    GL_R16_SNORM) and the result is cached on disk in 'cachedir' as a .npy
+    file, keyed by a hash of the file contents or the generator source and
+    parameters.
+
+    Parameters:
+        path        path to the source file
+        generator   function returning the texture data
+        params      dict of keyword arguments for 'generator'
+        normalise   rescale the data to [0, 1] before converting
+        flipud      flip the data along the row dimension
+
+    Methods:
+        key()
+        load()
+    """
+
+    def __init__(self, path=None, generator=None, params=None,
+                 normalise=False, flipud=False):
+        if (path is None) == (generator is None):
+            raise ValueError("Specify exactly one of 'path' or 'generator'")
+        self.path = path
+        self.generator = generator
+        self.params = params or {}
+        self.normalise = normalise
+        self.flipud = flipud
+        self._data = None
+
+    def key(self):
+        """ content hash identifying the preprocessed texture """
+        h = hashlib.sha1()
+        h.update(repr((CACHE_VERSION, self.normalise, self.flipud)))
+        if self.path is not None:
+            path = os.path.expanduser(self.path)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 16), ''):
+                    h.update(chunk)
+        else:
+            h.update(self.generator.__module__)
+            h.update(self.generator.__name__)
+            h.update(_function_source(self.generator))
+            h.update(repr(sorted(self.params.items())))
+        return h.hexdigest()
+
+    def _compute(self):
+        if self.path is not None:
+            data = read_image(os.path.expanduser(self.path))
+        else:
+            data = self.generator(**self.params)
+        data = np.asarray(data, dtype=np.float64)
+        if self.normalise:
+            data = (data - data.min()) / data.ptp()
+        if self.flipud:
+            data = np.flipud(data)
+        return to_snorm16(data)
+
+    def load(self):
+        """
+        Return the ready-to-upload int16 texture data, from memory, the
+        on-disk cache or by computing it (in that order of preference)
+        """
+        if self._data is not None:
+            return self._data
+
+        root = os.path.expanduser(cachedir)
+        path = os.path.join(root, self.key() + '.npy')
+        try:
+            data = np.load(path)
+        except (IOError, ValueError):
+            data = self._compute()
+            if not os.path.exists(root):
+                os.makedirs(root)
+            # write to a temporary file first so that a crash can't leave a
+            # truncated cache entry behind
+            tmp = path + '.%i.tmp' % os.getpid()
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.rename(tmp, path)
+
+        self._data = data
+        return data
+
+
+#
+# pregenerated noise sequences
+
+NOISE_TYPES = ('binary', 'ternary', 'gaussian')
+
+
+def noise_chunk(noise_type, shape, sparseness, sigma, seed, chunk):
+    """
+    Generate one chunk of noise frames with shape 'shape' (nframes, ny, nx)
+    as floats in [-1, 1].
+
+    Every chunk gets its own generator seeded with (seed, chunk), so the
+    sequence is the same however it is split up between processes.
+    """
+    gen = np.random.RandomState([seed, chunk])
+    if noise_type == 'binary':
+        frames = 2. * gen.randint(0, 2, shape) - 1.
+    elif noise_type == 'ternary':
+        frames = gen.randint(-1, 2, shape).astype(np.float64)
+    elif noise_type == 'gaussian':
+        frames = np.clip(gen.standard_normal(shape) * sigma, -1., 1.)
+    else:
+        raise ValueError("noise_type must be one of %s" % (NOISE_TYPES,))
+    if sparseness < 1.:
+        # only a fraction of the checks differ from the background
+        frames *= gen.random_sample(shape) < sparseness
+    return frames
+
+
+def _write_noise_chunk(args):
+    """ worker function, fills in one chunk of a memory-mapped sequence """
+    path, noise_type, sparseness, sigma, seed, chunk, start, stop = args
+    frames = np.load(path, mmap_mode='r+')
+    frames[start:stop] = to_snorm16(
+        noise_chunk(noise_type, (stop - start,) + frames.shape[1:],
+                    sparseness, sigma, seed, chunk))
+    frames.flush()
+    del frames
+
+
+class NoiseSequence(object):
+
+    """
+    A sequence of white noise frames that is generated once, up front, and
+    stored on disk in 'cachedir' as a memory-mapped int16 .npy file. The
+    file is keyed by the generation parameters, so an identical sequence is
+    only ever generated once.
+
+    Frames are generated in chunks of 'chunk_frames' with vectorised numpy.
+    Sequences with more than 'pool_threshold' elements are generated in a
+    process pool.
+
+    Parameters:
+        noise_type  'binary' (+/-1), 'ternary' (-1, 0, 1) or 'gaussian'
+        gridshape   (nx, ny) number of checks
+        nframes     number of frames in the sequence
+        sparseness  fraction of checks that differ from the background in
+                    each frame (1 == dense)
+        sigma       standard deviation for gaussian noise
+        seed        random seed
+
+    Methods:
+        load()
+    """
+
+    chunk_frames = 1000
+    pool_threshold = 50000000
+
+    def __init__(self, noise_type, gridshape, nframes, sparseness=1.,
+                 sigma=0.5, seed=0):
+        if noise_type not in NOISE_TYPES:
+            raise ValueError("noise_type must be one of %s" % (NOISE_TYPES,))
+        self.noise_type = noise_type
+        self.gridshape = tuple(gridshape)
+        self.nframes = int(nframes)
+        self.sparseness = float(sparseness)
+        self.sigma = float(sigma)
+        self.seed = int(seed)
+        self.sha1 = None
+
+    def key(self):
+        return hashlib.sha1(repr((
+            CACHE_VERSION, self.noise_type, self.gridshape, self.nframes,
+            self.sparseness, self.sigma, self.seed))).hexdigest()
+
+    def _generate(self, path):
+        nx, ny = self.gridshape
+        frames = np.lib.format.open_memmap(
+            path, mode='w+', dtype=np.int16, shape=(self.nframes, ny, nx))
+        del frames
+
+        starts = range(0, self.nframes, self.chunk_frames)
+        jobs = [(path, self.noise_type, self.sparseness, self.sigma,
+                 self.seed, ii, start,
+                 min(start + self.chunk_frames, self.nframes))
+                for ii, start in enumerate(starts)]
+
+        if self.nframes * nx * ny > self.pool_threshold:
+            import multiprocessing
+            import realtime
+            # workers shouldn't compete with the renderer for its CPUs
+            pool = multiprocessing.Pool(initializer=realtime.release)
+            try:
+                pool.map(_write_noise_chunk, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _write_noise_chunk(job)
+
+    def load(self):
+        """
+        Return the sequence as a read-only memory-mapped (nframes, ny, nx)
+        int16 array, generating it first if necessary. Also sets
+        'self.path' and 'self.sha1' (the hash of the file contents).
+        """
+        root = os.path.expanduser(cachedir)
+        if not os.path.exists(root):
+            os.makedirs(root)
+        path = os.path.join(root, 'noise_' + self.key() + '.npy')
+        hashpath = path + '.sha1'
+
+        if not (os.path.exists(path) and os.path.exists(hashpath)):
+            tmp = path + '.%i.tmp' % os.getpid()
+            self._generate(tmp)
+            h = hashlib.sha1()
+            with open(tmp, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), ''):
+                    h.update(chunk)
+            os.rename(tmp, path)
+            with open(hashpath, 'w') as f:
+                f.write(h.hexdigest())
+
+        with open(hashpath, 'r') as f:
+            self.sha1 = f.read().strip()
+        self.path = path
+        return np.load(path, mmap_mode='r')
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import task_index as ti
+import manifest
+import sessionlog
+
+"""
+Stimulus design matrices aligned to the imaging (scan) frames.
+
+For each task run, entry (frame, condition) of the design matrix is the
+fraction of scan frame 'frame' (1 / scan_hz long) during which a stimulus
+of that condition was on screen. Onsets are the recorded ones
+(actualstimtimes) where we have them and the theoretical ones otherwise,
+and every stimulus lasts 'on_duration'. Runs are concatenated back to back
+along the frame axis, i.e. as if each run were its own acquisition and
+the time between runs didn't exist. To keep one continuous timeline
+instead, from_log(gaps=True) inserts empty frames (run -1) for the time
+between the runs in a log. Each (taskname, condition) pair gets its own
+column, so repeats of a task share columns.
+
+A stimulus' condition is its entry in 'permutation' (an index into the
+task's full set of conditions), or else the distinct combinations of its
+per-stimulus parameters (xpos, orientation etc.).
+
+We also keep, for every frame, the run and the stimulus that was on for
+most of it, and the values of the per-stimulus parameters (nan if
+nothing was on).
+
+The matrix is saved in COO form in a compressed .npz (see save()):
+
+    row, col, data, shape           the design matrix
+    column_task, column_condition   what each column is
+    frame_run, frame_taskframe, frame_stim
+    param_<name>                    per-frame stimulus parameters
+    run_task, run_first_frame, run_nframes, run_scan_hz, run_actual
+
+From a session log (finished runs only) or a playlist (theoretical onsets):
+
+    $ python design_matrix.py ~/.tadpydoodle/logs/20131004-101500 -o dm.npz
+    $ python design_matrix.py ~/.tadpydoodle/logs/20131004-101500 --gaps \
+        -o dm.npz
+    $ python design_matrix.py --playlist experiment.tadplay -o dm.npz
+"""
+
+# per-stimulus arrays that are timings, not parameters
+TIMING_ATTRS = ('ontimes', 'offtimes', 'theoreticalstimtimes',
+                'actualstimtimes', 'permutation')
+
+
+def stim_params(task):
+    """ {name: float array} of the numeric per-stimulus parameters """
+    nstim = task.nstim
+    params = {}
+    for name, value in task.paramsdict.iteritems():
+        if name in TIMING_ATTRS or not isinstance(
+                value, (np.ndarray, list, tuple)):
+            continue
+        if len(value) != nstim:
+            continue
+        value = np.asarray(value)
+        if value.ndim == 1 and value.dtype.kind in 'biuf':
+            params[name] = value.astype(np.float64)
+    return params
+
+
+def stimulus_conditions(task, params=None):
+    """ (condition of each stimulus, number of conditions) """
+    nstim = task.nstim
+    permutation = getattr(task, 'permutation', None)
+    if permutation is not None and len(permutation) == nstim:
+        conditions = np.asarray(permutation, dtype=np.int64)
+        full = getattr(task, 'fullpermutation', None)
+        nconditions = len(full) if full is not None \
+            else int(conditions.max()) + 1
+        return conditions, nconditions
+    if params is None:
+        params = stim_params(task)
+    if not params:
+        return np.zeros(nstim, dtype=np.int64), 1
+    table = np.column_stack([params[name] for name in sorted(params)])
+    unique, conditions = np.unique(table, axis=0, return_inverse=True)
+    return conditions.astype(np.int64), unique.shape[0]
+
+
+def frame_overlaps(onsets, offsets, scan_hz, nframes):
+    """
+    (frame, stimulus, fraction) for every scan frame that overlaps a
+    stimulus' [onset, offset) interval, all vectorised
+    """
+    onsets = np.asarray(onsets, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.float64)
+    first = np.clip(np.floor(onsets * scan_hz).astype(np.int64),
+                    0, nframes)
+    last = np.clip(np.ceil(offsets * scan_hz).astype(np.int64),
+                   0, nframes)
+    counts = np.maximum(last - first, 0)
+
+    stim = np.repeat(np.arange(onsets.size), counts)
+    blockstart = np.cumsum(counts) - counts
+    frames = first[stim] + np.arange(stim.size) - blockstart[stim]
+
+    # overlap of [k, k + 1) / scan_hz with [onset, offset)
+    framestart = frames / float(scan_hz)
+    frameend = (frames + 1) / float(scan_hz)
+    overlap = (np.minimum(frameend, offsets[stim])
+               - np.maximum(framestart, onsets[stim])) * scan_hz
+    keep = overlap > 0
+    return frames[keep], stim[keep], overlap[keep]
+
+
+class DesignMatrix(object):
+
+    """
+    Builds a design matrix from a sequence of task runs.
+
+    Methods:
+        add_run(task, actualstimtimes, theoreticalstimtimes, nframes,
+                scan_hz)
+        add_gap(nframes)
+        arrays()
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.column_task = []
+        self.column_condition = []
+        self.rows, self.cols, self.data = [], [], []
+        self.frame_run, self.frame_taskframe, self.frame_stim = [], [], []
+        self.frame_params = []
+        self.runs = []
+        self.nframes = 0
+
+    def _column_offset(self, taskname, nconditions):
+        if taskname not in self.columns:
+            self.columns[taskname] = len(self.column_task)
+            self.column_task.extend([taskname] * nconditions)
+            self.column_condition.extend(range(nconditions))
+        return self.columns[taskname]
+
+    def add_run(self, task, actualstimtimes=None, theoreticalstimtimes=None,
+                nframes=None, scan_hz=None):
+        """
+        add one run of 'task' (an instance). the timing arguments default
+        to the task's own (pass the recorded ones when the task instance
+        wasn't the one that ran), and any onsets < 0 are taken from the
+        theoretical times
+        """
+        if actualstimtimes is None:
+            actualstimtimes = task.actualstimtimes
+        if theoreticalstimtimes is None:
+            theoreticalstimtimes = task.theoreticalstimtimes
+        if nframes is None:
+            nframes = task.nframes
+        if scan_hz is None:
+            scan_hz = task.scan_hz
+        actual = np.asarray(actualstimtimes, dtype=np.float64)
+        theoretical = np.asarray(theoreticalstimtimes, dtype=np.float64)
+        recorded = actual >= 0
+        onsets = np.where(recorded, actual, theoretical)
+        offsets = onsets + task.on_duration
+
+        params = stim_params(task)
+        conditions, nconditions = stimulus_conditions(task, params)
+        column0 = self._column_offset(task.taskname, nconditions)
+
+        nframes = int(nframes)
+        frames, stim, overlap = frame_overlaps(onsets, offsets,
+                                               scan_hz, nframes)
+        self.rows.append(frames + self.nframes)
+        self.cols.append(conditions[stim] + column0)
+        self.data.append(overlap)
+
+        # the stimulus that was on for most of each frame
+        framestim = -np.ones(nframes, dtype=np.int64)
+        order = np.lexsort((overlap, frames))
+        sframes = frames[order]
+        lastof = np.append(sframes[1:] != sframes[:-1], True)
+        framestim[sframes[lastof]] = stim[order][lastof]
+        on = framestim >= 0
+        frameparams = {}
+        for name, values in params.iteritems():
+            column = np.empty(nframes)
+            column.fill(np.nan)
+            column[on] = values[framestim[on]]
+            frameparams[name] = column
+
+        self.frame_run.append(np.repeat(len(self.runs), nframes))
+        self.frame_taskframe.append(np.arange(nframes))
+        self.frame_stim.append(framestim)
+        self.frame_params.append((nframes, frameparams))
+        self.runs.append((task.taskname, self.nframes, nframes,
+                          float(scan_hz), int(recorded.sum())))
+        self.nframes += nframes
+
+    def add_gap(self, nframes):
+        """ 'nframes' empty frames, belonging to no run """
+        nframes = int(nframes)
+        if nframes <= 0:
+            return
+        self.frame_run.append(np.repeat(-1, nframes))
+        self.frame_taskframe.append(np.repeat(-1, nframes))
+        self.frame_stim.append(np.repeat(-1, nframes))
+        self.frame_params.append((nframes, {}))
+        self.nframes += nframes
+
+    def arrays(self):
+        """ everything as a dict of arrays, the contents of the .npz """
+        def cat(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts \
+                else np.zeros(0, dtype=dtype)
+
+        out = {'row': cat(self.rows, np.int64),
+               'col': cat(self.cols, np.int64),
+               'data': cat(self.data, np.float32),
+               'shape': np.array([self.nframes, len(self.column_task)]),
+               'column_task': np.array(self.column_task, dtype=str),
+               'column_condition': np.array(self.column_condition,
+                                            dtype=np.int64),
+               'frame_run': cat(self.frame_run, np.int32),
+               'frame_taskframe': cat(self.frame_taskframe, np.int32),
+               'frame_stim': cat(self.frame_stim, np.int32)}
+
+        names = sorted(set(name for _, params in self.frame_params
+                           for name in params))
+        for name in names:
+            parts = []
+            for nframes, params in self.frame_params:
+                if name in params:
+                    parts.append(params[name])
+                else:
+                    missing = np.empty(nframes)
+                    missing.fill(np.nan)
+                    parts.append(missing)
+            out['param_' + name] = cat(parts, np.float64)
+
+        if self.runs:
+            tasks, first, nframes, scan_hz, actual = zip(*self.runs)
+        else:
+            tasks, first, nframes, scan_hz, actual = (), (), (), (), ()
+        out.update(run_task=np.array(tasks, dtype=str),
+                   run_first_frame=np.array(first, dtype=np.int64),
+                   run_nframes=np.array(nframes, dtype=np.int64),
+                   run_scan_hz=np.array(scan_hz, dtype=np.float64),
+                   run_actual=np.array(actual, dtype=np.int64))
+        return out
+
+
+def save(path, design):
+    """ write a DesignMatrix (or its arrays()) to a compressed .npz """
+    if isinstance(design, DesignMatrix):
+        design = design.arrays()
+    np.savez_compressed(path, **design)
+
+
+def load(path):
+    """ the arrays saved by save(), as a dict """
+    with np.load(path) as npz:
+        return dict((key, npz[key]) for key in npz.files)
+
+
+def to_sparse(design):
+    """ the design matrix as a scipy.sparse.coo_matrix """
+    # scipy is only needed here
+    from scipy import sparse
+    return sparse.coo_matrix(
+        (design['data'], (design['row'], design['col'])),
+        shape=tuple(design['shape']))
+
+
+def from_log(path, taskdict, gaps=False):
+    """
+    a DesignMatrix of the finished task runs in a session log. the timing
+    of each run (theoretical onsets, nframes, scan_hz) is the one that was
+    logged when it started. the registered task only supplies the
+    per-stimulus parameters and conditions. if 'gaps' is True, the time
+    between the start of a run and the end of the last one added (from
+    the logged task start times, not the frames they were logged on) is
+    filled with empty frames
+    """
+    log = sessionlog.SessionLogReader(path)
+    design = DesignMatrix()
+    lastend = None
+    for run in log.runs():
+        if not run['finished']:
+            print 'Skipping unfinished run %i of "%s"' % (run['run'],
+                                                         run['taskname'])
+            continue
+        task = taskdict.get(run['taskname'])
+        if task is None:
+            print 'Skipping run %i: task "%s" is not registered' % (
+                run['run'], run['taskname'])
+            continue
+        if gaps and lastend is not None:
+            design.add_gap(round((run['starttime'] - lastend)
+                                 * run['scan_hz']))
+        design.add_run(task(draw=False), run['actualstimtimes'],
+                       run['theoreticalstimtimes'], run['nframes'],
+                       run['scan_hz'])
+        lastend = (run['starttime']
+                   + run['nframes'] / float(run['scan_hz']))
+    return design
+
+
+def from_playlist(path, taskdict):
+    """ a DesignMatrix of one pass through a playlist, theoretical onsets """
+    design = DesignMatrix()
+    for task in manifest.load(path, taskdict):
+        design.add_run(task(draw=False))
+    return design
+
+
+def registered_tasks():
+    """ the task registry, as tadpydoodle would find it """
+    root = os.path.dirname(os.path.abspath(__file__))
+    dirs = [os.path.join(root, 'base_tasks'),
+            os.path.join(root, 'user_tasks')]
+    index = ti.TaskIndex(os.path.expanduser('~/.tadpydoodle/task_index'))
+    return ti.build_taskdict(index.update(dirs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export scan-frame aligned stimulus design matrices')
+    parser.add_argument('log', nargs='?', help='session log directory')
+    parser.add_argument('--playlist', default=None,
+                        help='use a playlist (.tadplay) instead of a log')
+    parser.add_argument('--gaps', action='store_true',
+                        help='insert empty frames for the time between '
+                             'logged runs (default: concatenate them)')
+    parser.add_argument('-o', '--out', required=True, help='output .npz')
+    args = parser.parse_args(argv)
+    if (args.log is None) == (args.playlist is None):
+        parser.error('give either a session log or --playlist')
+
+    taskdict = registered_tasks()
+    if args.playlist:
+        design = from_playlist(args.playlist, taskdict)
+    else:
+        design = from_log(args.log, taskdict, args.gaps)
+    save(args.out, design)
+    print '%i runs, %i scan frames x %i conditions, %i non-zero' % (
+        len(design.runs), design.nframes, len(design.column_task),
+        sum(rows.size for rows in design.rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+"""
+Statistics for the frame time logs, all O(n) and vectorised so that they
+can cope with millions of frames. StreamingPercentiles and
+StreamingSpectrum summarise logs that are too long to hold in memory, a
+chunk at a time.
+
+The sliding windows are centred on each frame: frame ii is summarised over
+X[max(0, ii - win / 2):min(n - 1, ii + win / 2)], i.e. the same windows
+that the diagnostic plot has always used. Empty windows give nan.
+"""
+
+PERCENTILES = (50., 90., 99., 99.9)
+
+
+def window_bounds(n, win):
+    """ (start, stop) index arrays of the window around each frame """
+    ii = np.arange(n)
+    half = win // 2
+    start = np.maximum(ii - half, 0)
+    stop = np.minimum(ii + half, n - 1)
+    return start, stop
+
+
+def rolling_mean(X, win):
+    """ sliding window mean, using a cumulative sum """
+    X = np.asarray(X, dtype=np.float64)
+    start, stop = window_bounds(X.size, win)
+    csum = np.concatenate(([0.], np.cumsum(X)))
+    count = stop - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (csum[stop] - csum[start]) / count
+    mean[count <= 0] = np.nan
+    return mean
+
+
+def _van_herk(X, length, ufunc, fill):
+    """
+    ufunc.reduce over every window of 'length' consecutive elements of X
+    (van Herk / Gil-Werman): with X cut into blocks of 'length', each
+    window spans the tail of one block and the head of the next, so it is
+    the combination of a suffix and a prefix accumulation
+    """
+    n = X.size
+    nblocks = -(-n // length)
+    padded = np.empty(nblocks * length)
+    padded.fill(fill)
+    padded[:n] = X
+    blocks = padded.reshape(nblocks, length)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    nwin = n - length + 1
+    return ufunc(suffix[:nwin], prefix[length - 1:length - 1 + nwin])
+
+
+def _rolling_reduce(X, win, ufunc, fill):
+    X = np.asarray(X, dtype=np.float64)
+    n = X.size
+    out = np.empty(n)
+    out.fill(np.nan)
+    if n < 2:
+        return out
+    start, stop = window_bounds(n, win)
+    valid = stop > start
+
+    # windows cut short at the beginning are prefixes of X...
+    head = valid & (start == 0)
+    out[head] = ufunc.accumulate(X)[stop[head] - 1]
+
+    # ...those cut short at the end are suffixes of X[:n - 1]...
+    tail = valid & (start > 0) & (stop == n - 1)
+    out[tail] = ufunc.accumulate(X[n - 2::-1])[::-1][start[tail]]
+
+    # ...and the rest all have the full length
+    middle = valid & ~head & ~tail
+    if np.any(middle):
+        length = 2 * (win // 2)
+        out[middle] = _van_herk(X, length, ufunc, fill)[start[middle]]
+    return out
+
+
+def rolling_min(X, win):
+    return _rolling_reduce(X, win, np.minimum, np.inf)
+
+
+def rolling_max(X, win):
+    return _rolling_reduce(X, win, np.maximum, -np.inf)
+
+
+def percentiles(X, q=PERCENTILES):
+    """ {'mean', 'max', 'p50', ...} summary of X """
+    X = np.asarray(X, dtype=np.float64)
+    summary = {}
+    if not X.size:
+        return summary
+    summary['mean'] = X.mean()
+    summary['max'] = X.max()
+    for qq, value in zip(q, np.percentile(X, q)):
+        summary['p%g' % qq] = value
+    return summary
+
+
+class StreamingPercentiles(object):
+
+    """
+    Approximate percentiles of a stream of positive values (e.g. frame
+    times), fed in chunks. Values are counted in log-spaced bins, so the
+    memory used doesn't grow with the stream, and each percentile is
+    within one bin width (0.4% with the defaults) of the exact one.
+
+    Methods:
+        update(X)
+        percentile(q)
+        summary(q)
+    """
+
+    def __init__(self, lo=1E-6, hi=10., nbins=4000):
+        self.edges = np.logspace(np.log10(lo), np.log10(hi), nbins + 1)
+        # plus one bin each for underflow and overflow
+        self.counts = np.zeros(nbins + 2, dtype=np.int64)
+        self.n = 0
+        self.total = 0.
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, X):
+        X = np.asarray(X, dtype=np.float64).ravel()
+        if not X.size:
+            return
+        bins = np.searchsorted(self.edges, X, side='right')
+        self.counts += np.bincount(bins, minlength=self.counts.size)
+        self.n += X.size
+        self.total += X.sum()
+        self.min = min(self.min, X.min())
+        self.max = max(self.max, X.max())
+
+    def percentile(self, q):
+        if not self.n:
+            return np.nan
+        rank = np.clip(q / 100. * self.n, 1, self.n)
+        ii = np.searchsorted(np.cumsum(self.counts), rank)
+        if ii == 0:
+            return self.min
+        if ii > self.edges.size - 1:
+            return self.max
+        # geometric centre of the bin
+        value = np.sqrt(self.edges[ii - 1] * self.edges[ii])
+        return np.clip(value, self.min, self.max)
+
+    def summary(self, q=PERCENTILES):
+        """ the same summary as percentiles() """
+        summary = {}
+        if not self.n:
+            return summary
+        summary['mean'] = self.total / self.n
+        summary['max'] = self.max
+        for qq in q:
+            summary['p%g' % qq] = self.percentile(qq)
+        return summary
+
+
+class StreamingSpectrum(object):
+
+    """
+    Welch estimate of the power spectrum of a stream of values, fed in
+    chunks of any length: the stream is cut into non-overlapping segments
+    of 'nfft' values, each is detrended and Hann-windowed, and their
+    periodograms are averaged.
+
+    Methods:
+        update(X)
+        spectrum()
+    """
+
+    def __init__(self, nfft=4096):
+        self.nfft = nfft
+        self.window = np.hanning(nfft)
+        self.scale = 1. / (self.window ** 2).sum()
+        self.power = np.zeros(nfft // 2 + 1)
+        self.nsegments = 0
+        self.leftover = np.empty(0)
+
+    def update(self, X):
+        X = np.concatenate((self.leftover,
+                            np.asarray(X, dtype=np.float64).ravel()))
+        nseg = X.size // self.nfft
+        self.leftover = X[nseg * self.nfft:].copy()
+        if not nseg:
+            return
+        segments = X[:nseg * self.nfft].reshape(nseg, self.nfft)
+        segments = segments - segments.mean(1)[:, None]
+        spectra = np.fft.rfft(segments * self.window, axis=1)
+        self.power += (np.abs(spectra) ** 2).sum(0) * self.scale
+        self.nsegments += nseg
+
+    def spectrum(self):
+        """
+        (frequencies in cycles per sample, power), or empty arrays if we
+        haven't seen a whole segment yet
+        """
+        if not self.nsegments:
+            return np.empty(0), np.empty(0)
+        freqs = np.fft.rfftfreq(self.nfft)
+        return freqs, self.power / self.nsegments
+
+
+def runs(mask):
+    """
+    run-length encode the True values of a boolean mask, returning
+    (starts, lengths)
+    """
+    mask = np.asarray(mask, dtype=np.int8)
+    edges = np.diff(np.concatenate(([0], mask, [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return starts, stops - starts
+
+
+def span_collection(ax, mask, x0=0, **kwargs):
+    """
+    Shade the runs of True values in 'mask' across the full height of 'ax'
+    with one BrokenBarHCollection (rather than one axvspan per run). 'x0'
+    is the x coordinate of mask[0]. Returns the collection, or None if
+    there is nothing to shade.
+    """
+    from matplotlib.collections import BrokenBarHCollection
+    starts, lengths = runs(mask)
+    if not starts.size:
+        return None
+    collection = BrokenBarHCollection(
+        zip(starts + x0, lengths), (0, 1),
+        transform=ax.get_xaxis_transform(), **kwargs)
+    ax.add_collection(collection)
+    return collection
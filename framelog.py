@@ -0,0 +1,159 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+
+"""
+The per-frame log that the stimulus canvas keeps while 'log_framerate' is
+on, as a ring buffer in a memory-mapped file. Other processes (the live
+diagnostic plot, the control window when the renderer is separate) map the
+same file and read it without involving the renderer at all.
+
+File layout: a header of two int64s (number of frames written so far, ring
+length), followed by one column per field.
+
+There is only ever one writer, so the only synchronisation is that a frame
+is written before the count is incremented. Readers may see the oldest
+frame or two being overwritten while they copy - that doesn't matter for
+diagnostics.
+"""
+
+# (name, dtype) of each column
+FIELDS = (('frametimes', np.float64),   # time since the previous frame (sec)
+          ('alldraws', np.int8),        # whole scene redrawn
+          ('stimdraws', np.int8),       # stimulus area redrawn
+          ('photodraws', np.int8),      # photodiode redrawn
+          ('gcpauses', np.float64))     # time spent collecting garbage (sec)
+
+_HEADER = 16
+
+
+def _shm_dir():
+    # tmpfs if we have it, so that the pages never hit the disk
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return None
+
+
+class FrameLog(object):
+
+    """
+    A frame log in the file at 'path'. If 'nframes' is given, the file is
+    created (and deleted again by close()), otherwise an existing log is
+    opened.
+
+    Methods:
+        create(nframes)   (classmethod)
+        record_draws(alldraw, stimdraw, photodraw)
+        commit(frametime, gcpause)
+        clear()
+        snapshot()
+        close()
+    """
+
+    def __init__(self, path, nframes=None, readonly=False):
+        self.path = path
+        self.owner = nframes is not None
+        if self.owner:
+            size = _HEADER + nframes * sum(np.dtype(dtype).itemsize
+                                           for _, dtype in FIELDS)
+            self._mm = np.memmap(path, dtype=np.uint8, mode='w+',
+                                 shape=(size,))
+            self._mm[:_HEADER].view(np.int64)[:] = (0, nframes)
+        else:
+            self._mm = np.memmap(path, dtype=np.uint8,
+                                 mode='r' if readonly else 'r+')
+        header = self._mm[:_HEADER].view(np.int64)
+        self._count = header[0:1]
+        self.nframes = int(header[1])
+
+        offset = _HEADER
+        self.columns = {}
+        for name, dtype in FIELDS:
+            nbytes = self.nframes * np.dtype(dtype).itemsize
+            self.columns[name] = self._mm[offset:offset + nbytes].view(dtype)
+            offset += nbytes
+        self._frametimes = self.columns['frametimes']
+        self._alldraws = self.columns['alldraws']
+        self._stimdraws = self.columns['stimdraws']
+        self._photodraws = self.columns['photodraws']
+        self._gcpauses = self.columns['gcpauses']
+
+    @classmethod
+    def create(cls, nframes):
+        """ a new log in a temporary file """
+        fd, path = tempfile.mkstemp(prefix='tadpydoodle-framelog-',
+                                    dir=_shm_dir())
+        os.close(fd)
+        return cls(path, nframes)
+
+    @property
+    def count(self):
+        """ number of frames written since the log was last cleared """
+        return int(self._count[0])
+
+    def __len__(self):
+        return min(self.count, self.nframes)
+
+    def record_draws(self, alldraw, stimdraw, photodraw):
+        """ what was redrawn in the current frame """
+        ii = self._count[0] % self.nframes
+        self._alldraws[ii] = alldraw
+        self._stimdraws[ii] = stimdraw
+        self._photodraws[ii] = photodraw
+
+    def commit(self, frametime, gcpause):
+        """ finish the current frame and move on to the next one """
+        ii = self._count[0] % self.nframes
+        self._frametimes[ii] = frametime
+        self._gcpauses[ii] = gcpause
+        self._count[0] += 1
+
+    def clear(self):
+        self._count[0] = 0
+
+    def snapshot(self):
+        """
+        (first, columns): copies of the logged frames in chronological
+        order, as a dict of {name: array}, and the index of the first one
+        since the log was cleared
+        """
+        count = self.count
+        n = min(count, self.nframes)
+        ii = count % self.nframes
+        columns = {}
+        for name, column in self.columns.iteritems():
+            if count <= self.nframes:
+                columns[name] = column[:n].copy()
+            else:
+                columns[name] = np.concatenate((column[ii:], column[:ii]))
+        return count - n, columns
+
+    def close(self):
+        """ unmap the file, and delete it if we created it """
+        if self._mm is None:
+            return
+        self._mm = None
+        self.columns = {}
+        if self.owner:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
@@ -0,0 +1,157 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import gc
+import time
+
+"""
+Control over when the cyclic garbage collector runs. Set 'gc_mode' in the
+[stimulus] section of the config file:
+
+    auto        the normal python behaviour - collections happen whenever
+                the allocation thresholds are crossed, including in the
+                middle of a stimulus
+    deferred    automatic collection is switched off while a task is
+                running. the young generations are collected during blank
+                periods that are long enough (see GCControl.min_headroom),
+                and everything is collected when the task stops
+    disabled    automatic collection is switched off while a task is
+                running, and we only collect when it stops
+
+The full collection happens once per task, in the gap between tasks: the
+canvas calls task_stopped() as soon as a task finishes, and task_started()
+then skips its own collection unless something has run since.
+
+In every mode, the time spent in each collection is accumulated so that it
+can be logged alongside the frame that it delayed. On python >= 3.3 this
+includes automatic collections (via gc.callbacks); otherwise only the
+collections that we trigger ourselves are timed.
+"""
+
+GC_MODES = ('auto', 'deferred', 'disabled')
+
+
+class GCControl(object):
+
+    """
+    Methods:
+        task_started(mode)
+        task_stopped()
+        idle(headroom)
+        pop_pause()
+    """
+
+    # only collect in a blank period if the next stimulus is at least this
+    # far away (sec)
+    min_headroom = 0.1
+
+    def __init__(self, mode='auto'):
+        self.mode = 'auto'
+        self.running = False
+        # True between a task_stopped() collection and the next task
+        self.clean = False
+        self.pause = 0.
+        self.ncollections = 0
+        self._t0 = None
+        self.have_callbacks = hasattr(gc, 'callbacks')
+        if self.have_callbacks:
+            gc.callbacks.append(self._callback)
+        self.set_mode(mode)
+
+    def set_mode(self, mode):
+        if mode not in GC_MODES:
+            raise ValueError("gc_mode must be one of %s" % (GC_MODES,))
+        self.mode = mode
+
+    def _callback(self, phase, info):
+        # called by the interpreter around every collection (python >= 3.3)
+        if phase == 'start':
+            self._t0 = time.time()
+        elif self._t0 is not None:
+            self.pause += time.time() - self._t0
+            self.ncollections += 1
+            self._t0 = None
+
+    def collect(self, generation=2):
+        """ run a collection, timing it if gc.callbacks can't """
+        if self.have_callbacks:
+            return gc.collect(generation)
+        t0 = time.time()
+        n = gc.collect(generation)
+        self.pause += time.time() - t0
+        self.ncollections += 1
+        return n
+
+    def task_started(self, mode=None):
+        """
+        Called when a task starts running. In 'deferred' and 'disabled'
+        modes we clear out any garbage now, unless task_stopped() already
+        did in the gap before this task, then switch off automatic
+        collection.
+        """
+        if mode is not None:
+            self.set_mode(mode)
+        self.running = True
+        clean, self.clean = self.clean, False
+        if self.mode == 'auto':
+            return
+        if not clean:
+            self.collect()
+        # objects that survive the full collection won't be looked at
+        # again by the young generation collections we do between stimuli
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        gc.disable()
+
+    def task_stopped(self):
+        """ called in the gap after a task stops """
+        if not self.running:
+            return
+        self.running = False
+        if self.mode == 'auto':
+            return
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        self.collect()
+        self.clean = True
+        gc.enable()
+
+    def idle(self, headroom):
+        """
+        Called on frames where no stimulus is being drawn. 'headroom' is the
+        time (sec) until the next stimulus is due to come on. In 'deferred'
+        mode, if that is long enough we collect whichever generations have
+        crossed their thresholds, just as the automatic collector would.
+        """
+        if not self.running or self.mode != 'deferred':
+            return
+        if headroom < self.min_headroom:
+            return
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        generation = -1
+        for gen in xrange(3):
+            if thresholds[gen] and counts[gen] > thresholds[gen]:
+                generation = gen
+        if generation >= 0:
+            self.collect(generation)
+
+    def pop_pause(self):
+        """ time spent collecting since the last call (sec) """
+        pause = self.pause
+        self.pause = 0.
+        return pause
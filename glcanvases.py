@@ -60,9 +60,14 @@ import time
 
 import collections
 
-# disable automatic garbage collection (!)
-# import gc
-# gc.disable()
+# when the garbage collector is allowed to run is controlled by the
+# 'gc_mode' config option, see gc_control.py
+import gc_control
+import framelog
+import telemetry
+import sessionlog
+import startup
+from base_tasks import shader_cache
 
 
 class StimCanvas(GLCanvas):
@@ -109,21 +114,49 @@ class StimCanvas(GLCanvas):
         self.timer = parent.timer
 
         self.done_postinit = False
+        # see startup.py
+        self.presented = False
 
         # ring buffers
         self.max_frame_time_buffer = collections.deque(
             maxlen=self.master.framerate_window)
-        self.frametimes = collections.deque(
-            maxlen=self.master.log_nframes)
-        self.alldraws = collections.deque(
-            maxlen=self.master.log_nframes)
-        self.stimdraws = collections.deque(
-            maxlen=self.master.log_nframes)
-        self.photodraws = collections.deque(
-            maxlen=self.master.log_nframes)
+        # per-frame log, in shared memory so that it can be plotted from
+        # another process. a separate renderer logs to a file that the
+        # control process has already created
+        path = getattr(self.master, 'framelog_path', None)
+        if path is None:
+            self.framelog = framelog.FrameLog.create(self.master.log_nframes)
+        else:
+            self.framelog = framelog.FrameLog(path)
+
+        # optional live telemetry stream, see telemetry.py
+        self.telemetry = None
+        if self.master.telemetry_socket:
+            self.telemetry = telemetry.Publisher(
+                self.master.telemetry_socket, self.master.telemetry_batch)
+
+        # optional on-disk log of every frame and task, see sessionlog.py
+        self.sessionlog = None
+        if self.master.log_directory:
+            self.sessionlog = sessionlog.SessionLog(self.master.log_directory)
+
+        self.gc = gc_control.GCControl(self.master.gc_mode)
+        self.gc_task = None
 
         pass
 
+    def clear_logs(self):
+        """ empty the frame time log """
+        self.framelog.clear()
+
+    def close_logs(self):
+        """ close the frame log, telemetry stream and session log """
+        self.framelog.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+        if self.sessionlog is not None:
+            self.sessionlog.close()
+
     def postinit(self):
         """
         This is called at the start of onPaint if (not
@@ -131,9 +164,12 @@ class StimCanvas(GLCanvas):
         canvas has been created because it requires an OpenGL context!
         """
 
-        self.SetCurrent()
-        self.initFBO()
-        self.initShader()
+        profile = startup.profile
+        with profile.phase('gl init'):
+            self.SetCurrent()
+            self.initFBO()
+        with profile.phase('shader compile'):
+            self.initShader()
         self.update_gamma()
         self.makedisplaylists()
 
@@ -411,9 +447,6 @@ class StimCanvas(GLCanvas):
         }
         """
 
-        VERTEX_SHADER = shaders.compileShader(vshader_str,
-                                              gl.GL_VERTEX_SHADER)
-
         fshader_str = """
         #version 130
         // Fragment program
@@ -427,11 +460,10 @@ class StimCanvas(GLCanvas):
         }
         """
 
-        FRAGMENT_SHADER = shaders.compileShader(fshader_str,
-                                                gl.GL_FRAGMENT_SHADER)
-
-        self.gamma_shader = shaders.compileProgram(VERTEX_SHADER,
-                                                   FRAGMENT_SHADER)
+        # linked program binaries are cached on disk, so this only compiles
+        # the first time round (or after a driver update)
+        self.gamma_shader = shader_cache.program(vshader_str, fshader_str,
+                                                 'gamma')
 
         # in order to pass uniform values to the shader we need to know
         # where these values are stored within the program object. we
@@ -524,7 +556,23 @@ class StimCanvas(GLCanvas):
         """
         pass
 
+    def task_finished(self):
+        """
+        Called on the main loop once the current task has finished. Collect
+        its garbage now, in the gap before the next task, rather than in
+        the frame that draws the next task's first stimulus.
+        """
+        self.gc.task_stopped()
+
     def onDraw(self, event=None):
+        try:
+            self._drawframe()
+        finally:
+            # let the render timer know it can post another tick - even if
+            # drawing raised, or the display loop would stall for good
+            self.timer.served()
+
+    def _drawframe(self):
         """
         This is where actual OpenGL shit goes down
         """
@@ -587,6 +635,18 @@ class StimCanvas(GLCanvas):
 
             # print "refresh_stimbox: %f" %time.time()
 
+        # a task has started (or the playlist has moved on to the next one).
+        # if the last one finished, task_finished() has already collected
+        # its garbage, so neither call below collects again
+        task = self.master.current_task
+        if self.master.run_task and task is not self.gc_task:
+            self.gc.task_stopped()
+            self.gc.task_started(self.master.gc_mode)
+            self.gc_task = task
+        elif not self.master.run_task and self.gc_task is not None:
+            self.gc.task_stopped()
+            self.gc_task = None
+
         # draw the current stimulus state
         if self.master.run_task:
             gl.glPushMatrix()
@@ -606,6 +666,9 @@ class StimCanvas(GLCanvas):
 
             self.master.current_task._display()
 
+            # draw whatever the task submitted to its scene
+            self.master.current_task._scene.flush()
+
             # NB: turning off clamping is expensive, so turn it back on once
             # we're done drawing the stimulus
 
@@ -651,11 +714,16 @@ class StimCanvas(GLCanvas):
             self.do_refresh_photodiode = False
             # print "refresh_photodiode: %f" %time.time()
 
+        # what was redrawn this frame, as telemetry flags
+        drawflags = (self.everything_changed * telemetry.FLAG_ALLDRAW
+                     | self.stimbox_changed * telemetry.FLAG_STIMDRAW
+                     | self.photodiode_changed * telemetry.FLAG_PHOTODRAW)
+
         # if we're logging framerate, also record what was being redrawn
         if self.master.log_framerate:
-            self.alldraws.append(int(self.everything_changed))
-            self.stimdraws.append(int(self.stimbox_changed))
-            self.photodraws.append(int(self.photodiode_changed))
+            self.framelog.record_draws(self.everything_changed,
+                                       self.stimbox_changed,
+                                       self.photodiode_changed)
 
         # did anything change during this loop iteration?
         if (self.stimbox_changed or self.photodiode_changed
@@ -694,6 +762,10 @@ class StimCanvas(GLCanvas):
             # are made visible
             self.SwapBuffers()
 
+            if not self.presented:
+                self.presented = True
+                startup.profile.first_frame()
+
             if self.master.show_preview:
                 # draw every 'new' frame to the preview canvas
                 for listener in self.listeners:
@@ -707,6 +779,11 @@ class StimCanvas(GLCanvas):
             # either the main canvas or the preview canvas
             pass
 
+        # nothing is on screen - if the next stimulus is far enough away,
+        # this is a good time to collect garbage
+        if self.gc_task is not None and not self.gc_task.stim_on_last_frame:
+            self.gc.idle(self.gc_task._time_to_next_stim())
+
         # draw only every nth frame to the preview canvas to reduce
         # overhead
         # if not self.drawcount % self.master.preview_frequency:
@@ -719,8 +796,15 @@ class StimCanvas(GLCanvas):
         dt = now - self.currtime
 
         # benchmarking - store the frame time in a ring buffer
+        gcpause = self.gc.pop_pause()
         if self.master.log_framerate:
-            self.frametimes.append(dt)
+            self.framelog.commit(dt, gcpause)
+        if self.telemetry is not None:
+            self.telemetry.record(now, dt, gcpause, drawflags, task,
+                                  self.master.run_task)
+        if self.sessionlog is not None:
+            self.sessionlog.record(now, dt, gcpause, drawflags, task,
+                                   self.master.run_task)
         # if dt > self.slowestframe: self.slowestframe = dt
         self.max_frame_time_buffer.append(dt)
         self.slowestframe = max(self.max_frame_time_buffer)
@@ -736,9 +820,6 @@ class StimCanvas(GLCanvas):
 
         self.drawcount += 1
 
-        if self.timer.pending:
-            self.timer.pending = False
-
         # if we're running the display loop, queue another draw call
         # if self.master.run_loop:
         #   self.drawcount += 1
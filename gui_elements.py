@@ -17,10 +17,13 @@ along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
 
 import wx
 import os
+import sys
+import subprocess
 from wx.lib.mixins import listctrl as listmix
-import cPickle
 import glcanvases as glc
-reload(glc)
+import task_index as ti
+import manifest
+import realtime
 import numpy as np
 
 
@@ -29,37 +32,6 @@ def seconds2human(secs):
     return '%02d:%05.2f' % (mins, secs)
 
 
-def get_onsets_and_offsets(boolvec):
-    """ get the onset and offset indices for a boolean vector"""
-    import numpy as np
-    if not np.any(boolvec):
-        return np.array([]), np.array([])
-    diff = np.diff(boolvec)
-    if not np.any(diff > 0):
-        onsets = np.array([0])
-    else:
-        onsets = np.where(diff > 0)[0]
-        if boolvec[0]:
-            onsets = np.concatenate((np.atleast_1d(0), np.atleast_1d(onsets)))
-    if not np.any(diff < 0):
-        offsets = np.array([0])
-    else:
-        offsets = np.where(diff < 0)[0]
-        if boolvec[-1]:
-            offsets = np.concatenate(
-                (np.atleast_1d(offsets), np.atleast_1d(len(boolvec) - 1)))
-    assert len(onsets) == len(offsets)
-    return onsets, offsets
-
-
-def window_iter(X, win):
-    n = X.shape[0]
-    for ii in xrange(n):
-        start = max((0, ii - (win / 2)))
-        stop = min((n - 1, ii + (win / 2)))
-        yield X[start:stop]
-
-
 class AttributeRef(object):
 
     def __init__(self, masterobj, attrname):
@@ -73,23 +45,81 @@ class AttributeRef(object):
         self.master.__setattr__(self.attrname, value)
 
 
-class CheckListCtrl(wx.ListCtrl, listmix.CheckListCtrlMixin,
-                    listmix.ListCtrlAutoWidthMixin):
+def check_bitmap(window, checked, size=(16, 16)):
+    """ a native checkbox, as drawn by CheckListCtrlMixin """
+    bmp = wx.EmptyBitmap(*size)
+    dc = wx.MemoryDC(bmp)
+    dc.SetBackground(wx.WHITE_BRUSH)
+    dc.Clear()
+    flags = wx.CONTROL_CHECKED if checked else 0
+    wx.RendererNative.Get().DrawCheckBox(window, dc, (0, 0) + size, flags)
+    dc.SelectObject(wx.NullBitmap)
+    return bmp
+
+
+class PlaylistCtrl(wx.ListCtrl, listmix.ListCtrlAutoWidthMixin):
+
+    """
+    A virtual list control showing the playlist. Rows are drawn on demand
+    from 'items', so only the visible rows are ever rendered and editing
+    the playlist only refreshes the rows that changed. The checkbox in
+    the first column marks the current task, and clicking on it calls
+    OnCheckItem(index, True).
+    """
 
-    def __init__(self, *args, **kwargs):
-        wx.ListCtrl.__init__(self, *args, **kwargs)
-        listmix.CheckListCtrlMixin.__init__(self)
+    def __init__(self, parent, items, *args, **kwargs):
+        kwargs['style'] = kwargs.get('style', 0) | wx.LC_VIRTUAL
+        wx.ListCtrl.__init__(self, parent, *args, **kwargs)
         listmix.ListCtrlAutoWidthMixin.__init__(self)
         self.setResizeColumn(3)
+        self.items = items
         self.current_selection = 0
 
+        self.imagelist = wx.ImageList(16, 16)
+        self.unchecked = self.imagelist.Add(check_bitmap(self, False))
+        self.checked = self.imagelist.Add(check_bitmap(self, True))
+        self.SetImageList(self.imagelist, wx.IMAGE_LIST_SMALL)
+        self.Bind(wx.EVT_LEFT_DOWN, self.onLeftDown)
+
+    def OnGetItemText(self, item, col):
+        task = self.items[item]
+        if col == 1:
+            return task.taskname
+        elif col == 2:
+            return task.subclass
+        return ''
+
+    def OnGetItemImage(self, item):
+        if item == self.current_selection:
+            return self.checked
+        return self.unchecked
+
+    def OnCheckItem(self, index, flag):
+        pass
+
+    def onLeftDown(self, event):
+        index, flags = self.HitTest(event.GetPosition())
+        if index >= 0 and flags & wx.LIST_HITTEST_ONITEMICON:
+            self.OnCheckItem(index, True)
+        event.Skip()
+
+    def SetItems(self, items):
+        self.items = items
+        self.SetItemCount(len(items))
+        self.Refresh()
+
+    def RefreshRows(self, *indices):
+        n = len(self.items)
+        for index in indices:
+            if 0 <= index < n:
+                self.RefreshItem(index)
+
     def SetCurrent(self, index):
-        self.current_selection = index
-        self.update_selections()
+        old, self.current_selection = self.current_selection, index
+        self.RefreshRows(old, index)
 
     def update_selections(self):
-        for ii in xrange(self.GetItemCount()):
-            self.SetItemImage(ii, ii == self.current_selection)
+        self.Refresh()
 
 
 class PlaylistPanel(wx.Panel):
@@ -104,15 +134,22 @@ class PlaylistPanel(wx.Panel):
         # task box
         taskbox = wx.StaticBox(self, wx.VERTICAL, label='Tasks')
 
+        # search box for filtering the task tree
+        self.searchbox = wx.SearchCtrl(self, -1, style=wx.TE_PROCESS_ENTER)
+        self.searchbox.ShowCancelButton(True)
+        self.searchbox.Bind(wx.EVT_TEXT, self.onSearch)
+        self.searchbox.Bind(wx.EVT_SEARCHCTRL_CANCEL_BTN, self.onSearchCancel)
+
         # a tree menu of available tasks
         self.task_tree = wx.TreeCtrl(
             self, -1,
             size=(200, 100),
             style=wx.TR_DEFAULT_STYLE | wx.TR_MULTIPLE | wx.TR_HIDE_ROOT,
         )
-        self.populate_tree()
         self.task_tree.Bind(wx.EVT_TREE_SEL_CHANGING, self.onSelectChange)
+        self.task_tree.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.onTreeExpanding)
         self.task_tree.Bind(wx.EVT_LEFT_DCLICK, self.onTreeDoubleClick)
+        self.populate_tree()
 
         # playlist controls
         self.startbutton = wx.ToggleButton(self, -1)
@@ -146,6 +183,8 @@ class PlaylistPanel(wx.Panel):
 
         taskbox_sizer = wx.StaticBoxSizer(taskbox, wx.VERTICAL)
         taskbox_sizer.Add(top_sizer, 0, wx.EXPAND | wx.ALL, 5)
+        taskbox_sizer.Add(self.searchbox, 0, wx.EXPAND | wx.LEFT | wx.RIGHT
+                          | wx.BOTTOM, 5)
         taskbox_sizer.Add(self.task_tree, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
         taskbox_sizer.Add(self.importbutton, 0, wx.EXPAND | wx.ALL, 5)
 
@@ -154,15 +193,15 @@ class PlaylistPanel(wx.Panel):
 
         playbox = wx.StaticBox(self, wx.VERTICAL, label='Playlist')
 
-        # a checklistctrl that contains the playlist
-        self.playlist = CheckListCtrl(
-            self, -1, size=(200, 50), style=wx.LC_SINGLE_SEL | wx.LC_REPORT)
-        self.playlist.InsertColumn(0, '')
-        self.playlist.InsertColumn(1, 'Name')
-        self.playlist.InsertColumn(2, 'Subclass')
+        # a virtual list control that shows the playlist
         self.items = []
-        self.playlist.Arrange()
-        # bind to CheckListCtrl 'event'
+        self.playlist = PlaylistCtrl(
+            self, self.items, -1, size=(200, 50),
+            style=wx.LC_SINGLE_SEL | wx.LC_REPORT)
+        self.playlist.InsertColumn(0, '', width=24)
+        self.playlist.InsertColumn(1, 'Name', width=150)
+        self.playlist.InsertColumn(2, 'Subclass')
+        # bind to PlaylistCtrl 'event'
         self.playlist.OnCheckItem = self.on_check
 
         # playlist editing buttons and checkbox controls
@@ -218,31 +257,52 @@ class PlaylistPanel(wx.Panel):
     #-----------------------------------------------------------------------
     # tree
 
+    # expand every branch if no more than this many tasks match the search
+    expand_limit = 200
+
     def populate_tree(self):
-        taskdict = self.master.taskdict
+        # arrange the task names according to their 'subclasses'
+        self.catalog = ti.TaskCatalog(self.master.taskdict)
+        self.catalog.search(self.searchbox.GetValue())
+        self.refresh_tree()
+
+    def refresh_tree(self):
+        tree = self.task_tree
+        tree.Freeze()
 
         # clear any existing items from the tree
-        self.task_tree.DeleteAllItems()
+        tree.DeleteAllItems()
 
         # we hide this
-        root = self.task_tree.AddRoot('tasks')
-
-        # arrange the task names according to their 'subclasses'. we use a dict
-        # to keep track of the existing branches.
-        hierarchy = {}
-        for name, obj in taskdict.iteritems():
-
-            # if it's a new subclass, create a new tree branch
-            if not hierarchy.has_key(obj.subclass):
-                newbranch = self.task_tree.AppendItem(root, obj.subclass)
-                hierarchy.update({obj.subclass: newbranch})
-
-            # add the task name to an existing branch
-            self.task_tree.AppendItem(hierarchy[obj.subclass], name)
-
-        # sort each tree branch recursively
-        for item in walk_branches(self.task_tree, root):
-            self.task_tree.SortChildren(item)
+        root = tree.AddRoot('tasks')
+
+        # one branch per subclass. the task names are only added when a
+        # branch is expanded (see onTreeExpanding), or straight away if
+        # there are few enough to show them all
+        expand = len(self.catalog) <= self.expand_limit
+        for subclass in self.catalog.branches():
+            branch = tree.AppendItem(root, subclass)
+            tree.SetItemHasChildren(branch, True)
+            if expand:
+                self.fill_branch(branch)
+                tree.Expand(branch)
+        tree.Thaw()
+
+    def fill_branch(self, branch):
+        tree = self.task_tree
+        if not tree.GetChildrenCount(branch, False):
+            for taskname in self.catalog.children(tree.GetItemText(branch)):
+                tree.AppendItem(branch, taskname)
+
+    def onTreeExpanding(self, event):
+        self.fill_branch(event.GetItem())
+
+    def onSearch(self, event=None):
+        self.catalog.search(self.searchbox.GetValue())
+        self.refresh_tree()
+
+    def onSearchCancel(self, event=None):
+        self.searchbox.SetValue('')
 
     def onTreeDoubleClick(self, event):
         point = event.GetPosition()
@@ -271,7 +331,9 @@ class PlaylistPanel(wx.Panel):
             if running:
                 l, c = obj.start
                 self.master.stimcanvas.drawcount = 0
-                self.master.current_task._reinit()
+                self.master.stopSession()
+                self.master.reinitTask()
+                self.master.publishEvent('task_stopped')
                 # enable the photodiode checkbox while the task is not running
                 self.parent.optionpanel.checkboxes[
                     'show_photodiode'].Enable(True)
@@ -281,6 +343,13 @@ class PlaylistPanel(wx.Panel):
                 # grey out the photodiode checkbox while the task is running
                 self.parent.optionpanel.checkboxes[
                     'show_photodiode'].Enable(False)
+                if self.master.auto_start_tasks:
+                    # run the whole playlist on one timeline
+                    self.master.startSession(
+                        self.items, self.playlist.current_selection)
+                self.master.publishEvent(
+                    'task_started', index=self.playlist.current_selection,
+                    taskname=self.master.current_task.taskname)
 
             self.master.controlwindow.statuspanel.onUpdate()
             obj.SetValue(not running)
@@ -294,17 +363,23 @@ class PlaylistPanel(wx.Panel):
         self.master.stimcanvas.do_refresh_everything = True
 
     def onReload(self, event):
-        if self.master.run_task:
-            self.onRunTask()
-        self.master.loadTasks()
+        # discovery runs in the background, so there's no need to stop the
+        # current task
+        self.importbutton.Disable()
+        self.master.loadTasks(callback=self.onReloadDone)
+
+    def onReloadDone(self):
         self.populate_tree()
+        self.importbutton.Enable()
 
     def Append(self, task):
-        index = self.playlist.Append(['', task.taskname, task.subclass])
         self.items.append(task)
+        index = len(self.items) - 1
+        self.playlist.SetItemCount(len(self.items))
         if index == 0:
             self.on_check(index)
-        auto_resize_cols(self.playlist)
+        else:
+            self.playlist.RefreshRows(index)
 
     def Next(self, event=None):
         if not len(self.items):
@@ -340,13 +415,17 @@ class PlaylistPanel(wx.Panel):
         elif index < playing:
             playing -= 1
 
-        self.playlist.DeleteItem(index)
         self.items.pop(index)
+        self.playlist.SetItemCount(len(self.items))
+        # only the rows from 'index' down have changed
+        if index < len(self.items):
+            self.playlist.RefreshItems(index, len(self.items) - 1)
+        self.update_session(playing)
         if len(self.items):
             self.playlist.Select(0)
             self.on_check(playing)
         else:
-            self.master.current_task = None
+            self.master.setCurrentTask(None)
 
     def Up(self, event=None):
         if not len(self.items):
@@ -366,7 +445,8 @@ class PlaylistPanel(wx.Panel):
             self.playlist.SetCurrent(old)
 
         self.items[old], self.items[new] = self.items[new], self.items[old]
-        self.redraw_playlist()
+        self.playlist.RefreshRows(old, new)
+        self.update_session(self.playlist.current_selection)
         self.playlist.Select(new)
         # print self.master.current_task.taskname
 
@@ -388,7 +468,8 @@ class PlaylistPanel(wx.Panel):
             self.playlist.SetCurrent(old)
 
         self.items[old], self.items[new] = self.items[new], self.items[old]
-        self.redraw_playlist()
+        self.playlist.RefreshRows(old, new)
+        self.update_session(self.playlist.current_selection)
         self.playlist.Select(new)
         # print self.master.current_task.taskname
 
@@ -410,12 +491,9 @@ class PlaylistPanel(wx.Panel):
                                )
         if dialog.ShowModal() == wx.ID_OK:
             path = dialog.GetPath()
-            tadplay = open(path, 'r')
-            tasks = cPickle.load(tadplay)
-            self.items = tasks
+            self.items = manifest.load(path, self.master.taskdict)
             self.playlist.current_selection = 0
             self.redraw_playlist()
-            tadplay.close()
 
     def Save(self, event=None):
         rootdir = self.master.configroot.replace('~', os.getenv('HOME'))
@@ -433,20 +511,26 @@ class PlaylistPanel(wx.Panel):
             path = dialog.GetPath()
             if path[-8:] != '.tadplay':
                 path += '.tadplay'
-            tadplay = open(path, 'w')
-            cPickle.dump(self.items, tadplay)
-            tadplay.close()
+            manifest.save(self.items, path)
 
     def redraw_playlist(self):
-        self.playlist.DeleteAllItems()
-        for task in self.items:
-            self.playlist.Append(['', task.taskname, task.subclass])
-        self.playlist.update_selections()
+        self.playlist.SetItems(self.items)
+        self.update_session(self.playlist.current_selection)
+
+    def update_session(self, index):
+        # the playlist has been edited while a session is running, so its
+        # timeline has to be recompiled
+        if self.master.session is None:
+            return
+        if self.items:
+            self.master.startSession(self.items, index)
+        else:
+            self.master.stopSession()
 
     def on_check(self, index, flag=True):
         if flag:
             task = self.items[index]
-            self.set_current_task(task)
+            self.set_current_task(task, index)
         self.playlist.SetCurrent(index)
 
     def on_loop_check(self, event=None):
@@ -457,8 +541,8 @@ class PlaylistPanel(wx.Panel):
         obj = event.GetEventObject()
         obj.ref.set(event.GetSelection())
 
-    def set_current_task(self, task):
-        self.master.current_task = task(self.master.stimcanvas)
+    def set_current_task(self, task, index=None):
+        self.master.setCurrentTask(task, index)
         self.parent.statuspanel.setTask()
         # force a full re-draw
         self.master.stimcanvas.recalc_stim_bounds()
@@ -466,23 +550,6 @@ class PlaylistPanel(wx.Panel):
         # print "playing current task: %s" %task.taskname
 
 
-def auto_resize_cols(listctrl):
-    ncols = listctrl.GetColumnCount()
-    [listctrl.SetColumnWidth(ii, wx.LIST_AUTOSIZE) for ii in xrange(ncols)]
-
-
-def walk_branches(tree, root, includeroot=True):
-    """ a generator that recursively yields child nodes of a wx.TreeCtrl """
-    if includeroot:
-        yield root
-    item, cookie = tree.GetFirstChild(root)
-    while item.IsOk():
-        yield item
-        if tree.ItemHasChildren(item):
-            walk_branches(tree, item)
-        item, cookie = tree.GetNextChild(root, cookie)
-
-
 class StatusPanel(wx.Panel):
 
     framerate = 0
@@ -509,6 +576,10 @@ class StatusPanel(wx.Panel):
             self, -1, 'Min FPS:', size=(80, -1), style=wx.ALIGN_RIGHT)
         self.fps = wx.StaticText(
             self, -1, '', size=(60, -1), style=wx.ALIGN_LEFT)
+        sessionlabel = wx.StaticText(
+            self, -1, 'Session:', size=(80, -1), style=wx.ALIGN_RIGHT)
+        self.sessiontime = wx.StaticText(
+            self, -1, '', size=(60, -1), style=wx.ALIGN_LEFT)
 
         txth1 = wx.BoxSizer(wx.HORIZONTAL)
         txth1.Add(timelabel, 0, wx.EXPAND | wx.RIGHT, border=5)
@@ -522,10 +593,15 @@ class StatusPanel(wx.Panel):
         txth3.Add(fpslabel, 0, wx.EXPAND | wx.RIGHT, border=5)
         txth3.Add(self.fps, 0, wx.EXPAND, border=0)
 
+        txth4 = wx.BoxSizer(wx.HORIZONTAL)
+        txth4.Add(sessionlabel, 0, wx.EXPAND | wx.RIGHT, border=5)
+        txth4.Add(self.sessiontime, 0, wx.EXPAND, border=0)
+
         vsizer = wx.BoxSizer(wx.VERTICAL)
         vsizer.Add(txth1, 1, wx.EXPAND)
         vsizer.Add(txth2, 1, wx.EXPAND)
         vsizer.Add(txth3, 1, wx.EXPAND)
+        vsizer.Add(txth4, 1, wx.EXPAND)
 
         hsizer = wx.StaticBoxSizer(statbox, wx.HORIZONTAL)
         hsizer.Add(self.progressbar, 1, wx.EXPAND | wx.ALL | wx.CENTER, 5)
@@ -554,6 +630,13 @@ class StatusPanel(wx.Panel):
             self.frame.SetLabel("%i/%i" % (frame + 1, self.totalframes))
             self.time.SetLabel(seconds2human(self.finishtime - time))
 
+        # time left until the end of the playlist
+        session = self.master.session
+        if session is not None:
+            self.sessiontime.SetLabel(seconds2human(session.remaining()))
+        else:
+            self.sessiontime.SetLabel('')
+
 
 class AdjustPanel(wx.Panel):
 
@@ -861,6 +944,9 @@ class LogPanel(wx.Panel):
 
         self.SetSizerAndFit(statbox_vsizer)
 
+        # the live plotting process, see onDiagnosticPlot
+        self.plotproc = None
+
     def onLogging(self, event=None):
         """ toggle logging on and off """
         newval = not(self.master.log_framerate)
@@ -869,97 +955,23 @@ class LogPanel(wx.Panel):
 
     def onClearLogs(self, event=None):
         """ clear the frame time logs """
-        self.master.stimcanvas.frametimes.clear()
-        self.master.stimcanvas.stimdraws.clear()
-        self.master.stimcanvas.alldraws.clear()
-        self.master.stimcanvas.photodraws.clear()
+        self.master.stimcanvas.clear_logs()
 
     def onDiagnosticPlot(self, event=None):
-
-        #----------------------------------------------------------------------
-        # plot frame times
-        import matplotlib
-        matplotlib.use('wxagg')
-        from matplotlib import pyplot as pp
-        import numpy as np
-
-        fig1, ax1 = pp.subplots(1, 1)
-        ax1.hold(True)
-        frametimes = np.array(self.master.stimcanvas.frametimes)
-        nframes = len(frametimes)
-        # ax1.fill_between(range(nframes),
-        #                  [0] * nframes, self.master.stimcanvas.frametimes)
-        # ax1.plot(range(nframes), self.master.stimcanvas.frametimes, '-k')
-        mean_ft = []
-        min_ft = []
-        max_ft = []
-        win = self.master.framerate_window
-        for frames in window_iter(frametimes, win):
-            mean_ft.append(np.mean(frames))
-            min_ft.append(np.min(frames))
-            max_ft.append(np.max(frames))
-        mean_ft = np.array(mean_ft)
-        min_ft = np.array(min_ft)
-        max_ft = np.array(max_ft)
-
-        stimon, stimoff = get_onsets_and_offsets(
-            self.master.stimcanvas.stimdraws)
-        if any(stimon) and any(stimoff):
-            for ii in xrange(stimon.size):
-                if ii == 0:
-                    ax1.axvspan(stimon[ii], stimoff[ii], alpha=0.5,
-                                color='g', label='Stimulus draws')
-                else:
-                    ax1.axvspan(stimon[ii], stimoff[ii],
-                                alpha=0.5, color='g', label='__nolegend__')
-        photoon, photooff = get_onsets_and_offsets(
-            self.master.stimcanvas.photodraws)
-        if any(photoon) and any(photooff):
-            for ii in xrange(photoon.size):
-                if ii == 0:
-                    ax1.axvspan(photoon[ii], photooff[ii], alpha=0.5,
-                                color='b', label='Photodiode draws')
-                else:
-                    ax1.axvspan(photoon[ii], photooff[ii],
-                                alpha=0.5, color='b', label='__nolegend__')
-
-        alldrawon, alldrawoff = get_onsets_and_offsets(
-            self.master.stimcanvas.alldraws)
-        if any(alldrawon) and any(alldrawoff):
-            for ii in xrange(alldrawon.size):
-                if ii == 0:
-                    ax1.axvspan(alldrawon[ii], alldrawoff[ii],
-                                alpha=0.5, color='r', label='Full-frame draws')
-                else:
-                    ax1.axvspan(alldrawon[ii], alldrawoff[ii],
-                                alpha=0.5, color='r', label='__nolegend__')
-
-        ax1.fill_between(np.arange(nframes), min_ft, max_ft,
-                         alpha=0.1, facecolor='k', edgecolor='None')
-        ax1.plot(np.arange(nframes), frametimes, '-k',
-                 alpha=0.3, label='Frame drawtime')
-        ax1.plot(np.arange(nframes), mean_ft, '-k',
-                 alpha=0.75, label='Mean drawtime', lw=2)
-        ax1.axhline(y=self.master.min_delta_t * 1E-3, ls='--',
-                    c='k', alpha=0.75, label='Theoretical')
-
-        ax1.set_xlim(0, self.master.log_nframes)
-        ax1.set_ylim(0, 0.02)
-        ax1.set_xlabel('Frame #')
-        ax1.legend(fancybox=True)
-
-        fig1.tight_layout()
-
-        fig2, ax2 = pp.subplots(1, 1)
-
-        ax2.hist(frametimes, bins=10 ** np.linspace(-3.5, -1.5, 50))
-        ax2.set_xscale('log')
-        ax2.set_xlabel('Draw time (sec)')
-        ax2.set_ylabel('Frequency')
-
-        pp.show(block=True)
-
-        #----------------------------------------------------------------------
+        """
+        Open the live frame log plots (liveplot.py) in a separate
+        interpreter, so that plotting can't hold up the stimulus
+        """
+        if self.plotproc is not None and self.plotproc.poll() is None:
+            return
+        script = os.path.join(os.path.dirname(__file__), 'liveplot.py')
+        self.plotproc = subprocess.Popen(
+            [sys.executable, script,
+             self.master.stimcanvas.framelog.path,
+             '--window', str(self.master.framerate_window),
+             '--min-delta-t', str(self.master.min_delta_t)],
+            # not pinned to the renderer's CPUs
+            preexec_fn=realtime.release)
 
 
 class OptionPanel(wx.Panel):
@@ -1143,10 +1155,9 @@ class OptionPanel(wx.Panel):
 
         # toggle the render timer
         if not isrunning:
-            self.master.stimcanvas.timer.reinit()
             self.master.stimcanvas.timer.start(self.master.min_delta_t)
         else:
-            self.master.stimcanvas.timer.stop()
+            self.master.stimcanvas.timer.pause()
 
         # kick-start the rendering loop by forcing a draw event
         # self.master.stimcanvas.onDraw()
@@ -1215,8 +1226,15 @@ class ControlWindow(wx.Frame):
 
         self.master = master
 
-        self.previewcanvas = glc.PreviewCanvas(
-            self, self.master.stimcanvas, size=(420, 560))
+        if self.master.renderer is None:
+            self.previewcanvas = glc.PreviewCanvas(
+                self, self.master.stimcanvas, size=(420, 560))
+        else:
+            # the GL context belongs to the renderer process, so there's
+            # nothing we can preview it with
+            self.previewcanvas = wx.StaticText(
+                self, label='No preview (separate renderer)',
+                size=(420, 560), style=wx.ALIGN_CENTRE)
         # self.taskpanel = TaskPanel(self,master)
         self.playlistpanel = PlaylistPanel(self, master)
         self.statuspanel = StatusPanel(self, master)
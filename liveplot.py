@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import framelog
+import diagnostics
+
+"""
+Live frame timing plots. The 'Diagnostic plots' button starts this script in
+a separate interpreter, pointed at the memory-mapped frame log (see
+framelog.py), so that matplotlib never runs inside the process that draws
+the stimulus. The plots are redrawn from a fresh snapshot of the log every
+--refresh seconds until the window is closed or tadpydoodle exits.
+
+    $ python liveplot.py /dev/shm/tadpydoodle-framelog-XXXXXX
+"""
+
+
+def draw(ax1, ax2, first, logs, win, min_delta_t):
+    frametimes = logs['frametimes']
+    nframes = frametimes.size
+    frames = np.arange(first, first + nframes)
+
+    ax1.cla()
+    ax2.cla()
+
+    for name, color, label in (('stimdraws', 'g', 'Stimulus draws'),
+                               ('photodraws', 'b', 'Photodiode draws'),
+                               ('alldraws', 'r', 'Full-frame draws')):
+        diagnostics.span_collection(ax1, logs[name], x0=first, alpha=0.5,
+                                    facecolor=color, edgecolor='None',
+                                    label=label)
+
+    if nframes:
+        ax1.fill_between(frames, diagnostics.rolling_min(frametimes, win),
+                         diagnostics.rolling_max(frametimes, win),
+                         alpha=0.1, facecolor='k', edgecolor='None')
+        ax1.plot(frames, frametimes, '-k', alpha=0.3,
+                 label='Frame drawtime')
+        ax1.plot(frames, diagnostics.rolling_mean(frametimes, win), '-k',
+                 alpha=0.75, label='Mean drawtime', lw=2)
+    ax1.axhline(y=min_delta_t * 1E-3, ls='--', c='k', alpha=0.75,
+                label='Theoretical')
+
+    # frames that were delayed by garbage collection
+    gcframes = np.flatnonzero(logs['gcpauses'])
+    if gcframes.size:
+        ax1.plot(frames[gcframes], frametimes[gcframes], 'vm', ms=6,
+                 label='GC pause')
+
+    ax1.set_xlim(first, max(first + nframes, first + 1))
+    ax1.set_ylim(0, 0.02)
+    ax1.set_xlabel('Frame #')
+    ax1.legend(fancybox=True, loc='upper left')
+
+    if nframes:
+        ax2.hist(frametimes, bins=10 ** np.linspace(-3.5, -1.5, 50))
+    ax2.set_xscale('log')
+    ax2.set_xlabel('Draw time (sec)')
+    ax2.set_ylabel('Frequency')
+    summary = diagnostics.percentiles(frametimes)
+    if summary:
+        ax2.set_title('median %.2fms, p99 %.2fms, max %.2fms' % (
+            1E3 * summary['p50'], 1E3 * summary['p99'],
+            1E3 * summary['max']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Live frame timing plots')
+    parser.add_argument('path', help='frame log file')
+    parser.add_argument('--window', type=int, default=100,
+                        help='sliding window for the mean/min/max (frames)')
+    parser.add_argument('--min-delta-t', type=float, default=2.,
+                        help='render timer interval (msec)')
+    parser.add_argument('--refresh', type=float, default=1.,
+                        help='seconds between updates')
+    args = parser.parse_args(argv)
+
+    from matplotlib import pyplot as pp
+
+    log = framelog.FrameLog(args.path, readonly=True)
+    fig, (ax1, ax2) = pp.subplots(2, 1, figsize=(10, 8))
+    fig.canvas.set_window_title('TadPyDoodle frame log')
+
+    lastcount = None
+    # the log file is deleted when tadpydoodle exits
+    while pp.fignum_exists(fig.number) and os.path.exists(args.path):
+        count = log.count
+        if count != lastcount:
+            lastcount = count
+            first, logs = log.snapshot()
+            draw(ax1, ax2, first, logs, args.window, args.min_delta_t)
+            fig.tight_layout()
+        pp.pause(args.refresh)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import json
+import argparse
+
+import numpy as np
+
+import telemetry
+import sessionlog
+import diagnostics
+
+"""
+Offline reports on a session log (see sessionlog.py). The frame records are
+memory-mapped and summarised a chunk at a time, so memory use is bounded
+however long the session was.
+
+    summary.json        whole-session and per-run frame statistics, and
+                        onset errors per task
+    percentiles.csv     frame time percentiles (msec), late and dropped
+                        frames for the whole session and each task run
+    onset_errors.csv    theoretical vs actual onset of every stimulus
+    spectrum.csv        power spectrum of the frame times, for spotting
+                        periodic stalls
+
+A frame is 'late' if it took more than --late-factor times the nominal
+frame interval (--frame-ms, or else the median frame time of the first
+chunk), and each late frame counts round(frametime / interval) - 1
+'dropped' frames.
+
+    $ python logreport.py ~/.tadpydoodle/logs/20131004-101500 --out report
+"""
+
+
+class FrameStats(object):
+
+    """ frame time statistics for one stretch of the log, fed in chunks """
+
+    def __init__(self, interval, late_factor):
+        self.interval = interval
+        self.threshold = interval * late_factor
+        self.percentiles = diagnostics.StreamingPercentiles()
+        self.late = 0
+        self.dropped = 0
+        self.gcpauses = 0
+        self.photodiode = 0
+
+    def update(self, records):
+        frametimes = records['frametime'].astype(np.float64)
+        self.percentiles.update(frametimes)
+        late = frametimes[frametimes > self.threshold]
+        self.late += late.size
+        self.dropped += int(
+            np.maximum(np.round(late / self.interval) - 1, 0).sum())
+        self.gcpauses += np.count_nonzero(records['gcpause'])
+        self.photodiode += np.count_nonzero(
+            records['flags'] & telemetry.FLAG_PHOTODIODE)
+
+    def summary(self):
+        summary = self.percentiles.summary()
+        summary.update(nframes=self.percentiles.n, late=self.late,
+                       dropped=self.dropped, gcpauses=self.gcpauses,
+                       photodiode_frames=self.photodiode)
+        return summary
+
+
+def onset_errors(runs):
+    """ one row per stimulus of every task run that recorded onsets """
+    rows = []
+    for run in runs:
+        actual = run.get('actualstimtimes')
+        if actual is None:
+            continue
+        theoretical = run['theoreticalstimtimes']
+        for stim, (tt, aa) in enumerate(zip(theoretical, actual)):
+            # stimuli that never came on are recorded as -1
+            error = (aa - tt) * 1E3 if aa >= 0 else None
+            rows.append({'run': run['run'], 'taskname': run['taskname'],
+                         'stim': stim, 'theoretical': tt,
+                         'actual': aa if aa >= 0 else None,
+                         'error_ms': error})
+    return rows
+
+
+def onset_summary(rows):
+    """ onset error statistics (msec) per taskname """
+    bytask = {}
+    for row in rows:
+        if row['error_ms'] is not None:
+            bytask.setdefault(row['taskname'], []).append(row['error_ms'])
+    summary = {}
+    for taskname, errors in bytask.iteritems():
+        errors = np.array(errors)
+        absolute = np.abs(errors)
+        summary[taskname] = {'n': errors.size, 'mean': errors.mean(),
+                             'sd': errors.std(),
+                             'abs_p50': np.percentile(absolute, 50),
+                             'abs_p99': np.percentile(absolute, 99),
+                             'abs_max': absolute.max()}
+    return summary
+
+
+def analyse(log, frame_ms=None, late_factor=1.5, nfft=4096,
+            chunksize=1 << 20):
+    runs = log.runs()
+
+    interval = frame_ms * 1E-3 if frame_ms else None
+    overall = None
+    perrun = []
+    spectrum = diagnostics.StreamingSpectrum(nfft)
+    starts = np.array([run['frame'] for run in runs], dtype=np.int64)
+    ends = np.array([run['end'] for run in runs], dtype=np.int64)
+
+    for offset, records in log.chunks(chunksize):
+        if interval is None:
+            interval = float(np.median(records['frametime']))
+        if overall is None:
+            overall = FrameStats(interval, late_factor)
+            perrun = [FrameStats(interval, late_factor) for run in runs]
+        overall.update(records)
+        spectrum.update(records['frametime'])
+
+        # the task runs that overlap this chunk
+        stop = offset + records.shape[0]
+        for ii in np.flatnonzero((starts < stop) & (ends > offset)):
+            lo = max(starts[ii], offset) - offset
+            hi = min(ends[ii], stop) - offset
+            perrun[ii].update(records[lo:hi])
+
+    freqs, power = spectrum.spectrum()
+    if interval:
+        # cycles/frame --> Hz
+        freqs = freqs / interval
+
+    errors = onset_errors(runs)
+    report = {
+        'path': log.path,
+        'nominal_interval_ms': interval * 1E3 if interval else None,
+        'late_factor': late_factor,
+        'frames': overall.summary() if overall else {},
+        'runs': [dict(run=run['run'], taskname=run['taskname'],
+                      finished=run['finished'], first_frame=run['frame'],
+                      end_frame=run['end'], frames=stats.summary())
+                 for run, stats in zip(runs, perrun)],
+        'onset_errors_ms': onset_summary(errors)}
+    return report, errors, (freqs, power)
+
+
+PERCENTILE_COLUMNS = ('scope', 'run', 'taskname', 'nframes', 'mean', 'p50',
+                      'p90', 'p99', 'p99.9', 'max', 'late', 'dropped',
+                      'gcpauses')
+
+
+def percentile_rows(report):
+    rows = []
+    for scope, run, taskname, frames in (
+            [('session', '', '', report['frames'])]
+            + [('run', rr['run'], rr['taskname'], rr['frames'])
+               for rr in report['runs']]):
+        row = {'scope': scope, 'run': run, 'taskname': taskname}
+        for key in PERCENTILE_COLUMNS[3:]:
+            value = frames.get(key)
+            if key in ('mean', 'max') or key.startswith('p'):
+                value = None if value is None else value * 1E3
+            row[key] = value
+        rows.append(row)
+    return rows
+
+
+def write_csv(path, columns, rows):
+    with open(path, 'wb') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_report(outdir, report, errors, spectrum):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    with open(os.path.join(outdir, 'summary.json'), 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    write_csv(os.path.join(outdir, 'percentiles.csv'), PERCENTILE_COLUMNS,
+              percentile_rows(report))
+    write_csv(os.path.join(outdir, 'onset_errors.csv'),
+              ('run', 'taskname', 'stim', 'theoretical', 'actual',
+               'error_ms'), errors)
+    freqs, power = spectrum
+    write_csv(os.path.join(outdir, 'spectrum.csv'), ('freq_hz', 'power'),
+              [{'freq_hz': ff, 'power': pp} for ff, pp in zip(freqs, power)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Summarise a tadpydoodle session log')
+    parser.add_argument('path', help='session log directory')
+    parser.add_argument('--out', default=None,
+                        help='write CSV/JSON reports to this directory')
+    parser.add_argument('--frame-ms', type=float, default=None,
+                        help='nominal frame interval (msec)')
+    parser.add_argument('--late-factor', type=float, default=1.5,
+                        help='a frame is late if it takes longer than this '
+                             'many frame intervals')
+    parser.add_argument('--nfft', type=int, default=4096,
+                        help='segment length for the frame time spectrum')
+    parser.add_argument('--chunk', type=int, default=1 << 20,
+                        help='frames per chunk')
+    args = parser.parse_args(argv)
+
+    log = sessionlog.SessionLogReader(args.path)
+    report, errors, spectrum = analyse(log, args.frame_ms, args.late_factor,
+                                       args.nfft, args.chunk)
+    if args.out:
+        write_report(args.out, report, errors, spectrum)
+
+    print '%-8s %-4s %-24s %10s %8s %8s %8s %8s %7s' % (
+        'scope', 'run', 'task', 'frames', 'p50', 'p99', 'max', 'late',
+        'dropped')
+    for row in percentile_rows(report):
+        if not row['nframes']:
+            continue
+        print '%-8s %-4s %-24s %10i %8.3f %8.3f %8.3f %8i %7i' % (
+            row['scope'], row['run'], row['taskname'][:24], row['nframes'],
+            row['p50'], row['p99'], row['max'], row['late'], row['dropped'])
+    for taskname, stats in sorted(report['onset_errors_ms'].iteritems()):
+        print 'onset error %-24s mean %.2fms, |p99| %.2fms, |max| %.2fms' % (
+            taskname[:24], stats['mean'], stats['abs_p99'], stats['abs_max'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
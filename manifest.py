@@ -0,0 +1,146 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import hashlib
+import inspect
+import cPickle
+
+import task_index as ti
+
+"""
+Playlist files (.tadplay). A playlist is saved as a JSON manifest:
+
+    {"format": "tadpydoodle-playlist", "version": 1,
+     "duration": <total sec, or null if any item's is unknown>,
+     "items": [{"taskname": ..., "subclass": ..., "modpath": ...,
+                "clsname": ..., "params": {...}, "hash": ...,
+                "timeline": {"duration": ..., "nstim": ..., ...}}, ...]}
+
+Each item is identified by its taskname (the key in the task registry,
+AppThread.taskdict), and carries a hash of the task's parameters so that
+we can tell when a task has been changed since the playlist was saved.
+Loading doesn't import anything: items become the registry's LazyTasks, or
+LazyTasks built from the manifest if the taskname isn't registered.
+
+Playlists saved by older versions (pickled task classes) can still be
+loaded.
+"""
+
+FORMAT = 'tadpydoodle-playlist'
+VERSION = 1
+
+# the per-item timeline summary, all attributes of a task instance
+TIMELINE = ('finishtime', 'nstim', 'nframes', 'initblanktime', 'scan_hz')
+
+
+def param_hash(params):
+    """ content hash of a task's parameters """
+    return hashlib.sha1(json.dumps(params, sort_keys=True)).hexdigest()
+
+
+def task_params(task):
+    params = getattr(task, 'params', None)
+    if isinstance(params, dict):
+        return params
+    return ti.task_params(task)
+
+
+def timeline_summary(task):
+    """
+    the timing of a task, from an instance created without a canvas, or
+    None if it can't be instantiated
+    """
+    try:
+        inst = task(draw=False)
+    except Exception:
+        return None
+    summary = dict((name, ti.simple_value(getattr(inst, name, None)))
+                   for name in TIMELINE)
+    summary['duration'] = summary.pop('finishtime')
+    return summary
+
+
+def item_record(task):
+    params = task_params(task)
+    timeline = getattr(task, 'timeline', None)
+    if timeline is None:
+        timeline = timeline_summary(task)
+    if isinstance(task, ti.LazyTask):
+        modpath, clsname = task.modpath, task.clsname
+        task.timeline = timeline
+    else:
+        modpath, clsname = inspect.getsourcefile(task), task.__name__
+    return {'taskname': task.taskname,
+            'subclass': task.subclass,
+            'modpath': modpath,
+            'clsname': clsname,
+            'params': params,
+            'hash': param_hash(params),
+            'timeline': timeline}
+
+
+def save(tasks, path):
+    """ write 'tasks' (task classes or LazyTasks) to a manifest at 'path' """
+    items = [item_record(task) for task in tasks]
+    durations = [(item['timeline'] or {}).get('duration') for item in items]
+    manifest = {'format': FORMAT, 'version': VERSION,
+                'duration': None if None in durations else sum(durations),
+                'items': items}
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def load(path, taskdict):
+    """
+    Read a playlist from 'path' and return a list of LazyTasks (or task
+    classes, for old pickled playlists). 'taskdict' is the task registry.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(1)
+        f.seek(0)
+        if head != '{':
+            # an old playlist of pickled task classes
+            return cPickle.load(f)
+        manifest = json.load(f)
+
+    if manifest.get('format') != FORMAT:
+        raise ValueError('%s is not a playlist' % path)
+    if manifest.get('version', 0) > VERSION:
+        raise ValueError('%s was saved by a newer version of tadpydoodle'
+                         % path)
+
+    tasks = []
+    for item in manifest['items']:
+        taskname = item['taskname']
+        task = taskdict.get(taskname) if taskdict else None
+        if task is None:
+            print 'Task "%s" is not registered, using the playlist copy' \
+                % taskname
+            task = ti.LazyTask(taskname, item['subclass'], item['modpath'],
+                               item['clsname'], item['params'])
+        elif param_hash(task_params(task)) != item['hash']:
+            print 'Task "%s" has changed since the playlist was saved' \
+                % taskname
+        else:
+            # the saved timeline is still valid
+            task.timeline = item['timeline']
+        tasks.append(task)
+    return tasks
@@ -0,0 +1,275 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import ctypes
+import ctypes.util
+
+"""
+Optional real-time profile for the process that renders the stimulus
+(Linux only). Configured in the [realtime] section of the config file:
+
+    rt_enable       apply the profile at all
+    rt_policy       'fifo' or 'rr' (SCHED_FIFO / SCHED_RR), or 'other' to
+                    keep the normal time-sharing scheduler
+    rt_priority     1-99, higher pre-empts lower
+    rt_cpus         CPUs to pin the renderer to, e.g. '2,3' or '2-3'. empty
+                    means don't change the affinity
+    rt_mlockall     lock the pages mapped so far (code, GL driver, loaded
+                    tasks) into RAM, so that the render path doesn't wait
+                    on them being paged back in. only used with a
+                    separate renderer, see below
+
+The profile is applied to the thread that draws (see configure()) and to
+the render timer thread (see render_thread()), and nothing else:
+
+  - the scheduling policy is set with SCHED_RESET_ON_FORK, so threads and
+    processes started afterwards get the normal scheduler
+  - CPU affinity is inherited regardless, so other threads and child
+    processes (task discovery and noise generation pools, the remote
+    control server, event handlers, the live plots) call release() to go
+    back to the CPUs we started with
+
+With a separate renderer (see renderer.py) only the renderer process is
+affected. Without one the stimulus is drawn on the wx main thread, so the
+control window shares its priority and CPUs.
+
+Memory is locked with MCL_CURRENT only, never MCL_FUTURE: every mapping
+made afterwards (noise sequence memmaps, the frame log ring, numpy
+buffers) would count against RLIMIT_MEMLOCK, and once that runs out mmap
+and malloc fail, i.e. MemoryErrors in the middle of an experiment. Even so
+locking the whole wx process is rarely worth it, so rt_mlockall is ignored
+unless separate_renderer is set.
+
+Raising the scheduling priority needs root, CAP_SYS_NICE or an 'rtprio'
+entry in /etc/security/limits.conf; mlockall needs a large enough
+'memlock' limit. Steps that fail are reported and skipped.
+"""
+
+SCHED_OTHER = 0
+SCHED_FIFO = 1
+SCHED_RR = 2
+POLICIES = {'other': SCHED_OTHER, 'fifo': SCHED_FIFO, 'rr': SCHED_RR}
+
+# children (threads included) revert to SCHED_OTHER
+SCHED_RESET_ON_FORK = 0x40000000
+
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# glibc's cpu_set_t is 1024 bits
+_NCPUBITS = 1024
+_WORDBITS = 8 * ctypes.sizeof(ctypes.c_ulong)
+_CpuSet = ctypes.c_ulong * (_NCPUBITS // _WORDBITS)
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+_libc = None
+
+# the (policy, priority, cpus) applied by apply_profile(), and the CPUs we
+# had before it, for render_thread() and release()
+_applied = None
+_original_cpus = None
+
+
+def libc():
+    """ the C library, or None if it can't be found """
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library('c')
+        if name is None:
+            return None
+        _libc = ctypes.CDLL(name, use_errno=True)
+    return _libc
+
+
+def _check(result):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def parse_cpus(spec):
+    """ '0,2-3' --> [0, 2, 3] """
+    cpus = []
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(xrange(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def set_scheduler(policy, priority, pid=0):
+    param = _SchedParam(priority if policy != SCHED_OTHER else 0)
+    if policy != SCHED_OTHER:
+        policy |= SCHED_RESET_ON_FORK
+    _check(libc().sched_setscheduler(pid, policy, ctypes.byref(param)))
+
+
+def get_scheduler(pid=0):
+    """ (policy, priority) """
+    c = libc()
+    policy = c.sched_getscheduler(pid)
+    if policy < 0:
+        _check(policy)
+    param = _SchedParam()
+    _check(c.sched_getparam(pid, ctypes.byref(param)))
+    return policy & ~SCHED_RESET_ON_FORK, param.sched_priority
+
+
+def set_affinity(cpus, pid=0):
+    mask = _CpuSet()
+    for cpu in cpus:
+        mask[cpu // _WORDBITS] |= 1 << (cpu % _WORDBITS)
+    _check(libc().sched_setaffinity(pid, ctypes.sizeof(mask),
+                                    ctypes.byref(mask)))
+
+
+def get_affinity(pid=0):
+    mask = _CpuSet()
+    _check(libc().sched_getaffinity(pid, ctypes.sizeof(mask),
+                                    ctypes.byref(mask)))
+    return [cpu for cpu in xrange(_NCPUBITS)
+            if mask[cpu // _WORDBITS] >> (cpu % _WORDBITS) & 1]
+
+
+def lock_memory():
+    """ lock the pages that are mapped now (see the module docstring) """
+    _check(libc().mlockall(MCL_CURRENT))
+
+
+def memory_locked():
+    """ kB of locked memory for this process, from /proc """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmLck:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def apply_profile(policy='fifo', priority=50, cpus='', mlock=True):
+    """
+    Apply a real-time profile to the calling thread. Returns a list of
+    messages describing anything that couldn't be applied.
+    """
+    global _applied, _original_cpus
+    if libc() is None or not hasattr(libc(), 'sched_setaffinity'):
+        return ['real-time profile is only supported on Linux']
+
+    failures = []
+    applied = [SCHED_OTHER, 0, None]
+    try:
+        set_scheduler(POLICIES[policy], priority)
+        applied[:2] = POLICIES[policy], priority
+    except KeyError:
+        failures.append('unknown scheduling policy %r (use one of %s)'
+                        % (policy, ', '.join(sorted(POLICIES))))
+    except OSError as e:
+        failures.append('could not set %s priority %i: %s'
+                        % (policy, priority, e.strerror))
+    if cpus:
+        try:
+            original = get_affinity()
+            set_affinity(parse_cpus(cpus))
+            _original_cpus = original
+            applied[2] = parse_cpus(cpus)
+        except ValueError:
+            failures.append('could not parse CPU list %r' % cpus)
+        except OSError as e:
+            failures.append('could not set CPU affinity %s: %s'
+                            % (cpus, e.strerror))
+    _applied = tuple(applied)
+    if mlock:
+        try:
+            lock_memory()
+        except OSError as e:
+            failures.append('could not lock memory: %s' % e.strerror)
+    return failures
+
+
+def render_thread():
+    """
+    Give the calling thread the profile applied by apply_profile() (the
+    scheduling policy isn't inherited). For threads on the render path,
+    i.e. the render timer
+    """
+    if _applied is None:
+        return
+    policy, priority, cpus = _applied
+    try:
+        if policy != SCHED_OTHER:
+            set_scheduler(policy, priority)
+        if cpus:
+            set_affinity(cpus)
+    except OSError as e:
+        print 'Real-time profile: render thread: %s' % e.strerror
+
+
+def release():
+    """
+    Undo the CPU affinity inherited from the render thread, in other
+    threads and in child processes (e.g. as a Pool initializer or a Popen
+    preexec_fn). The scheduling policy is already reset by
+    SCHED_RESET_ON_FORK
+    """
+    if _original_cpus is None:
+        return
+    try:
+        set_affinity(_original_cpus)
+    except OSError:
+        pass
+
+
+def report():
+    """ a one-line summary of the effective settings """
+    if libc() is None or not hasattr(libc(), 'sched_setaffinity'):
+        return 'scheduling settings unavailable'
+    names = dict((vv, kk) for kk, vv in POLICIES.iteritems())
+    policy, priority = get_scheduler()
+    locked = memory_locked()
+    return 'scheduler: %s, priority: %i, CPUs: %s, locked memory: %s' % (
+        names.get(policy, policy), priority,
+        ','.join(str(cpu) for cpu in get_affinity()),
+        'unknown' if locked is None else '%i kB' % locked)
+
+
+def configure(master):
+    """
+    Apply the profile described by the 'rt_*' options of 'master' (an
+    AppThread or RendererMaster) to the calling thread, which should be
+    the one that draws, and print the effective settings
+    """
+    if not master.rt_enable:
+        return
+    mlock = master.rt_mlockall and master.separate_renderer
+    if master.rt_mlockall and not mlock:
+        print ('Real-time profile: rt_mlockall ignored, it is only used with '
+               'separate_renderer')
+    failures = apply_profile(master.rt_policy, master.rt_priority,
+                             master.rt_cpus, mlock)
+    for msg in failures:
+        print 'Real-time profile: %s' % msg
+    print 'Real-time profile: %s' % report()
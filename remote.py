@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import select
+import argparse
+import threading
+import collections
+
+import realtime
+
+"""
+Remote control of a running tadpydoodle, so that it can be scripted or
+driven by acquisition software. Set 'remote_address' in the [remote]
+section of the config file to either a Unix socket path or 'host:port'.
+
+The protocol is line-delimited JSON. Each request is one line:
+
+    {"id": 1, "cmd": "enqueue", "args": {"taskname": "bars1"}}
+
+and gets one response line with the same id:
+
+    {"id": 1, "ok": true, "result": {"index": 3}}
+    {"id": 1, "ok": false, "error": "no task called 'bars1'"}
+
+Commands (see Controller):
+
+    list_tasks                      registered tasks
+    playlist                        the playlist and the current item
+    enqueue     taskname            append a task to the playlist
+    start       [index]             start the current (or index'th) task
+    stop                            stop it
+    next                            move on to the next playlist item
+    set         name, value         set a configuration option
+    get         name                read one
+    status                          what's running and how far through
+    subscribe                       also send event lines on this
+                                    connection
+
+Events are pushed to subscribed connections as they happen:
+
+    {"event": "task_finished", "time": 1380000000.0, "taskname": "bars1"}
+
+The server runs on its own thread and never blocks: requests are read
+there and the commands run on the wx main loop between frames (with
+wx.CallAfter), so a slow or stalled client can't hold up the stimulus.
+
+From a shell:
+
+    $ python remote.py ~/.tadpydoodle/remote.sock start
+    $ python remote.py localhost:7007 set '{"name": "gamma", "value": 2.2}'
+    $ python remote.py ~/.tadpydoodle/remote.sock --events
+"""
+
+# requests longer than this are refused
+MAX_LINE = 65536
+
+# OptionPanel handlers for the options that have checkboxes
+CHECKBOX_HANDLERS = {'show_photodiode': 'onPhoto',
+                     'show_crosshairs': 'onCross',
+                     'show_preview': 'onPreview',
+                     'fullscreen': 'onFullscreen',
+                     'on_top': 'onTop',
+                     'run_loop': 'onDisplayloop'}
+
+
+def parse_address(address):
+    """ (family, address) for 'host:port' or a Unix socket path """
+    if ':' in address and os.sep not in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, os.path.expanduser(address)
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')) + '\n'
+
+
+class Server(object):
+
+    """
+    Line-delimited JSON server. 'handler(cmd, args)' returns the result
+    of a command or raises an exception, and is run by 'call' (e.g.
+    wx.CallAfter, the default is to run it on the server's own thread).
+
+    Methods:
+        start()
+        publish(event, **fields)
+        close()
+    """
+
+    def __init__(self, address, handler, call=None):
+        self.handler = handler
+        self.call = call
+        self.family, self.address = parse_address(address)
+
+        if self.family == socket.AF_UNIX:
+            root = os.path.dirname(self.address)
+            if root and not os.path.exists(root):
+                os.makedirs(root)
+            # a socket file left behind by a previous run
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+        self.server = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen(8)
+        self.server.setblocking(False)
+        if self.family == socket.AF_INET:
+            # the port actually used, if we asked for port 0
+            self.address = self.server.getsockname()
+
+        # responses and events are queued by any thread and sent by the
+        # server thread, which is woken up through a pipe
+        self.outbox = collections.deque()
+        self.wake_r, self.wake_w = os.pipe()
+        self.lock = threading.Lock()
+        self.inbuf = {}
+        self.outbuf = {}
+        self.subscribers = set()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name='remote')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, 'x')
+        except OSError:
+            pass
+
+    def send(self, conn, message):
+        """ queue a message for 'conn', from any thread """
+        self.outbox.append((conn, encode(message)))
+        self._wake()
+
+    def publish(self, event, **fields):
+        """ send an event to every subscribed connection """
+        fields['event'] = event
+        fields.setdefault('time', time.time())
+        line = encode(fields)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for conn in subscribers:
+            self.outbox.append((conn, line))
+        if subscribers:
+            self._wake()
+
+    def _loop(self):
+        realtime.release()
+        while self.running:
+            readers = [self.server, self.wake_r] + self.inbuf.keys()
+            writers = [conn for conn, buf in self.outbuf.iteritems() if buf]
+            try:
+                readable, writable, _ = select.select(readers, writers, [])
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in readable:
+                if fd is self.server:
+                    self._accept()
+                elif fd == self.wake_r:
+                    os.read(self.wake_r, 4096)
+                elif fd in self.inbuf:
+                    self._read(fd)
+            while self.outbox:
+                conn, line = self.outbox.popleft()
+                if conn in self.outbuf:
+                    self.outbuf[conn] += line
+                    writable.append(conn)
+            for conn in set(writable):
+                self._write(conn)
+
+    def _accept(self):
+        try:
+            conn, _ = self.server.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        if self.family == socket.AF_INET:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.setblocking(False)
+        self.inbuf[conn] = ''
+        self.outbuf[conn] = ''
+
+    def _drop(self, conn):
+        self.inbuf.pop(conn, None)
+        self.outbuf.pop(conn, None)
+        with self.lock:
+            self.subscribers.discard(conn)
+        conn.close()
+
+    def _read(self, conn):
+        try:
+            data = conn.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._drop(conn)
+            return
+        buf = self.inbuf[conn] + data
+        lines = buf.split('\n')
+        self.inbuf[conn] = lines.pop()
+        if len(self.inbuf[conn]) > MAX_LINE:
+            self._drop(conn)
+            return
+        for line in lines:
+            if line.strip():
+                self._request(conn, line)
+
+    def _write(self, conn):
+        buf = self.outbuf.get(conn)
+        if not buf:
+            return
+        try:
+            sent = conn.send(buf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self._drop(conn)
+            return
+        self.outbuf[conn] = buf[sent:]
+
+    def _request(self, conn, line):
+        try:
+            request = json.loads(line)
+            rid = request.get('id')
+            cmd = request['cmd']
+            args = request.get('args') or {}
+        except (ValueError, KeyError, AttributeError, TypeError):
+            self.send(conn, {'id': None, 'ok': False,
+                             'error': 'malformed request'})
+            return
+        if cmd == 'subscribe':
+            # doesn't need the main loop
+            with self.lock:
+                self.subscribers.add(conn)
+            self.send(conn, {'id': rid, 'ok': True, 'result': None})
+        elif self.call is None:
+            self._handle(conn, rid, cmd, args)
+        else:
+            self.call(self._handle, conn, rid, cmd, args)
+
+    def _handle(self, conn, rid, cmd, args):
+        try:
+            result = self.handler(cmd, args)
+        except Exception as e:
+            response = {'id': rid, 'ok': False, 'error': str(e)}
+        else:
+            response = {'id': rid, 'ok': True, 'result': result}
+        self.send(conn, response)
+
+    def close(self):
+        self.running = False
+        self._wake()
+        if self.thread is not None:
+            self.thread.join(1.)
+        for conn in self.inbuf.keys():
+            conn.close()
+        self.server.close()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+        if self.family == socket.AF_UNIX:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+
+class Controller(object):
+
+    """
+    The commands, run on the main loop. 'master' is the AppThread.
+
+    Methods:
+        __call__(cmd, args)
+    """
+
+    def __init__(self, master):
+        self.master = master
+        self.options = dict((option, type(value))
+                            for subsect in master.template.itervalues()
+                            for option, value in subsect.iteritems())
+
+    def __call__(self, cmd, args):
+        method = getattr(self, 'cmd_' + cmd, None)
+        if method is None:
+            raise ValueError("unknown command '%s'" % cmd)
+        return method(**args)
+
+    @property
+    def playlistpanel(self):
+        return self.master.controlwindow.playlistpanel
+
+    def cmd_list_tasks(self):
+        taskdict = self.master.taskdict or {}
+        return [{'taskname': name, 'subclass': taskdict[name].subclass}
+                for name in sorted(taskdict)]
+
+    def cmd_playlist(self):
+        panel = self.playlistpanel
+        return {'current': panel.playlist.current_selection,
+                'items': [{'taskname': task.taskname,
+                           'subclass': task.subclass}
+                          for task in panel.items]}
+
+    def cmd_enqueue(self, taskname):
+        task = (self.master.taskdict or {}).get(taskname)
+        if task is None:
+            raise ValueError("no task called '%s'" % taskname)
+        panel = self.playlistpanel
+        panel.Append(task)
+        return {'index': len(panel.items) - 1}
+
+    def cmd_start(self, index=None):
+        panel = self.playlistpanel
+        if index is not None:
+            if not 0 <= index < len(panel.items):
+                raise IndexError('no playlist item %i' % index)
+            panel.on_check(index)
+        if self.master.current_task is None:
+            raise ValueError('no task to start')
+        if not self.master.run_task:
+            panel.onRunTask()
+        return self.cmd_status()
+
+    def cmd_stop(self):
+        if self.master.run_task:
+            self.playlistpanel.onRunTask()
+        return self.cmd_status()
+
+    def cmd_next(self):
+        self.playlistpanel.Next()
+        return self.cmd_status()
+
+    def cmd_get(self, name):
+        if name not in self.options:
+            raise KeyError("no option called '%s'" % name)
+        return getattr(self.master, name)
+
+    def cmd_set(self, name, value):
+        if name not in self.options:
+            raise KeyError("no option called '%s'" % name)
+        value = self.options[name](value)
+        master = self.master
+        if getattr(master, name) == value:
+            return value
+        optionpanel = master.controlwindow.optionpanel
+        adjustpanel = master.controlwindow.adjustpanel
+        if name in CHECKBOX_HANDLERS:
+            # the checkbox handlers toggle the option and do whatever else
+            # is needed (fullscreen, the render timer...)
+            getattr(optionpanel, CHECKBOX_HANDLERS[name])()
+        else:
+            setattr(master, name, value)
+            if name == 'gamma':
+                master.stimcanvas.update_gamma()
+            for ctrls in (adjustpanel.p_textctls, adjustpanel.c_textctls):
+                if name in ctrls:
+                    ctrls[name].SetValue(str(value))
+        master.stimcanvas.do_refresh_everything = True
+        return getattr(master, name)
+
+    def cmd_status(self):
+        master = self.master
+        task = master.current_task
+        status = {'running': bool(master.run_task),
+                  'index': self.playlistpanel.playlist.current_selection,
+                  'task': None}
+        if task is not None:
+            status['task'] = {'taskname': task.taskname,
+                              'subclass': task.subclass,
+                              'currentframe': int(task.currentframe),
+                              'nframes': int(task.nframes),
+                              'currentstim': int(task.currentstim),
+                              'nstim': int(task.nstim),
+                              'dt': float(task.dt),
+                              'finishtime': float(task.finishtime)}
+        session = master.session
+        if session is not None:
+            status['session_remaining'] = session.remaining()
+        return status
+
+
+class Client(object):
+
+    """
+    A blocking client, for scripts and tests.
+
+    Methods:
+        call(cmd, **args)
+        subscribe()
+        next_event(timeout)
+        close()
+    """
+
+    def __init__(self, address, timeout=5.):
+        family, address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.buf = ''
+        self.nextid = 0
+        self.events = collections.deque()
+
+    def _readline(self):
+        while '\n' not in self.buf:
+            data = self.sock.recv(65536)
+            if not data:
+                raise EOFError('server closed the connection')
+            self.buf += data
+        line, self.buf = self.buf.split('\n', 1)
+        return json.loads(line)
+
+    def call(self, cmd, **args):
+        """ send a command and wait for its result """
+        self.nextid += 1
+        rid = self.nextid
+        self.sock.sendall(encode({'id': rid, 'cmd': cmd, 'args': args}))
+        while True:
+            message = self._readline()
+            if 'event' in message:
+                self.events.append(message)
+            elif message.get('id') == rid:
+                break
+        if not message['ok']:
+            raise RuntimeError(message['error'])
+        return message['result']
+
+    def subscribe(self):
+        return self.call('subscribe')
+
+    def next_event(self, timeout=None):
+        """ the next event, or None on timeout """
+        if self.events:
+            return self.events.popleft()
+        old = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            while True:
+                message = self._readline()
+                if 'event' in message:
+                    return message
+        except socket.timeout:
+            return None
+        finally:
+            self.sock.settimeout(old)
+
+    def close(self):
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Send a command to a running tadpydoodle')
+    parser.add_argument('address', help="Unix socket path or 'host:port'")
+    parser.add_argument('cmd', nargs='?', help='command')
+    parser.add_argument('args', nargs='?', default='{}',
+                        help='command arguments, as a JSON object')
+    parser.add_argument('--events', action='store_true',
+                        help='print events until interrupted')
+    args = parser.parse_args(argv)
+
+    client = Client(args.address)
+    if args.cmd:
+        print json.dumps(client.call(args.cmd, **json.loads(args.args)),
+                         indent=1, sort_keys=True)
+    if args.events:
+        client.subscribe()
+        try:
+            while True:
+                print json.dumps(client.next_event(), sort_keys=True)
+        except (KeyboardInterrupt, EOFError):
+            pass
+    client.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
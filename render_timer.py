@@ -17,42 +17,150 @@ along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
 
 import wx
 import threading
-# import multiprocessing
-import time
+
+import realtime
+from base_tasks.clocks import monotonic
+
+"""
+The render timer: a background thread that asks the stimulus canvas to
+draw by posting EVT_THREAD_TIMER events at a fixed interval.
+
+Ticks are scheduled against absolute deadlines on the monotonic clock, so
+late wake-ups don't accumulate. The thread sleeps on a condition variable
+until just before each deadline (so that pause/resume/stop take effect
+immediately) and spins for the last 'spin' seconds, since sleeps are only
+accurate to about a millisecond.
+
+At most one draw request is outstanding at a time. A tick that comes due
+before the canvas has served the previous one (by calling served()) is
+coalesced into it rather than queueing another event.
+"""
 
 wxEVT_THREAD_TIMER = wx.NewEventType()
 EVT_THREAD_TIMER = wx.PyEventBinder(wxEVT_THREAD_TIMER, 1)
 
+STOPPED, RUNNING, PAUSED = 'stopped', 'running', 'paused'
+
+
 class ThreadTimer(object):
 
-    def __init__(self, parent):
-        self.parent = parent
-        self.reinit()
+    """
+    Methods:
+        start(interval)
+        pause()
+        resume()
+        stop()
+        served()
+        stats()
 
-    def reinit(self):
-        self.thread = Thread()
-        self.thread.parent = self
-        self.alive = False
+    'interval' is in msec. The counters 'posted', 'served' and 'coalesced'
+    count draw requests sent to the canvas, requests it has handled, and
+    ticks that were folded into an outstanding request.
+    """
 
-    def start(self, interval):
-        self.interval = interval
-        self.alive = True
+    # spin (rather than sleep) for the last part of each wait (sec)
+    spin = 0.0005
+
+    def __init__(self, parent, clock=monotonic):
+        self.parent = parent
+        self.clock = clock
+        self.cond = threading.Condition()
+        self.state = STOPPED
+        self.interval = None
+        self.deadline = None
         self.pending = False
-        self.thread.start()
+        self.thread = None
+        self.posted = 0
+        self.served_count = 0
+        self.coalesced = 0
+
+    def start(self, interval):
+        """ start ticking every 'interval' msec (or resume, if paused) """
+        with self.cond:
+            self.interval = interval / 1000.
+            self.deadline = self.clock() + self.interval
+            self.pending = False
+            self.state = RUNNING
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+
+    def pause(self):
+        with self.cond:
+            if self.state == RUNNING:
+                self.state = PAUSED
+                self.cond.notify()
+
+    def resume(self):
+        with self.cond:
+            if self.state == PAUSED:
+                self.deadline = self.clock() + self.interval
+                # don't wait on a tick that was never served
+                self.pending = False
+                self.state = RUNNING
+                self.cond.notify()
 
     def stop(self):
-        self.alive = False
+        """ stop ticking and let the thread exit """
+        with self.cond:
+            self.state = STOPPED
+            self.thread = None
+            self.cond.notify()
+
+    def served(self):
+        """ called by the canvas once it has drawn in response to a tick """
+        with self.cond:
+            if self.pending:
+                self.pending = False
+                self.served_count += 1
+
+    def stats(self):
+        return {'posted': self.posted, 'served': self.served_count,
+                'coalesced': self.coalesced}
 
+    def _run(self):
+        # the ticks are on the render path, so they get the real-time
+        # profile too (see realtime.py)
+        realtime.render_thread()
+        me = threading.current_thread()
+        cond = self.cond
+        clock = self.clock
+        while True:
+            with cond:
+                while self.state == PAUSED and self.thread is me:
+                    cond.wait()
+                if self.thread is not me:
+                    return
+                deadline = self.deadline
+                remaining = deadline - clock() - self.spin
+                if remaining > 0:
+                    # woken early if we're paused, stopped or restarted
+                    cond.wait(remaining)
+                    continue
 
-class Thread(threading.Thread):
+            while clock() < deadline:
+                pass
 
-    def run(self):
-        while self.parent.alive:
-            time.sleep(self.parent.interval / 1000.0)
-            if not self.parent.pending:
-                self.parent.pending = True
-                self._post()
+            with cond:
+                if self.state != RUNNING or self.deadline != deadline:
+                    continue
+                self.deadline = deadline + self.interval
+                now = clock()
+                if self.deadline < now:
+                    # we've fallen more than a whole interval behind - skip
+                    # the missed ticks rather than firing them in a burst
+                    missed = int((now - deadline) // self.interval)
+                    self.coalesced += missed
+                    self.deadline += missed * self.interval
+                if self.pending:
+                    self.coalesced += 1
+                    continue
+                self.pending = True
+                self.posted += 1
+            self._post()
 
     def _post(self):
         event = wx.PyEvent(eventType=wxEVT_THREAD_TIMER)
-        wx.PostEvent(self.parent.parent, event)
+        wx.PostEvent(self.parent, event)
@@ -0,0 +1,432 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import wx
+import multiprocessing
+import threading
+import Queue
+
+import glcanvases as glc
+import render_timer as rt
+import realtime
+import framelog
+import startup
+from base_tasks import events
+
+"""
+Runs the stimulus window in a process of its own, so that nothing that
+happens in the control window (file dialogs, diagnostic plots, rebuilding
+the task tree...) can hold up a frame. Enabled by setting
+'separate_renderer = True' in the [stimulus] section of the config file.
+
+The renderer process owns the GL context. It talks to the control UI via:
+
+    params      shared memory holding the live display parameters (c_xpos,
+                gamma, show_photodiode, run_task etc.), written by the UI
+                and read by the renderer every frame
+    status      shared memory holding the renderer's state (current frame,
+                task time, slowest frame), written by the renderer every
+                frame and polled by the UI
+    commands    a queue of (name, args...) tuples from the UI: set the
+                task, schedule or reinitialise it, refresh, start/stop the
+                render timer, fullscreen etc.
+    events      a queue of (name, args...) tuples from the renderer: task
+                finished, first frame presented (with the renderer's
+                startup timings), window closed
+    framelog    the renderer's frame log, a memory-mapped file created by
+                the UI (see framelog.py)
+
+Only numeric and boolean options are shared. Everything else (gc_mode,
+log_nframes...) is read from the configuration once, when the renderer
+starts. The preview canvas can't be used, since a GL context can't be
+shared between processes.
+"""
+
+# renderer --> UI state, with initial values. 'taskseq' is the sequence
+# number of the 'task' command that created the current task, so that the
+# UI can tell whether the rest describes the task it last sent
+STATUS_FIELDS = (('slowestframe', -1.), ('currentframe', 0),
+                 ('currentstim', -1), ('dt', -1.), ('starttime', -1.),
+                 ('taskseq', 0))
+
+# sections of the config template that hold display parameters
+SHARED_SECTIONS = ('window', 'photodiode', 'crosshairs', 'stimulus')
+
+
+def shared_defaults(template):
+    """ (name, value) for every option that goes in shared memory """
+    defaults = [('run_task', False)]
+    for sect in SHARED_SECTIONS:
+        for option, value in sorted(template[sect].iteritems()):
+            if isinstance(value, (bool, int, float)):
+                defaults.append((option, value))
+    return defaults
+
+
+class SharedParams(object):
+
+    """
+    A fixed set of named numeric values in shared memory. Each value is
+    stored as a double and converted back to the type of its initial value
+    when it is read.
+
+    'version' is incremented by every set() with notify=True, so that the
+    reader can tell when something has changed without comparing values.
+
+    Methods:
+        get(name)
+        set(name, value, notify=True)
+    """
+
+    def __init__(self, defaults):
+        self.names = [name for name, _ in defaults]
+        self.index = dict((name, ii) for ii, name in enumerate(self.names))
+        self.types = dict((name, type(value)) for name, value in defaults)
+        self.values = multiprocessing.Array(
+            'd', [float(value) for _, value in defaults])
+        # protected by the lock on self.values
+        self.version = multiprocessing.Value('L', 0, lock=False)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def get(self, name):
+        return self.types[name](self.values[self.index[name]])
+
+    def set(self, name, value, notify=True):
+        with self.values.get_lock():
+            self.values[self.index[name]] = value
+            if notify:
+                self.version.value += 1
+
+
+class RendererMaster(object):
+
+    """
+    Stands in for the AppThread as the 'master' of the StimCanvas inside
+    the renderer process. Shared parameters are read from (and written to)
+    shared memory, everything else comes from the configuration that the
+    renderer was started with.
+    """
+
+    controlwindow = None
+    current_task = None
+    # no preview canvas in this process
+    show_preview = False
+
+    def __init__(self, params, events, config):
+        for option, value in config.iteritems():
+            if option not in params:
+                object.__setattr__(self, option, value)
+        object.__setattr__(self, 'params', params)
+        object.__setattr__(self, 'events', events)
+
+    def __getattr__(self, name):
+        # only called for names that aren't found the normal way
+        params = object.__getattribute__(self, 'params')
+        if name in params:
+            return params.get(name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in self.params:
+            # the renderer's own writes (i.e. the photodiode state) don't
+            # count as parameter changes
+            self.params.set(name, value, notify=False)
+        else:
+            object.__setattr__(self, name, value)
+
+    def onTaskFinished(self, event):
+        task = event.task
+        if task is not self.current_task:
+            return
+        self.show_photodiode = False
+        self.stimcanvas.do_refresh_everything = True
+        self.stimcanvas.task_finished()
+        self.events.put(('finished', task.taskname,
+                         event.actualstimtimes.tolist()))
+
+
+class RendererProcess(multiprocessing.Process):
+
+    """
+    The stimulus window, StimCanvas and render timer, in their own process
+    and wx main loop. 'config' is a flat dict of {option: value} for every
+    option in the config template.
+
+    Methods (UI side):
+        send(name, *args)
+        poll_events()
+        shutdown(timeout)
+    """
+
+    def __init__(self, config, template):
+        super(RendererProcess, self).__init__()
+        self.daemon = True
+        self.framelog = framelog.FrameLog.create(config['log_nframes'])
+        self.config = dict(config, framelog_path=self.framelog.path)
+        self.params = SharedParams(
+            [(name, config.get(name, value))
+             for name, value in shared_defaults(template)])
+        self.status = SharedParams(STATUS_FIELDS)
+        self.commands = multiprocessing.Queue()
+        self.events = multiprocessing.Queue()
+
+    #-----------------------------------------------------------------------
+    # UI side
+
+    def send(self, name, *args):
+        self.commands.put((name,) + args)
+
+    def poll_events(self):
+        """ the renderer's events since the last call, without blocking """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except Queue.Empty:
+                return events
+
+    def shutdown(self, timeout=2.):
+        if self.is_alive():
+            self.send('quit')
+            self.join(timeout)
+        if self.is_alive():
+            self.terminate()
+        self.framelog.close()
+
+    #-----------------------------------------------------------------------
+    # renderer side
+
+    def run(self):
+        app = wx.App()
+        master = RendererMaster(self.params, self.events, self.config)
+        master.eventbus = events.EventBus(call=wx.CallAfter,
+                                          thread_init=realtime.release)
+        master.eventbus.subscribe(master.onTaskFinished, events.TaskFinished)
+        self.master = master
+        realtime.configure(master)
+        self.seen_version = -1
+
+        # our startup timings go back to the AppThread with the first frame
+        startup.profile.listeners = [self._first_frame]
+
+        with startup.profile.phase('stimulus window'):
+            self.frame = wx.Frame(
+                None, -1, size=(master.x_resolution, master.y_resolution),
+                title='Stimulus window')
+            self.frame.Bind(wx.EVT_CLOSE, self.onClose)
+            self.frame.timer = rt.ThreadTimer(self.frame)
+            self.canvas = glc.StimCanvas(self.frame, master)
+            master.stimframe = self.frame
+            master.stimcanvas = self.canvas
+            self.frame.Bind(rt.EVT_THREAD_TIMER, self.onFrame)
+            self.frame.Show()
+
+        # commands are read in a separate thread and handed to the main
+        # loop, so the main loop never blocks on the queue
+        reader = threading.Thread(target=self._read_commands)
+        reader.daemon = True
+        reader.start()
+
+        app.MainLoop()
+
+    def _read_commands(self):
+        realtime.release()
+        while True:
+            command = self.commands.get()
+            wx.CallAfter(self.onCommand, *command)
+            if command[0] == 'quit':
+                break
+
+    def _first_frame(self, profile):
+        self.events.put(('first_frame', profile.firstframe, profile.phases))
+
+    def onClose(self, event=None):
+        # the UI decides when we quit
+        self.events.put(('closed',))
+
+    def onFrame(self, event=None):
+        canvas = self.canvas
+        version = self.params.version.value
+        if version != self.seen_version:
+            self.seen_version = version
+            canvas.recalc_stim_bounds()
+            canvas.recalc_photo_bounds()
+            canvas.do_refresh_everything = True
+
+        canvas.onDraw(event)
+
+        status = self.status
+        status.set('slowestframe', canvas.slowestframe, notify=False)
+        task = self.master.current_task
+        if task is not None:
+            status.set('currentframe', task.currentframe, notify=False)
+            status.set('currentstim', task.currentstim, notify=False)
+            status.set('dt', task.dt, notify=False)
+            status.set('starttime', task.starttime, notify=False)
+
+    def onCommand(self, name, *args):
+        getattr(self, 'cmd_' + name)(*args)
+
+    def cmd_task(self, task, seq=0):
+        self.master.current_task = None if task is None else task(self.canvas)
+        self.status.set('starttime', -1., notify=False)
+        self.status.set('taskseq', seq, notify=False)
+        self.cmd_refresh()
+
+    def cmd_reinit(self):
+        if self.master.current_task is not None:
+            self.master.current_task._reinit()
+        self.canvas.drawcount = 0
+
+    def cmd_schedule(self, t, align):
+        if self.master.current_task is not None:
+            self.master.current_task._schedule(t, align)
+
+    def cmd_refresh(self):
+        self.canvas.recalc_stim_bounds()
+        self.canvas.recalc_photo_bounds()
+        self.canvas.do_refresh_everything = True
+
+    def cmd_gamma(self):
+        self.canvas.SetCurrent()
+        self.canvas.update_gamma()
+
+    def cmd_timer_start(self, interval):
+        self.canvas.timer.start(interval)
+
+    def cmd_timer_pause(self):
+        self.canvas.timer.pause()
+
+    def cmd_timer_resume(self):
+        self.canvas.timer.resume()
+
+    def cmd_timer_stop(self):
+        self.canvas.timer.stop()
+
+    def cmd_fullscreen(self, show):
+        self.frame.ShowFullScreen(show, style=wx.FULLSCREEN_ALL)
+
+    def cmd_on_top(self, ontop):
+        style = self.frame.GetWindowStyle() & ~wx.STAY_ON_TOP
+        if ontop:
+            style |= wx.STAY_ON_TOP
+        self.frame.SetWindowStyle(style)
+
+    def cmd_clear_logs(self):
+        self.canvas.clear_logs()
+
+    def cmd_quit(self):
+        self.canvas.timer.stop()
+        self.canvas.close_logs()
+        self.frame.Destroy()
+
+
+class RemoteTimer(object):
+
+    """ the render timer of a RendererProcess, from the UI side """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def start(self, interval):
+        self.renderer.send('timer_start', interval)
+
+    def pause(self):
+        self.renderer.send('timer_pause')
+
+    def resume(self):
+        self.renderer.send('timer_resume')
+
+    def stop(self):
+        self.renderer.send('timer_stop')
+
+
+class RemoteCanvas(object):
+
+    """
+    Takes the place of the StimCanvas in the UI process when the renderer
+    is separate. Implements the parts of the StimCanvas interface that the
+    control window uses.
+    """
+
+    listeners = ()
+    drawcount = 0
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.timer = RemoteTimer(renderer)
+        # mapped from the same file as the renderer's
+        self.framelog = renderer.framelog
+
+    @property
+    def slowestframe(self):
+        return self.renderer.status.get('slowestframe')
+
+    @property
+    def do_refresh_everything(self):
+        return False
+
+    @do_refresh_everything.setter
+    def do_refresh_everything(self, value):
+        if value:
+            self.renderer.send('refresh')
+
+    def task_finished(self):
+        # the renderer's own TaskFinished handler takes care of this
+        pass
+
+    def recalc_stim_bounds(self):
+        self.renderer.send('refresh')
+
+    def recalc_photo_bounds(self):
+        self.renderer.send('refresh')
+
+    def close_logs(self):
+        # the renderer closes its own telemetry and session logs
+        self.framelog.close()
+
+    def update_gamma(self):
+        self.renderer.send('gamma')
+
+    def clear_logs(self):
+        # the renderer is the only process that writes to the log
+        self.renderer.send('clear_logs')
+
+
+class RemoteFrame(object):
+
+    """
+    Takes the place of the stimulus frame in the UI process when the
+    renderer is separate
+    """
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+
+    def GetWindowStyle(self):
+        return wx.DEFAULT_FRAME_STYLE
+
+    def SetWindowStyle(self, style):
+        self.renderer.send('on_top', bool(style & wx.STAY_ON_TOP))
+
+    def ShowFullScreen(self, show, style=wx.FULLSCREEN_ALL):
+        self.renderer.send('fullscreen', show)
+
+    def Destroy(self):
+        self.renderer.shutdown()
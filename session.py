@@ -0,0 +1,144 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+
+import numpy as np
+
+"""
+Runs a whole playlist on one clock. When a playlist is started with 'Auto
+start' on, its items are compiled into a single timeline:
+
+    onsets      absolute start time of each item, relative to the start of
+                the session, with 'session_gap' seconds between items
+    frame0      number of scan frames before each item
+    stimonsets  absolute onset of every stimulus in the session
+
+Each task after the first is scheduled to start at its onset in this
+timeline (see Task._schedule) rather than whenever the previous one
+happened to finish. With 'session_align' on, a task that starts late is
+anchored to its scheduled time anyway and catches up, so start-up slop
+doesn't accumulate over a long session. Jumping to another item by hand
+re-anchors the timeline at that item.
+"""
+
+
+class Session(object):
+
+    """
+    Methods:
+        anchor(index, now)
+        start_time(index, now)
+        task_finished(task, now)
+        remaining(now)
+        progress(task)
+    """
+
+    def __init__(self, tasks, gap=0., align=True):
+        self.gap = gap
+        self.align = align
+        self.ntasks = len(tasks)
+
+        durations, nframes, stimtimes = [], [], []
+        instances = {}
+        for task in tasks:
+            inst = instances.get(task.taskname)
+            if inst is None:
+                inst = task(draw=False)
+                instances[task.taskname] = inst
+            durations.append(inst.finishtime)
+            nframes.append(inst.nframes)
+            stimtimes.append(inst.theoreticalstimtimes)
+
+        self.durations = np.array(durations, dtype=np.float64)
+        self.nframes = np.array(nframes, dtype=np.int64)
+        self.onsets = np.cumsum(self.durations + gap) - self.durations - gap
+        self.offsets = self.onsets + self.durations
+        self.frame0 = np.cumsum(self.nframes) - self.nframes
+        self.totalframes = int(self.nframes.sum())
+        self.total = float(self.offsets[-1]) if self.ntasks else 0.
+        # the timeline repeats with this period if the playlist does
+        self.period = self.total + gap
+
+        self.stimonsets = np.concatenate(
+            [onset + st for onset, st in zip(self.onsets, stimtimes)]
+            or [np.empty(0)])
+        self.stimitems = np.repeat(np.arange(self.ntasks),
+                                   [st.size for st in stimtimes])
+
+        self.t0 = None
+        self.index = 0
+        self.cycle = 0
+        self.expect_next = False
+        # (index, start lag, finish error) for every task that finished
+        self.history = []
+
+    def scheduled_start(self, index):
+        return self.t0 + self.cycle * self.period + self.onsets[index]
+
+    def anchor(self, index, now=None):
+        """ (re)start the timeline so that item 'index' starts now """
+        if now is None:
+            now = time.time()
+        self.index = index
+        self.cycle = 0
+        self.expect_next = False
+        self.t0 = now - self.onsets[index]
+
+    def start_time(self, index, now=None):
+        """
+        When item 'index' should start, or None if it should just start
+        straight away. If the previous item just finished this is its
+        place in the timeline. Otherwise we've been moved to 'index' by
+        hand, so the timeline is re-anchored there.
+        """
+        if not self.expect_next:
+            self.anchor(index, now)
+            return None
+        self.expect_next = False
+        if index <= self.index:
+            # the playlist has wrapped around
+            self.cycle += 1
+        self.index = index
+        return self.scheduled_start(index)
+
+    def task_finished(self, task, now=None):
+        """
+        Called when the current item finishes. Returns how late it
+        finished relative to the timeline (sec).
+        """
+        if now is None:
+            now = time.time()
+        self.expect_next = True
+        error = now - (self.scheduled_start(self.index)
+                       + self.durations[self.index])
+        self.history.append((self.index, getattr(task, '_startlag', 0.),
+                             error))
+        return error
+
+    def remaining(self, now=None):
+        """ seconds until the end of the session (or of this cycle) """
+        if now is None:
+            now = time.time()
+        return max(0., self.t0 + self.cycle * self.period + self.total - now)
+
+    def progress(self, task):
+        """ scan frames elapsed in the session so far """
+        frame = self.frame0[self.index]
+        if task is not None:
+            frame += task.currentframe
+        return int(frame)
@@ -0,0 +1,231 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+import telemetry
+
+"""
+On-disk session logs, for analysing long runs after the fact (see
+logreport.py). Set 'log_directory' in the [logs] section of the config file
+to enable them. Every run of tadpydoodle gets its own directory in there:
+
+    header.json     format, version, record dtype, start time
+    frames.bin      one telemetry.RECORD_DTYPE record per frame, appended
+                    in batches - frame times, draw and photodiode flags,
+                    task progress
+    events.jsonl    one JSON object per line for every task that starts,
+                    finishes or is stopped part way through, with its
+                    theoretical and actual stimulus times (and anything
+                    listed in the task's 'log_attrs', e.g. noise seeds)
+
+frames.bin is just a flat array of records, so it can be memory-mapped
+however long it gets (see SessionLogReader). Unlike the frame log
+(framelog.py) nothing is ever overwritten.
+"""
+
+FORMAT = 'tadpydoodle-session-log'
+VERSION = 1
+
+HEADER_FILE = 'header.json'
+FRAMES_FILE = 'frames.bin'
+EVENTS_FILE = 'events.jsonl'
+
+
+def _new_directory(root):
+    root = os.path.expanduser(root)
+    base = os.path.join(root, time.strftime('%Y%m%d-%H%M%S'))
+    path = base
+    suffix = 1
+    while os.path.exists(path):
+        path = '%s-%i' % (base, suffix)
+        suffix += 1
+    os.makedirs(path)
+    return path
+
+
+class SessionLog(telemetry.RecordBuffer):
+
+    """
+    Writes a session log. record() is called once per frame by the
+    stimulus canvas, and also notices when the task starts and finishes.
+
+    Methods:
+        record(now, frametime, gcpause, drawflags, task, running)
+        event(name, **fields)
+        flush()
+        close()
+    """
+
+    def __init__(self, root, batch=600):
+        telemetry.RecordBuffer.__init__(self, batch)
+        self.path = _new_directory(root)
+        with open(os.path.join(self.path, HEADER_FILE), 'w') as f:
+            json.dump({'format': FORMAT, 'version': VERSION,
+                       'dtype': telemetry.RECORD_DTYPE.descr,
+                       'started': time.time()}, f, indent=1)
+        self.frames = open(os.path.join(self.path, FRAMES_FILE), 'ab')
+        self.events = open(os.path.join(self.path, EVENTS_FILE), 'a')
+
+        # the task run we're watching
+        self.task = None
+        self.taskstart = -1
+        self.taskdone = False
+        self.run = -1
+
+    def record(self, now, frametime, gcpause, drawflags, task, running):
+        """ called once per frame """
+        if task is not None and (task is not self.task
+                                 or task.starttime != self.taskstart):
+            self._task_changed(task, now)
+        if task is not None and task.finished and not self.taskdone:
+            self.taskdone = True
+            self.event('task_finished', time=now, frame=self.frame,
+                       run=self.run, taskname=task.taskname,
+                       actualstimtimes=task.actualstimtimes.tolist())
+        telemetry.RecordBuffer.record(self, now, frametime, gcpause,
+                                      drawflags, task, running)
+
+    def _task_changed(self, task, now):
+        if self.taskstart != -1 and not self.taskdone:
+            # the last run was stopped (or replaced) before it finished
+            self.event('task_stopped', time=now, frame=self.frame,
+                       run=self.run, taskname=self.task.taskname)
+        self.task = task
+        self.taskstart = task.starttime
+        self.taskdone = False
+        if task.starttime != -1:
+            self.run += 1
+            self.event('task_started', time=now, frame=self.frame,
+                       run=self.run, taskname=task.taskname,
+                       subclass=task.subclass,
+                       starttime=task.starttime,
+                       finishtime=float(task.finishtime),
+                       scan_hz=float(task.scan_hz),
+                       nframes=int(task.nframes),
+                       theoreticalstimtimes=(
+                           task.theoreticalstimtimes.tolist()),
+                       **self._task_attrs(task))
+
+    def _task_attrs(self, task):
+        # whatever else the task asks us to record (see Task.log_attrs),
+        # as plain values. attributes it doesn't have (yet) are null
+        attrs = {}
+        for name in getattr(task, 'log_attrs', ()):
+            value = getattr(task, name, None)
+            attrs[name] = None if value is None \
+                else np.asarray(value).tolist()
+        return attrs
+
+    def event(self, name, **fields):
+        fields['event'] = name
+        self.events.write(json.dumps(fields) + '\n')
+        self.events.flush()
+
+    def flush(self):
+        """ append the records collected so far to frames.bin """
+        if self.n:
+            self.frames.write(self.records[:self.n].tostring())
+            self.frames.flush()
+        self.n = 0
+
+    def close(self):
+        if self.frames.closed:
+            return
+        self.flush()
+        self.frames.close()
+        self.events.close()
+
+
+class SessionLogReader(object):
+
+    """
+    Reads a session log without loading it: 'frames' is a read-only
+    memory-mapped array of records, 'events' a list of dicts.
+
+    Methods:
+        chunks(size)
+        runs()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_FILE)) as f:
+            self.header = json.load(f)
+        if self.header.get('format') != FORMAT:
+            raise ValueError('%s is not a session log' % path)
+        if self.header.get('version', 0) > VERSION:
+            raise ValueError('%s was written by a newer version of '
+                             'tadpydoodle' % path)
+        self.dtype = np.dtype([(str(name), str(fmt))
+                               for name, fmt in self.header['dtype']])
+
+        framefile = os.path.join(path, FRAMES_FILE)
+        # ignore a partly written record at the end
+        nframes = os.path.getsize(framefile) // self.dtype.itemsize
+        if nframes:
+            self.frames = np.memmap(framefile, dtype=self.dtype, mode='r',
+                                    shape=(nframes,))
+        else:
+            self.frames = np.zeros(0, dtype=self.dtype)
+
+        self.events = []
+        with open(os.path.join(path, EVENTS_FILE)) as f:
+            for line in f:
+                try:
+                    self.events.append(json.loads(line))
+                except ValueError:
+                    # cut off mid-line
+                    break
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def chunks(self, size=1 << 20):
+        """ yield (offset, records) for consecutive chunks of frames """
+        for start in xrange(0, len(self), size):
+            yield start, self.frames[start:start + size]
+
+    def runs(self):
+        """
+        one dict per task run: the 'task_started' event, plus 'end' (the
+        frame after the run), 'finished' and 'actualstimtimes' if it
+        finished
+        """
+        runs = {}
+        order = []
+        for event in self.events:
+            name = event['event']
+            if name == 'task_started':
+                run = dict(event, end=len(self), finished=False,
+                           actualstimtimes=None)
+                runs[event['run']] = run
+                order.append(run)
+            elif event.get('run') in runs:
+                run = runs[event['run']]
+                run['end'] = event['frame']
+                if name == 'task_finished':
+                    run['finished'] = True
+                    run['actualstimtimes'] = event['actualstimtimes']
+        # a run without an explicit end lasts until the next one starts
+        for run, nextrun in zip(order[:-1], order[1:]):
+            run['end'] = min(run['end'], nextrun['frame'])
+        return order
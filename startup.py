@@ -0,0 +1,107 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import time
+import json
+from contextlib import contextmanager
+
+# as close to launch as we can get without hooking the interpreter
+LAUNCHED = time.time()
+
+"""
+Startup timing. Each phase of startup (imports, config, windows, GL setup,
+shader compilation, task discovery...) is timed with
+
+    >>> with startup.profile.phase('config'):
+    ...     loadConfig()
+
+and when the first frame has been presented the stimulus canvas calls
+profile.first_frame(), which hands the profile to its listeners - the
+AppThread prints a report and can save it as JSON for
+testing/startup_benchmark.py. A separate renderer process passes its own
+phases back to the AppThread (see renderer.py).
+"""
+
+
+class StartupProfile(object):
+
+    """
+    Methods:
+        phase(name)
+        add(name, start, duration)
+        merge(phases)
+        first_frame(t)
+        report()
+        save(path)
+    """
+
+    def __init__(self, launched=LAUNCHED):
+        self.launched = launched
+        # (name, start, duration) tuples, in seconds since the epoch
+        self.phases = []
+        self.firstframe = None
+        self.listeners = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time() - start)
+
+    def add(self, name, start, duration):
+        self.phases.append((name, start, duration))
+
+    def merge(self, phases):
+        """ add phases recorded elsewhere (i.e. in another process) """
+        for phase in phases:
+            phase = tuple(phase)
+            if phase not in self.phases:
+                self.phases.append(phase)
+
+    def first_frame(self, t=None):
+        """ called once the first frame has been presented """
+        if self.firstframe is not None:
+            return
+        self.firstframe = time.time() if t is None else t
+        for listener in self.listeners:
+            listener(self)
+
+    def report(self):
+        lines = ['Startup (msec since launch):']
+        for name, start, duration in sorted(self.phases,
+                                            key=lambda p: p[1]):
+            lines.append('  %-20s %8.1f  +%.1f' % (
+                name, (start - self.launched) * 1E3, duration * 1E3))
+        if self.firstframe is not None:
+            lines.append('  %-20s %8.1f' % (
+                'first frame', (self.firstframe - self.launched) * 1E3))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'launched': self.launched,
+                       'first_frame': self.firstframe,
+                       'phases': [{'name': name, 'start': start,
+                                   'duration': duration}
+                                  for name, start, duration in self.phases]},
+                      f, indent=1)
+
+
+# one per process
+profile = StartupProfile()
@@ -17,21 +17,25 @@ You should have received a copy of the GNU General Public License
 along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import startup
 import wx
 import multiprocessing
 from ConfigParser import SafeConfigParser
 import os
 import copy
-import imp
-import inspect
 import time
+import argparse
+import numpy as np
 
 import glcanvases as glc
-reload(glc)
 import gui_elements as gui
-reload(gui)
 import render_timer as rt
-reload(rt)
+import task_index as ti
+import renderer as rd
+import realtime
+import session as ss
+import remote
+from base_tasks import events
 
 __version__ = "1.0"
 
@@ -42,21 +46,29 @@ class AppThread(multiprocessing.Process):
     template = {
         'window': {'x_resolution': 800, 'y_resolution': 600,
                    'fullscreen': False, 'on_top': True, 'gamma': 1.7,
-                   'screenh':20., 'screend':10.},
+                   'screenh':20., 'screend':10., 'window_delay': 0.1},
         'photodiode': {'show_photodiode': True, 'p_xpos': 300.,
                        'p_ypos': 100., 'p_scale': 20.},
         'crosshairs': {'show_crosshairs': True, 'c_xpos': 300.,
                        'c_ypos': 600., 'c_scale': 145.},
         'stimulus': {'show_preview': True, 'log_framerate': False,
                      'log_nframes': 10000, 'run_loop': True, 'vblank_mode': -1,
-                     'min_delta_t': 2., 'framerate_window': 100},
+                     'min_delta_t': 2., 'framerate_window': 100,
+                     'gc_mode': 'auto', 'separate_renderer': False},
+        'realtime': {'rt_enable': False, 'rt_policy': 'fifo',
+                     'rt_priority': 50, 'rt_cpus': '', 'rt_mlockall': True},
+        'telemetry': {'telemetry_socket': '', 'telemetry_batch': 60},
+        'remote': {'remote_address': ''},
+        'logs': {'log_directory': ''},
         'playlist': {'playlist_directory': 'playlists',
-                     'repeat_playlist': True, 'auto_start_tasks': False}
+                     'repeat_playlist': True, 'auto_start_tasks': False,
+                     'session_gap': 0., 'session_align': True}
     }
 
     # configuration file
     configroot = '~/.tadpydoodle'
     configfile = 'tadpydoodlerc'
+    taskindexfile = 'task_index'
 
     # tasks
     base_taskdir = './base_tasks'
@@ -64,14 +76,48 @@ class AppThread(multiprocessing.Process):
     run_task = False
     current_task = None
     taskdict = None
+    taskindex = None
+
+    # the RendererProcess, if 'separate_renderer' is set
+    renderer = None
+    # number of tasks sent to it so far
+    renderer_taskseq = 0
+    # how often we check on it (msec)
+    renderer_poll_interval = 100
+
+    # the running playlist's timeline (see session.py)
+    session = None
+
+    # the remote control server, if 'remote_address' is set
+    remote = None
+
+    # task lifecycle events (see base_tasks/events.py)
+    eventbus = None
+
+    # write the startup profile (see startup.py) here once the first frame
+    # is up, and optionally quit straight away (see __main__)
+    startup_profile_path = None
+    quit_after_first_frame = False
+
+    def __setattr__(self, name, value):
+        multiprocessing.Process.__setattr__(self, name, value)
+        # live parameters also have to reach a separate renderer
+        renderer = self.__dict__.get('renderer')
+        if renderer is not None and name in renderer.params:
+            renderer.params.set(name, value)
 
     def run(self):
 
+        profile = startup.profile
+        profile.add('imports', profile.launched,
+                    time.time() - profile.launched)
+        profile.listeners.append(self.onFirstFrame)
+
         print "Starting TadPyDoodle v%s" % __version__
-        app = wx.App()
 
         print "Loading configuration..."
-        self.loadConfig()
+        with profile.phase('config'):
+            self.loadConfig()
 
         # setting this environment variable forces vsync on/off (on my
         # Acer laptop, Intel Sandy Bridge built-in grapics...)
@@ -79,35 +125,204 @@ class AppThread(multiprocessing.Process):
             os.environ.update({'vblank_mode': str(self.vblank_mode)})
         # print 'vblank_mode: %s' % os.environ.get('vblank_mode','undefined')
 
-        print "Initialising stimulus window..."
-        # we need to pause here, or for some reason the thread stalls
-        # when creating the stimulus frame (but only on the
-        # workstation?!)
-        time.sleep(0.1)
-        self.stimframe = wx.Frame(None, -1,
-                                  size=(self.x_resolution, self.y_resolution),
-                                  title='Stimulus window')
-        self.stimframe.Bind(wx.EVT_CLOSE, self.onClose)
-
-        self.stimframe.timer = rt.ThreadTimer(self.stimframe)
-        self.stimcanvas = glc.StimCanvas(self.stimframe, self)
-        self.stimframe.Bind(rt.EVT_THREAD_TIMER, self.stimcanvas.onDraw)
-
-        self.stimframe.Show()
+        if self.separate_renderer:
+            # this has to happen before we create our own wx.App
+            print "Starting renderer process..."
+            with profile.phase('renderer process'):
+                self.startRenderer()
+
+        with profile.phase('wx app'):
+            app = wx.App()
+
+        self.eventbus = events.EventBus(call=wx.CallAfter,
+                                        thread_init=realtime.release)
+        self.eventbus.subscribe(self.onTaskFinished, events.TaskFinished)
+        self.eventbus.subscribe(self.reportTaskTiming, events.TaskFinished,
+                                threaded=True)
+
+        if self.renderer is None:
+            # rendering happens on our main thread
+            realtime.configure(self)
+
+            print "Initialising stimulus window..."
+            # we need to pause here, or for some reason the thread stalls
+            # when creating the stimulus frame (but only on the
+            # workstation?!). set 'window_delay' to 0 where it doesn't
+            if self.window_delay > 0:
+                time.sleep(self.window_delay)
+            with profile.phase('stimulus window'):
+                self.stimframe = wx.Frame(
+                    None, -1, size=(self.x_resolution, self.y_resolution),
+                    title='Stimulus window')
+                self.stimframe.Bind(wx.EVT_CLOSE, self.onClose)
+
+                self.stimframe.timer = rt.ThreadTimer(self.stimframe)
+                self.stimcanvas = glc.StimCanvas(self.stimframe, self)
+                self.stimframe.Bind(rt.EVT_THREAD_TIMER,
+                                    self.stimcanvas.onDraw)
+
+                self.stimframe.Show()
 
         print "Loading tasks..."
-        self.loadTasks()
+        with profile.phase('task discovery'):
+            self.loadTasks()
 
         print "Initialising controls ..."
-        self.controlwindow = gui.ControlWindow(None, self,
-                                               title='TadPyDoodle')
-        self.controlwindow.Bind(wx.EVT_CLOSE, self.onClose)
-        self.controlwindow.Show()
-        self.controlwindow.SetFocus()
+        with profile.phase('control window'):
+            self.controlwindow = gui.ControlWindow(None, self,
+                                                   title='TadPyDoodle')
+            self.controlwindow.Bind(wx.EVT_CLOSE, self.onClose)
+            self.controlwindow.Show()
+            self.controlwindow.SetFocus()
+
+        if self.renderer is not None:
+            self.renderertimer = wx.Timer(self.controlwindow)
+            self.controlwindow.Bind(wx.EVT_TIMER, self.onRendererPoll,
+                                    self.renderertimer)
+            self.renderertimer.Start(self.renderer_poll_interval)
+
+        if self.remote_address:
+            print "Starting remote control on %s..." % self.remote_address
+            self.remote = remote.Server(self.remote_address,
+                                        remote.Controller(self),
+                                        call=wx.CallAfter)
+            self.remote.start()
 
         print "Done"
         app.MainLoop()
 
+    def onFirstFrame(self, profile):
+        """
+        Called once the stimulus window has presented its first frame:
+        report how long startup took
+        """
+        print profile.report()
+        if self.startup_profile_path:
+            profile.save(self.startup_profile_path)
+        if self.quit_after_first_frame:
+            wx.CallAfter(self.onClose, None)
+
+    def startRenderer(self):
+        """
+        Start the stimulus window in its own process (see renderer.py). The
+        control window talks to it through stand-ins for the stimulus
+        frame and canvas.
+        """
+        config = dict((option, getattr(self, option))
+                      for subsect in self.template.itervalues()
+                      for option in subsect)
+        config['run_task'] = self.run_task
+        self.renderer = rd.RendererProcess(config, self.template)
+        self.renderer.start()
+        self.stimframe = rd.RemoteFrame(self.renderer)
+        self.stimcanvas = rd.RemoteCanvas(self.renderer)
+
+    def onRendererPoll(self, event=None):
+        """
+        Handle events from a separate renderer and update the status panel
+        with the current task's progress
+        """
+        task = self.current_task
+        for event in self.renderer.poll_events():
+            if event[0] == 'closed':
+                self.onClose(None)
+                return
+            elif event[0] == 'first_frame':
+                t, phases = event[1:]
+                startup.profile.merge(phases)
+                startup.profile.first_frame(t)
+            elif event[0] == 'finished':
+                taskname, actualstimtimes = event[1:]
+                if task is not None and task.taskname == taskname:
+                    task.actualstimtimes[:] = actualstimtimes
+                    task.finished = True
+                    self.eventbus.publish(events.TaskFinished(
+                        task, time.time(), task.actualstimtimes.copy(),
+                        task.theoreticalstimtimes.copy()))
+
+        if task is not None and self.run_task:
+            status = self.renderer.status
+            task.currentframe = status.get('currentframe')
+            task.currentstim = status.get('currentstim')
+            task.dt = status.get('dt')
+            # our copy is never displayed, so it only knows when it started
+            # from the renderer's - as long as that is the same task
+            if status.get('taskseq') == self.renderer_taskseq:
+                task.starttime = status.get('starttime')
+        self.controlwindow.statuspanel.onUpdate()
+
+    def setCurrentTask(self, task, index=None):
+        """
+        Instantiate the task class 'task' (or None) as the current task.
+        'index' is its position in the playlist, used to schedule it if a
+        session is running
+        """
+        if task is None:
+            self.current_task = None
+        elif self.renderer is None:
+            self.current_task = task(self.stimcanvas)
+        else:
+            # the renderer draws its own instance, ours just keeps track
+            # of the timing
+            self.current_task = task(draw=False)
+        if self.renderer is not None:
+            self.renderer_taskseq += 1
+            self.renderer.send('task', task, self.renderer_taskseq)
+        self.publishEvent('task_changed', index=index,
+                          taskname=getattr(task, 'taskname', None))
+        if self.session is not None and task is not None \
+                and index is not None:
+            t = self.session.start_time(index)
+            if t is not None:
+                self.scheduleTask(t)
+
+    def scheduleTask(self, t):
+        """ start the current task at time 't' """
+        self.current_task._schedule(t, self.session_align)
+        if self.renderer is not None:
+            self.renderer.send('schedule', t, self.session_align)
+
+    def startSession(self, tasks, index):
+        """
+        Compile the playlist 'tasks' into a single timeline, with item
+        'index' (the current task) starting now, or when it started if
+        it's already running, or when it is due to start if it's already
+        been scheduled (e.g. it's waiting out the gap after the last task)
+        """
+        try:
+            session = ss.Session(tasks, self.session_gap, self.session_align)
+        except Exception as e:
+            print "Couldn't compile the session timeline: %s" % e
+            self.session = None
+            return
+        task = self.current_task
+        if task is not None and task.starttime != -1:
+            session.anchor(index, task.starttime)
+        elif task is not None and task._startat is not None:
+            session.anchor(index, task._startat)
+        else:
+            session.anchor(index)
+        self.session = session
+        if task is not None and task.starttime == -1 \
+                and task._startat is None:
+            self.scheduleTask(session.scheduled_start(index))
+        print "Session: %i tasks, %s" % (
+            session.ntasks, gui.seconds2human(session.total))
+
+    def stopSession(self):
+        self.session = None
+
+    def publishEvent(self, event, **fields):
+        """ tell remote control clients that something happened """
+        if self.remote is not None:
+            self.remote.publish(event, **fields)
+
+    def reinitTask(self):
+        """ return the current task to its initialised state """
+        self.current_task._reinit()
+        if self.renderer is not None:
+            self.renderer.send('reinit')
+
     def resetConfig(self, event=None):
         """
         Resets the configuration to the hard-coded defaults specified in
@@ -192,12 +407,24 @@ class AppThread(multiprocessing.Process):
         path = os.path.join(root, self.configfile)
         parser.write(open(path, 'w'))
 
-    def loadTasks(self, event=None):
+    def loadTasks(self, event=None, callback=None):
         """
-        Recursively compile and  load all tasks in 'self.taskdir' and
-        its subdirectories. Tasks may be defined in any source file, but
-        each must have the '.taskname' attribute in order to be
-        recognised. Duplicate tasknames are skipped with a warning.
+        Recursively discover all tasks in 'self.base_taskdir',
+        'self.user_taskdir' and their subdirectories. Tasks may be defined
+        in any source file, but each must have the '.taskname' attribute
+        in order to be recognised. Duplicate tasknames are skipped with a
+        warning.
+
+        Discovery is incremental: an index of module path --> mtime/hash
+        --> exported task names is kept in
+        '<self.configroot>/<self.taskindexfile>', and only modules that
+        have changed since the last call are re-executed (each in its own
+        worker process). Everything else is represented by LazyTask
+        placeholders that import their module on first use.
+
+        If 'callback' is given, discovery happens in the background and
+        'callback' is called on the wx main loop once 'self.taskdict' has
+        been updated.
         """
 
         base_taskdir, user_taskdir = (
@@ -209,49 +436,88 @@ class AppThread(multiprocessing.Process):
             if not os.path.exists(pth):
                 os.makedirs(pth)
 
-        def istask(obj):
-            return hasattr(obj, 'taskname')
-
-        names = []
-        objects = []
-        for pth in (base_taskdir, user_taskdir):
-            for relpath, _, fullnames in os.walk(pth):
-                for fullname in fullnames:
-                    fname, ext = os.path.splitext(fullname)
-                    if ext.lower() == '.py':
-                        # print os.path.join(relpath,fullname)
-                        mod = imp.load_source(fname,
-                                              os.path.join(relpath, fullname))
-                    # we don't want to do this if we've made changes to the
-                    # source files
-                    # elif ext.lower() == '.pyc':
-                    #   mod = imp.load_compiled(fname,
-                    #                           os.path.join(relpath,fullname))
-
-                    else:
-                        continue
-
-                    for name, obj in inspect.getmembers(mod,
-                                                        predicate=istask):
-
-                        if obj.taskname in names:
-                            print 'Ignoring duplicate of task "%s" in %s' \
-                                % (obj.taskname, fullname)
-                        else:
-                            names.append(obj.taskname)
-                            objects.append(obj)
-                    del mod
-
-        self.current_task = None
-        self.taskdict = dict(zip(names, objects))
+        if self.taskindex is None:
+            root = self.configroot.replace('~', os.getenv('HOME'))
+            self.taskindex = ti.TaskIndex(
+                os.path.join(root, self.taskindexfile))
+
+        dirs = (base_taskdir, user_taskdir)
+        if callback is None:
+            self.current_task = None
+            self.taskdict = ti.build_taskdict(self.taskindex.update(dirs))
+        else:
+            def done(found):
+                taskdict = ti.build_taskdict(found)
+                wx.CallAfter(self._set_taskdict, taskdict, callback)
+            self.taskindex.update_async(dirs, done)
+
+    def _set_taskdict(self, taskdict, callback):
+        self.taskdict = taskdict
+        callback()
+
+    def onTaskFinished(self, event):
+        """
+        Handles TaskFinished events from the current task. Switches the
+        photodiode off and moves on to the next task in the playlist.
+        """
+        task = event.task
+        if task is not self.current_task:
+            # we've moved on since it finished
+            return
+        ctrl = self.controlwindow
+        pd_checkbox = ctrl.optionpanel.checkboxes['show_photodiode']
+        pd_checkbox.ref.set(False)
+        self.show_photodiode = False
+        self.stimcanvas.do_refresh_everything = True
+        self.stimcanvas.task_finished()
+        wx.Bell()
+
+        self.publishEvent('task_finished', taskname=task.taskname,
+                          actualstimtimes=event.actualstimtimes.tolist())
+
+        if self.session is not None:
+            late = self.session.task_finished(task)
+            print "Session: finished %.1fms after schedule, %s remaining" % (
+                late * 1E3, gui.seconds2human(self.session.remaining()))
+
+        if not self.auto_start_tasks:
+            ctrl.playlistpanel.onRunTask()
+        ctrl.playlistpanel.Next()
+
+    def reportTaskTiming(self, event):
+        """
+        print a finished task's stimulus timing, off the main loop. only
+        the event's copies of the stimulus times are safe to use here
+        """
+        print "Task '%s' finished: %s" % (event.task.taskname, time.asctime())
+        print("Absolute difference between "
+              "theoretical and actual stimulus times:")
+        print np.abs(event.actualstimtimes - event.theoreticalstimtimes)
 
     def onClose(self, event):
+        if self.remote is not None:
+            self.remote.close()
+            self.remote = None
+        if self.eventbus is not None:
+            self.eventbus.close()
+        if self.renderer is not None:
+            self.renderertimer.Stop()
         if self.stimframe:
             self.stimcanvas.timer.stop()
+            self.stimcanvas.close_logs()
             self.stimframe.Destroy()
         if self.controlwindow:
             self.controlwindow.Destroy()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='TadPyDoodle')
+    parser.add_argument('--startup-profile', default=None, metavar='PATH',
+                        help='save the startup timings (JSON) to PATH')
+    parser.add_argument('--quit-after-first-frame', action='store_true',
+                        help='quit once the first frame is up, for '
+                             'benchmarking startup')
+    args = parser.parse_args()
     t = AppThread()
+    t.startup_profile_path = args.startup_profile
+    t.quit_after_first_frame = args.quit_after_first_frame
     t.run()
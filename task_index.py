@@ -0,0 +1,521 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import imp
+import time
+import shutil
+import inspect
+import hashlib
+import cPickle
+import tempfile
+import subprocess
+import multiprocessing
+import threading
+import traceback
+
+import numpy as np
+
+import realtime
+
+# bump this whenever the layout of the index records changes, so that stale
+# index files get thrown away rather than misread
+INDEX_VERSION = 3
+
+# parameter values of these types get copied into the index
+_simpletypes = (bool, int, long, float, str, unicode)
+
+# modules that have already been imported in this session, keyed by path.
+# values are (mtime, module)
+_modcache = {}
+
+# scan workers run this file as a script
+_worker_script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+
+
+def istask(obj):
+    return hasattr(obj, 'taskname')
+
+
+def file_md5(path):
+    """ md5 hex digest of the contents of a file """
+    h = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), ''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def import_module(path):
+    """
+    Compile and import a task module from 'path', bypassing the session
+    module cache. The fresh module is stored in the cache afterwards.
+    """
+    fname = os.path.splitext(os.path.basename(path))[0]
+    mtime = os.stat(path).st_mtime
+    mod = imp.load_source(fname, path)
+    _modcache[path] = (mtime, mod)
+    return mod
+
+
+def get_module(path):
+    """
+    Return the module at 'path', importing it only if we haven't already
+    done so since it was last modified
+    """
+    try:
+        mtime, mod = _modcache[path]
+        if os.stat(path).st_mtime == mtime:
+            return mod
+    except (KeyError, OSError):
+        pass
+    return import_module(path)
+
+
+def simple_value(value):
+    """
+    convert a task parameter to plain python types that can be pickled
+    without importing anything, or return None if it can't be converted
+    """
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    elif isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, _simpletypes):
+        return value
+    if isinstance(value, (tuple, list)):
+        items = [simple_value(vv) for vv in value]
+        if None not in items:
+            return type(value)(items)
+    return None
+
+
+def task_params(obj):
+    """ the public, plain-valued class attributes of a task """
+    params = {}
+    for name in dir(obj):
+        if name.startswith('_'):
+            continue
+        value = simple_value(getattr(obj, name))
+        if value is not None:
+            params[name] = value
+    return params
+
+
+def task_metadata(clsname, obj):
+    """ the information about a task class that we keep in the index """
+    return {'taskname': obj.taskname,
+            'subclass': obj.subclass,
+            'clsname': clsname,
+            'params': task_params(obj)}
+
+
+def scan_module(path):
+    """
+    Import the module at 'path' and return a list of metadata dicts, one
+    for each task class that it exports
+    """
+    mod = import_module(path)
+    return [task_metadata(name, obj)
+            for name, obj in inspect.getmembers(mod, predicate=istask)]
+
+
+def scan_job(path):
+    """
+    Runs in a worker interpreter. Returns (path, record), where 'record' is
+    the index record for the module. If the module couldn't be imported,
+    record['error'] holds the formatted traceback.
+    """
+    st = os.stat(path)
+    rec = {'mtime': st.st_mtime, 'size': st.st_size, 'md5': file_md5(path),
+           'entries': [], 'error': None}
+    try:
+        rec['entries'] = scan_module(path)
+    except Exception:
+        rec['error'] = traceback.format_exc()
+    return path, rec
+
+
+class LazyTask(object):
+
+    """
+    Stands in for a task class. It carries just enough metadata to populate
+    the task tree and the playlist, and only imports the module that
+    defines the task when the class itself is needed (e.g. when it gets
+    instantiated).
+
+    'timeline' is a summary of the task's timing, if we know it without
+    instantiating the task (see manifest.py).
+
+    Calling a LazyTask instantiates the underlying task class, and any
+    other attribute lookups are passed through to the class.
+    """
+
+    timeline = None
+
+    def __init__(self, taskname, subclass, modpath, clsname, params=None):
+        self.taskname = taskname
+        self.subclass = subclass
+        self.modpath = modpath
+        self.clsname = clsname
+        self.params = params or {}
+        self._cls = None
+
+    def resolve(self):
+        """ import the defining module (if necessary), return the class """
+        if self._cls is None:
+            mod = get_module(self.modpath)
+            self._cls = getattr(mod, self.clsname)
+        return self._cls
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # don't trigger an import for special method lookups (pickle,
+        # copy etc. probe for these)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cls'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def __repr__(self):
+        return "<LazyTask '%s' (%s:%s)>" % (self.taskname, self.modpath,
+                                            self.clsname)
+
+
+def build_taskdict(found):
+    """
+    Turn the (modpath, metadata) tuples returned by TaskIndex.update()
+    into a dict of {taskname: LazyTask}. Duplicate tasknames are skipped
+    with a warning.
+    """
+    taskdict = {}
+    for modpath, meta in found:
+        if meta['taskname'] in taskdict:
+            print 'Ignoring duplicate of task "%s" in %s' \
+                % (meta['taskname'], os.path.basename(modpath))
+        else:
+            taskdict[meta['taskname']] = LazyTask(
+                meta['taskname'], meta['subclass'], modpath,
+                meta['clsname'], meta['params'])
+    return taskdict
+
+
+class TaskCatalog(object):
+
+    """
+    The task tree's view of a task registry (a {taskname: task} dict): the
+    subclasses and the tasknames in each, in sorted order, narrowed down
+    by a search query.
+
+    A task matches a query if every word in the query appears in its
+    taskname or subclass (ignoring case). Typing more of the same query
+    only rescans the tasks that matched the last one.
+
+    Methods:
+        search(query)
+        branches()
+        children(subclass)
+    """
+
+    def __init__(self, taskdict):
+        self.entries = sorted((task.subclass, name)
+                              for name, task in (taskdict or {}).iteritems())
+        self.keys = [('%s %s' % (name, subclass)).lower()
+                     for subclass, name in self.entries]
+        self.query = ''
+        self.matches = range(len(self.entries))
+        self._groups = None
+
+    def __len__(self):
+        """ number of tasks matching the current query """
+        return len(self.matches)
+
+    def search(self, query):
+        """ restrict the catalog to the tasks matching 'query' """
+        query = ' '.join(query.lower().split())
+        if query == self.query:
+            return len(self.matches)
+        if query.startswith(self.query):
+            # a refinement of the last query can only match fewer tasks
+            candidates = self.matches
+        else:
+            candidates = xrange(len(self.entries))
+        words = query.split()
+        keys = self.keys
+        if words:
+            self.matches = [ii for ii in candidates
+                            if all(word in keys[ii] for word in words)]
+        else:
+            self.matches = range(len(self.entries))
+        self.query = query
+        self._groups = None
+        return len(self.matches)
+
+    def _group(self):
+        # the matches are sorted by subclass, so each subclass is a
+        # contiguous run of them
+        if self._groups is None:
+            order = []
+            groups = {}
+            entries = self.entries
+            for jj, ii in enumerate(self.matches):
+                subclass = entries[ii][0]
+                if subclass in groups:
+                    groups[subclass][1] = jj + 1
+                else:
+                    order.append(subclass)
+                    groups[subclass] = [jj, jj + 1]
+            self._groups = order, groups
+        return self._groups
+
+    def branches(self):
+        """ subclasses with at least one matching task """
+        return self._group()[0]
+
+    def children(self, subclass):
+        """ matching tasknames in 'subclass' """
+        start, stop = self._group()[1].get(subclass, (0, 0))
+        entries = self.entries
+        return [entries[ii][1] for ii in self.matches[start:stop]]
+
+
+class TaskIndex(object):
+
+    """
+    On-disk index of task modules:
+
+        module path --> (mtime, size, md5) --> exported task metadata
+
+    update() only re-executes modules whose contents have changed since the
+    index was last written. Tasks from unchanged modules are returned as
+    LazyTask instances built straight from the index, without importing
+    anything.
+
+    Modules are never imported into the calling process while scanning.
+    Each one is executed in a fresh interpreter of its own (started with
+    fork + exec, so nothing is inherited from a process that has threads
+    and an OpenGL context running), so a module that raises, hangs or
+    takes the interpreter down with it only costs us that module's tasks.
+    Failures are reported but not recorded in the index, so they get
+    retried on the next update.
+    """
+
+    # seconds to wait for the whole scan before giving up on the modules
+    # that haven't finished
+    scan_timeout = 30.
+
+    def __init__(self, path, processes=None):
+        self.path = path
+        self.processes = processes
+        self.modules = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                version, modules = cPickle.load(f)
+            if version == INDEX_VERSION:
+                self.modules = modules
+        except (IOError, EOFError, ValueError, TypeError,
+                cPickle.UnpicklingError):
+            # missing or corrupt index, never mind - we'll rebuild it
+            self.modules = {}
+
+    def save(self):
+        root = os.path.dirname(self.path)
+        if root and not os.path.exists(root):
+            os.makedirs(root)
+        # write to a temporary file first so that a crash can't leave us
+        # with a truncated index
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            cPickle.dump((INDEX_VERSION, self.modules), f,
+                         cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.path)
+
+    def module_paths(self, dirs):
+        """
+        all of the task source files within 'dirs', in walk order. paths
+        are canonical (symlinks resolved), so the same file reached by two
+        routes only gets one index record.
+        """
+        paths = []
+        seen = set()
+        for pth in dirs:
+            for relpath, _, fullnames in os.walk(pth):
+                for fullname in fullnames:
+                    fname, ext = os.path.splitext(fullname)
+                    if ext.lower() == '.py':
+                        path = os.path.realpath(
+                            os.path.join(relpath, fullname))
+                        if path not in seen:
+                            seen.add(path)
+                            paths.append(path)
+        return paths
+
+    def is_current(self, path, st):
+        """
+        check whether the index record for 'path' is still valid. if only
+        the mtime has changed (e.g. the file was touched or checked out
+        again) but the contents are identical, we just update the mtime.
+        """
+        rec = self.modules.get(path)
+        if rec is None or rec['size'] != st.st_size:
+            return False
+        if rec['mtime'] == st.st_mtime:
+            return True
+        if rec['md5'] == file_md5(path):
+            rec['mtime'] = st.st_mtime
+            self.changed = True
+            return True
+        return False
+
+    def scan(self, paths):
+        """
+        Execute the modules in 'paths' in worker interpreters, at most
+        'processes' at a time, and store the results in the index
+        """
+        nprocs = self.processes or multiprocessing.cpu_count()
+        deadline = time.time() + self.scan_timeout
+        tmpdir = tempfile.mkdtemp(prefix='tadpydoodle-scan-')
+        waiting = list(enumerate(paths))
+        running = []
+        try:
+            while waiting or running:
+                while waiting and len(running) < nprocs:
+                    ii, path = waiting.pop(0)
+                    out = os.path.join(tmpdir, '%i.pickle' % ii)
+                    proc = subprocess.Popen(
+                        [sys.executable, _worker_script, path, out],
+                        close_fds=True, preexec_fn=realtime.release)
+                    running.append((path, out, proc))
+                for item in list(running):
+                    path, out, proc = item
+                    if proc.poll() is not None:
+                        running.remove(item)
+                        self._collect(path, out, proc.returncode)
+                if time.time() > deadline:
+                    break
+                time.sleep(0.01)
+        finally:
+            for path, out, proc in running:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+                proc.wait()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        for path, out, proc in running:
+            print 'No response from %s after %g sec' % (
+                path, self.scan_timeout)
+            self.modules.pop(path, None)
+        # these never got a worker, which says nothing about the modules
+        # themselves - the scan as a whole just ran out of time
+        if waiting:
+            print '%i modules not scanned (scan took over %g sec):' % (
+                len(waiting), self.scan_timeout)
+            for ii, path in waiting:
+                print '    %s' % path
+                self.modules.pop(path, None)
+
+    def _collect(self, path, out, returncode):
+        """ store the record that a finished worker left in 'out' """
+        try:
+            with open(out, 'rb') as f:
+                _, rec = cPickle.load(f)
+        except (IOError, EOFError, ValueError, TypeError,
+                cPickle.UnpicklingError):
+            rec = {'error': 'Worker exited with status %i' % returncode}
+        if rec['error'] is not None:
+            print 'Failed to import tasks from %s:\n%s' % (
+                path, rec['error'])
+            self.modules.pop(path, None)
+        else:
+            self.modules[path] = rec
+        _modcache.pop(path, None)
+
+    def update(self, dirs):
+        """
+        Bring the index up to date with the source files in 'dirs', and
+        return a list of (modpath, metadata) tuples in discovery order.
+        """
+        with self.lock:
+            return self._update(dirs)
+
+    def update_async(self, dirs, callback):
+        """
+        Like update(), but runs in a background thread and passes the
+        result to 'callback' (from that thread) when it is done
+        """
+        def run():
+            realtime.release()
+            callback(self.update(dirs))
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _update(self, dirs):
+        self.changed = False
+        paths = self.module_paths(dirs)
+
+        # new or modified modules - we have to execute these
+        stale = [path for path in paths
+                 if not self.is_current(path, os.stat(path))]
+        if stale:
+            self.scan(stale)
+            self.changed = True
+
+        # forget about modules that have been deleted. the index file is
+        # shared with other tools that scan other directories, so leave
+        # records outside of 'dirs' alone
+        roots = [os.path.join(os.path.realpath(pth), '')
+                 for pth in dirs]
+        for path in set(self.modules) - set(paths):
+            if not any(path.startswith(root) for root in roots):
+                continue
+            del self.modules[path]
+            _modcache.pop(path, None)
+            self.changed = True
+
+        if self.changed:
+            self.save()
+
+        # modules that failed to import have no record
+        return [(path, meta) for path in paths if path in self.modules
+                for meta in self.modules[path]['entries']]
+
+
+if __name__ == '__main__':
+
+    # worker for TaskIndex.scan(): task_index.py <module path> <output path>
+    modpath, outpath = sys.argv[1:3]
+    result = scan_job(modpath)
+    with open(outpath, 'wb') as f:
+        cPickle.dump(result, f, cPickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import errno
+import socket
+import struct
+import argparse
+
+import numpy as np
+
+"""
+Live telemetry of frame and task metrics over a Unix domain socket
+(SOCK_SEQPACKET, so message boundaries are preserved). Set
+'telemetry_socket' in the [telemetry] section of the config file to
+enable it.
+
+The stimulus canvas records one fixed-size record per frame into a
+preallocated buffer, and every 'telemetry_batch' frames sends the whole
+batch as a single message to each connected subscriber. Sends never
+block: a subscriber that isn't keeping up simply misses batches (it can
+tell from the gaps in 'seq'), so the cost to the renderer is bounded no
+matter who is listening.
+
+Message: HEADER, then 'nrecords' records of RECORD_DTYPE.
+
+To watch the frame times from a shell:
+
+    $ python telemetry.py ~/.tadpydoodle/telemetry.sock
+"""
+
+MAGIC = 'TPDT'
+VERSION = 1
+
+# magic, version, record size, number of records, batch sequence number
+HEADER = struct.Struct('<4sHHIQ')
+
+RECORD_DTYPE = np.dtype([
+    ('frame', '<u8'),       # frames drawn since the canvas was created
+    ('time', '<f8'),        # wall clock time at the end of the frame
+    ('frametime', '<f4'),   # time since the previous frame (sec)
+    ('gcpause', '<f4'),     # time spent collecting garbage (sec)
+    ('taskframe', '<i4'),   # Task.currentframe, -1 if no task
+    ('stim', '<i4'),        # Task.currentstim, -1 if no task
+    ('taskdt', '<f4'),      # Task.dt, time since the task started (sec)
+    ('flags', 'u1'),        # see below
+    ('pad', 'V3')])
+
+# bits of 'flags'
+FLAG_ALLDRAW = 1
+FLAG_STIMDRAW = 2
+FLAG_PHOTODRAW = 4
+FLAG_PHOTODIODE = 8
+FLAG_RUNNING = 16
+
+# largest message we'll try to send in one go
+MAX_BATCH = 1024
+
+
+class RecordBuffer(object):
+
+    """
+    A preallocated batch of per-frame records. record() fills in the next
+    one, and flush() is called whenever the batch is full. flush() passes
+    the records collected so far to 'callback' (if given) and starts a new
+    batch; subclasses override it to send or write the batch instead.
+
+    Methods:
+        record(now, frametime, gcpause, drawflags, task, running)
+        flush()
+    """
+
+    def __init__(self, batch, callback=None):
+        self.batch = batch
+        self.callback = callback
+        self.records = np.zeros(self.batch, dtype=RECORD_DTYPE)
+        # column views, so that record() doesn't have to look up fields
+        self._frame = self.records['frame']
+        self._time = self.records['time']
+        self._frametime = self.records['frametime']
+        self._gcpause = self.records['gcpause']
+        self._taskframe = self.records['taskframe']
+        self._stim = self.records['stim']
+        self._taskdt = self.records['taskdt']
+        self._flags = self.records['flags']
+        self.n = 0
+        self.frame = 0
+
+    def record(self, now, frametime, gcpause, drawflags, task, running):
+        """ called once per frame """
+        ii = self.n
+        self._frame[ii] = self.frame
+        self._time[ii] = now
+        self._frametime[ii] = frametime
+        self._gcpause[ii] = gcpause
+        flags = drawflags
+        if running:
+            flags |= FLAG_RUNNING
+        if task is None:
+            self._taskframe[ii] = -1
+            self._stim[ii] = -1
+            self._taskdt[ii] = -1.
+        else:
+            self._taskframe[ii] = task.currentframe
+            self._stim[ii] = task.currentstim
+            self._taskdt[ii] = task.dt
+            if task.photodiode_on:
+                flags |= FLAG_PHOTODIODE
+        self._flags[ii] = flags
+        self.frame += 1
+        self.n = ii + 1
+        if self.n == self.batch:
+            self.flush()
+
+    def flush(self):
+        """ hand the records collected so far to the callback """
+        if self.n and self.callback is not None:
+            self.callback(self.records[:self.n])
+        self.n = 0
+
+
+class Publisher(RecordBuffer):
+
+    """
+    Methods:
+        record(now, frametime, gcpause, drawflags, task, running)
+        flush()
+        close()
+    """
+
+    def __init__(self, path, batch=60):
+        RecordBuffer.__init__(self, max(1, min(batch, MAX_BATCH)))
+        self.path = os.path.expanduser(path)
+        self.seq = 0
+        self.dropped = 0
+        self.clients = []
+
+        root = os.path.dirname(self.path)
+        if root and not os.path.exists(root):
+            os.makedirs(root)
+        # a socket file left behind by a previous run
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.server.bind(self.path)
+        self.server.listen(8)
+        self.server.setblocking(False)
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            conn.setblocking(False)
+            self.clients.append(conn)
+
+    def flush(self):
+        """ send the records collected so far to every subscriber """
+        self._accept()
+        if self.n and self.clients:
+            message = (HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize,
+                                   self.n, self.seq)
+                       + self.records[:self.n].tostring())
+            for conn in list(self.clients):
+                try:
+                    conn.send(message)
+                except socket.error as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                   errno.ENOBUFS):
+                        # not keeping up - it'll see the gap in seq
+                        self.dropped += 1
+                    else:
+                        # gone away
+                        self.clients.remove(conn)
+                        conn.close()
+        self.seq += 1
+        self.n = 0
+
+    def close(self):
+        for conn in self.clients:
+            conn.close()
+        self.clients = []
+        self.server.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def parse(message):
+    """ (seq, records) from one telemetry message """
+    magic, version, size, nrecords, seq = HEADER.unpack_from(message)
+    if magic != MAGIC or version != VERSION or size != RECORD_DTYPE.itemsize:
+        raise ValueError('not a telemetry message (version %i)' % version)
+    records = np.frombuffer(message, dtype=RECORD_DTYPE, count=nrecords,
+                            offset=HEADER.size)
+    return seq, records
+
+
+class Subscriber(object):
+
+    """
+    Reads telemetry batches from a Publisher's socket.
+
+    Methods:
+        read(timeout)
+        close()
+
+    Iterating over a Subscriber yields (seq, records) until the publisher
+    goes away.
+    """
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.sock.connect(os.path.expanduser(path))
+        self.bufsize = HEADER.size + MAX_BATCH * RECORD_DTYPE.itemsize
+        self.lastseq = None
+        self.missed = 0
+
+    def read(self, timeout=None):
+        """
+        the next (seq, records), or None on timeout. raises EOFError once
+        the publisher has closed the connection
+        """
+        self.sock.settimeout(timeout)
+        try:
+            message = self.sock.recv(self.bufsize)
+        except socket.timeout:
+            return None
+        if not message:
+            raise EOFError('publisher closed the connection')
+        seq, records = parse(message)
+        if self.lastseq is not None and seq > self.lastseq + 1:
+            self.missed += seq - self.lastseq - 1
+        self.lastseq = seq
+        return seq, records
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.read()
+            except EOFError:
+                return
+
+    def close(self):
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Show live frame time percentiles from a telemetry socket')
+    parser.add_argument('path', help='telemetry socket')
+    parser.add_argument('--window', type=int, default=600,
+                        help='number of frames to summarise')
+    args = parser.parse_args(argv)
+
+    sub = Subscriber(args.path)
+    window = np.zeros(args.window)
+    n = 0
+    print '%10s %8s %8s %8s %8s %6s %7s %6s' % (
+        'frame', 'p50', 'p90', 'p99', 'max', 'stim', 'taskdt', 'missed')
+    for seq, records in sub:
+        frametimes = records['frametime'][-args.window:]
+        window = np.roll(window, -frametimes.size)
+        window[-frametimes.size:] = frametimes
+        n = min(n + frametimes.size, args.window)
+        p50, p90, p99 = np.percentile(window[-n:], (50, 90, 99)) * 1E3
+        last = records[-1]
+        sys.stdout.write('\r%10i %8.2f %8.2f %8.2f %8.2f %6i %7.1f %6i' % (
+            last['frame'], p50, p90, p99, window[-n:].max() * 1E3,
+            last['stim'], last['taskdt'], sub.missed))
+        sys.stdout.flush()
+    print
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Per-frame allocation benchmark for the draw path. One task of each
+stimulus subclass (or every task, with --all) is stepped through its
+timeline on a virtual clock, drawing into a real GL context, and for every
+frame in which the stimulus is drawn we measure the cost of _display() +
+Scene.flush():
+
+    gc0     growth of the generation 0 count, i.e. gc-tracked objects
+            (tuples, lists, dicts...) that were allocated and not freed
+            again - this is what eventually triggers a collection
+    blocks  growth of the traced memory in bytes (tracemalloc, where
+            available)
+    usec    median wall time
+
+A GL context is needed. By default we open a hidden GLUT window; with
+--headless we use an EGL pbuffer instead, which works without an X server
+on Mesa (EGL_PLATFORM=surfaceless).
+
+Run from the tadpydoodle directory:
+
+    $ python testing/alloc_benchmark.py
+"""
+
+import os
+import sys
+import gc
+import time
+import argparse
+import traceback
+
+if '--headless' in sys.argv:
+    # has to happen before OpenGL is imported anywhere
+    os.environ['PYOPENGL_PLATFORM'] = 'egl'
+    os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from base_tasks.clocks import VirtualClock
+from timing_benchmark import registered_tasks
+
+FRAME_INTERVAL = 1. / 60.
+SIZE = 256
+
+
+def glut_context():
+    from OpenGL import GLUT
+    GLUT.glutInit(sys.argv[:1])
+    GLUT.glutInitDisplayMode(GLUT.GLUT_RGBA | GLUT.GLUT_STENCIL)
+    GLUT.glutInitWindowSize(SIZE, SIZE)
+    GLUT.glutCreateWindow('alloc_benchmark')
+    GLUT.glutHideWindow()
+
+
+def egl_context():
+    import ctypes
+    from OpenGL import EGL
+    display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not EGL.eglInitialize(display, ctypes.pointer(major),
+                             ctypes.pointer(minor)):
+        raise RuntimeError('eglInitialize failed')
+    attribs = (EGL.EGLint * 9)(
+        EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+        EGL.EGL_STENCIL_SIZE, 8,
+        EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+        EGL.EGL_NONE, 0, 0)
+    config = EGL.EGLConfig()
+    nconfigs = EGL.EGLint()
+    EGL.eglChooseConfig(display, attribs, ctypes.pointer(config), 1,
+                        ctypes.pointer(nconfigs))
+    if not nconfigs.value:
+        raise RuntimeError('no suitable EGL config')
+    size = (EGL.EGLint * 5)(EGL.EGL_WIDTH, SIZE, EGL.EGL_HEIGHT, SIZE,
+                            EGL.EGL_NONE)
+    surface = EGL.eglCreatePbufferSurface(display, config, size)
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT,
+                                   None)
+    if not EGL.eglMakeCurrent(display, surface, surface, context):
+        raise RuntimeError('eglMakeCurrent failed')
+
+
+def measure(taskcls, frame_interval=FRAME_INTERVAL):
+    """
+    arrays of (gc0, blocks, usec) for every frame in which 'taskcls'
+    drew its stimulus
+    """
+    clock = VirtualClock()
+    task = taskcls(clock=clock)
+    gc0, blocks, usec = [], [], []
+
+    # warm up: the first frame just sets the start time, and PyOpenGL
+    # sets up its argument converters the first time each function is
+    # called, so we skip the first drawn frame too
+    task._display()
+    warm = False
+
+    gc.disable()
+    try:
+        while not task.finished:
+            clock.advance(frame_interval)
+            c0 = gc.get_count()[0]
+            b0 = tracemalloc.get_traced_memory()[0] if tracemalloc else 0
+            t0 = time.time()
+            task._display()
+            task._scene.flush()
+            t1 = time.time()
+            b1 = tracemalloc.get_traced_memory()[0] if tracemalloc else 0
+            c1 = gc.get_count()[0]
+            if task.stim_on_last_frame:
+                if warm:
+                    gc0.append(c1 - c0)
+                    blocks.append(b1 - b0)
+                    usec.append((t1 - t0) * 1E6)
+                warm = True
+    finally:
+        gc.enable()
+
+    return np.array(gc0), np.array(blocks), np.array(usec)
+
+
+def pick_tasks(pattern, every):
+    """ one task per stimulus subclass, unless 'every' is True """
+    tasks = registered_tasks(pattern)
+    if every:
+        return tasks
+    seen = set()
+    picked = []
+    for task in tasks:
+        if task.subclass not in seen:
+            seen.add(task.subclass)
+            picked.append(task)
+    return picked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Per-frame allocation benchmark for the draw path')
+    parser.add_argument('--tasks', default='*',
+                        help='only benchmark tasknames matching this glob')
+    parser.add_argument('--all', action='store_true',
+                        help='benchmark every task, not one per subclass')
+    parser.add_argument('--headless', action='store_true',
+                        help='use an EGL pbuffer rather than a GLUT window')
+    args = parser.parse_args(argv)
+
+    if args.headless:
+        egl_context()
+    else:
+        glut_context()
+    if tracemalloc:
+        tracemalloc.start()
+
+    print '%-36s %-24s %8s %8s %8s %8s' % (
+        'task', 'subclass', 'frames', 'gc0', 'blocks', 'usec')
+    for taskcls in pick_tasks(args.tasks, args.all):
+        try:
+            gc0, blocks, usec = measure(taskcls)
+        except Exception:
+            print '%-36s %-24s FAILED: %s' % (
+                taskcls.taskname, taskcls.subclass,
+                traceback.format_exc().splitlines()[-1])
+            continue
+        if not gc0.size:
+            continue
+        print '%-36s %-24s %8i %8.2f %8.2f %8.1f' % (
+            taskcls.taskname, taskcls.subclass, gc0.size, gc0.mean(),
+            blocks.mean(), np.median(usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Round-trip latency of the remote control server (see remote.py), using
+remote.Client against a server whose commands are handled by a mock.
+
+Commands are either run directly on the server thread ('direct') or handed
+to a stand-in for the wx main loop ('mainloop'), which runs pending calls
+between simulated frames of --frame-ms msec, the way wx.CallAfter does.
+We also measure how long an event takes to reach a subscriber.
+
+Run from the tadpydoodle directory:
+
+    $ python testing/remote_latency_benchmark.py --address 127.0.0.1:0
+"""
+
+import os
+import sys
+import time
+import Queue
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import remote
+
+
+class MockController(object):
+
+    """ answers every command with a canned status """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, cmd, args):
+        self.calls += 1
+        if cmd == 'fail':
+            raise ValueError('failed on purpose')
+        return {'cmd': cmd, 'args': args, 'running': False}
+
+
+class MainLoop(object):
+
+    """ runs queued calls between busy 'frames', like the wx main loop """
+
+    def __init__(self, frame_ms):
+        self.frame = frame_ms / 1000.
+        self.pending = Queue.Queue()
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def call_after(self, func, *args):
+        self.pending.put((func, args))
+
+    def run(self):
+        while self.running:
+            end = time.time() + self.frame
+            while time.time() < end:
+                pass
+            # like wx, only handle what was queued by the end of the frame;
+            # anything queued meanwhile waits for the next one
+            for _ in xrange(self.pending.qsize()):
+                func, args = self.pending.get_nowait()
+                func(*args)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def round_trips(address, n):
+    client = remote.Client(address)
+    client.call('status')
+    times = []
+    for ii in xrange(n):
+        t = time.time()
+        client.call('status', frame=ii)
+        times.append(time.time() - t)
+    try:
+        client.call('fail')
+        raise AssertionError('expected an error')
+    except RuntimeError:
+        pass
+    client.close()
+    return np.array(times) * 1E3
+
+
+def event_latency(server, address, n):
+    client = remote.Client(address)
+    client.subscribe()
+    times = []
+    for ii in xrange(n):
+        server.publish('tick', sent=time.time())
+        event = client.next_event(timeout=1.)
+        times.append(time.time() - event['sent'])
+    client.close()
+    return np.array(times) * 1E3
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Remote control round-trip latency')
+    parser.add_argument('--address', default=None,
+                        help="'host:port' or Unix socket path (default: a "
+                             "temporary Unix socket)")
+    parser.add_argument('-n', type=int, default=2000,
+                        help='number of requests')
+    parser.add_argument('--frame-ms', type=float, default=2.,
+                        help='length of a simulated frame (msec)')
+    args = parser.parse_args(argv)
+
+    address = args.address
+    if address is None:
+        address = os.path.join(tempfile.mkdtemp(), 'remote.sock')
+
+    print '%-10s %8s %8s %8s %8s' % ('mode', 'p50', 'p90', 'p99', 'max')
+    for mode in ('direct', 'mainloop', 'events'):
+        loop = MainLoop(args.frame_ms) if mode == 'mainloop' else None
+        server = remote.Server(address, MockController(),
+                               call=loop and loop.call_after)
+        server.start()
+        if server.family == remote.socket.AF_INET:
+            bound = '%s:%i' % server.address
+        else:
+            bound = server.address
+        try:
+            if mode == 'events':
+                ms = event_latency(server, bound, args.n)
+            else:
+                ms = round_trips(bound, args.n)
+        finally:
+            server.close()
+            if loop is not None:
+                loop.stop()
+        p50, p90, p99 = np.percentile(ms, (50, 90, 99))
+        print '%-10s %8.3f %8.3f %8.3f %8.3f' % (mode, p50, p90, p99,
+                                                 ms.max())
+    print '(msec)'
+
+
+if __name__ == '__main__':
+    main()
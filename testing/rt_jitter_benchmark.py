@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Frame pacing jitter with and without the real-time profile (see
+realtime.py). A loop that wakes up every --interval msec, like the render
+timer does, is run twice in a child process: once with the default
+scheduling, once with the profile applied. Meanwhile --hogs processes spin
+on the CPU(s) to simulate competing load, e.g. acquisition software.
+
+For each run we report statistics of the lateness of each wake-up
+relative to its deadline (msec). Raising the priority usually needs root
+or an rtprio limit - if the profile can't be applied, the failures are
+printed and the 'realtime' row is just another default run.
+
+Run from the tadpydoodle directory:
+
+    $ python testing/rt_jitter_benchmark.py --cpus 1 --hogs 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import realtime
+
+
+def hog(stop):
+    """ spin until told to stop """
+    x = 0
+    while not stop.is_set():
+        for ii in xrange(10000):
+            x += ii
+
+
+def pace(interval, duration, profile, results):
+    """ runs in a child process: sleep-paced loop, put latenesses (sec) """
+    failures = []
+    if profile is not None:
+        failures = realtime.apply_profile(**profile)
+    interval /= 1000.
+    late = []
+    deadline = time.time() + interval
+    end = deadline + duration
+    while deadline < end:
+        remaining = deadline - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        late.append(time.time() - deadline)
+        deadline += interval
+    results.put((failures, realtime.report(), late))
+
+
+def measure(interval, duration, profile=None):
+    results = multiprocessing.Queue()
+    proc = multiprocessing.Process(
+        target=pace, args=(interval, duration, profile, results))
+    proc.start()
+    failures, report, late = results.get()
+    proc.join()
+    return failures, report, np.array(late) * 1E3
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Frame pacing jitter with and without the real-time '
+                    'profile')
+    parser.add_argument('--interval', type=float, default=1000. / 60.,
+                        help='wake-up interval (msec)')
+    parser.add_argument('--duration', type=float, default=10.,
+                        help='length of each run (sec)')
+    parser.add_argument('--hogs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of CPU-hog processes')
+    parser.add_argument('--policy', default='fifo',
+                        choices=sorted(realtime.POLICIES))
+    parser.add_argument('--priority', type=int, default=50)
+    parser.add_argument('--cpus', default='',
+                        help="pin the paced loop to these CPUs, e.g. '1'")
+    parser.add_argument('--no-mlock', action='store_true')
+    args = parser.parse_args(argv)
+
+    profile = {'policy': args.policy, 'priority': args.priority,
+               'cpus': args.cpus, 'mlock': not args.no_mlock}
+
+    stop = multiprocessing.Event()
+    hogs = [multiprocessing.Process(target=hog, args=(stop,))
+            for _ in xrange(args.hogs)]
+    for proc in hogs:
+        proc.daemon = True
+        proc.start()
+
+    try:
+        print '%-10s %8s %8s %8s %8s %8s' % (
+            'profile', 'wakeups', 'mean', 'sd', 'p99', 'max')
+        for name, prof in (('default', None), ('realtime', profile)):
+            failures, report, late = measure(
+                args.interval, args.duration, prof)
+            for msg in failures:
+                print '  %s' % msg
+            print '%-10s %8i %8.3f %8.3f %8.3f %8.3f' % (
+                name, late.size, late.mean(), late.std(),
+                np.percentile(late, 99), late.max())
+            print '  %s' % report
+    finally:
+        stop.set()
+        for proc in hogs:
+            proc.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Time from launch to first presented frame. tadpydoodle.py is started
+--repeats times with --quit-after-first-frame, and the startup profile it
+saves (see startup.py) is combined with our own launch time, so that the
+interpreter's own startup is counted too:
+
+    interpreter     launch --> first line of tadpydoodle.py
+    <phase>         each phase of startup (imports, config, windows, GL
+                    init, shader compilation, task discovery...)
+    first frame     launch --> first frame presented
+
+The first run is reported separately, since it may have to rebuild the task
+index and fill the OS file cache. Needs a display. Run from the tadpydoodle
+directory:
+
+    $ python testing/startup_benchmark.py --repeats 5
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+def launch(timeout):
+    """ run tadpydoodle once, return {phase: msec since launch} """
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'startup.json')
+    devnull = open(os.devnull, 'w')
+    try:
+        t0 = time.time()
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'tadpydoodle.py'),
+             '--startup-profile', path, '--quit-after-first-frame'],
+            cwd=ROOT, stdout=devnull)
+        while proc.poll() is None:
+            if time.time() - t0 > timeout:
+                proc.kill()
+                raise RuntimeError('no first frame after %g sec' % timeout)
+            time.sleep(0.01)
+        if not os.path.exists(path):
+            raise RuntimeError('tadpydoodle exited (%i) without saving a '
+                               'startup profile' % proc.returncode)
+        with open(path) as f:
+            profile = json.load(f)
+    finally:
+        devnull.close()
+        shutil.rmtree(tmpdir)
+
+    times = {'interpreter': (profile['launched'] - t0) * 1E3,
+             'first frame': (profile['first_frame'] - t0) * 1E3}
+    for phase in profile['phases']:
+        times[phase['name']] = phase['duration'] * 1E3
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time from launch to first frame')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='number of launches after the first')
+    parser.add_argument('--timeout', type=float, default=60.,
+                        help='give up on a launch after this long (sec)')
+    args = parser.parse_args(argv)
+
+    first = launch(args.timeout)
+    runs = [launch(args.timeout) for ii in xrange(args.repeats)]
+
+    names = sorted(first, key=lambda name: (name == 'first frame', name))
+    print '%-20s %10s %10s %10s' % ('phase', 'first', 'median', 'max')
+    for name in names:
+        values = np.array([run.get(name, np.nan) for run in runs])
+        if values.size:
+            median, worst = np.median(values), values.max()
+        else:
+            median = worst = np.nan
+        print '%-20s %10.1f %10.1f %10.1f' % (name, first[name], median,
+                                              worst)
+    print '(msec)'
+
+
+if __name__ == '__main__':
+    main()
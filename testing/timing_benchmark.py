@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Stimulus timing accuracy benchmark. Every registered task is simulated
+headlessly (see base_tasks/simulate.py) under a few synthetic frame-time
+distributions, and the following errors are reported per task:
+
+    onset       actualstimtimes - theoreticalstimtimes (sec)
+    scanframe   time at which each scan frame was entered - frametimes (sec)
+    duty        measured - theoretical photodiode duty cycle (fraction of
+                a scan period)
+
+Results are written as CSV. With --baseline, they are compared against a
+JSON file saved earlier with --save-baseline, and the script exits with
+status 1 if any error got worse by more than --tolerance.
+
+Run from the tadpydoodle directory:
+
+    $ python testing/timing_benchmark.py --out timing.csv
+"""
+
+import os
+import sys
+import csv
+import json
+import fnmatch
+import argparse
+import traceback
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import task_index as ti
+from base_tasks.simulate import simulate
+
+REFRESH_HZ = 60.
+NINTERVALS = 10000
+
+
+def frame_distributions(seed=0):
+    """
+    synthetic frame intervals (sec):
+
+        fixed       exactly 1 / REFRESH_HZ
+        jittered    gaussian jitter, 1ms SD
+        stalls      fixed, with an occasional (0.5%) 50ms stall
+    """
+    gen = np.random.RandomState(seed)
+    period = 1. / REFRESH_HZ
+    fixed = np.repeat(period, NINTERVALS)
+    jittered = np.clip(period + gen.normal(0, 1E-3, NINTERVALS), 1E-3, None)
+    stalls = fixed.copy()
+    stalls[gen.random_sample(NINTERVALS) < 0.005] = 0.05
+    return [('fixed', fixed), ('jittered', jittered), ('stalls', stalls)]
+
+
+def timing_errors(task, log):
+    """ onset, scan-frame and photodiode duty errors for a simulated run """
+
+    onset = task.actualstimtimes - task.theoreticalstimtimes
+
+    # when did the task actually move into each scan frame? log.frame is
+    # non-decreasing, so we can find the first sample in each frame with a
+    # binary search
+    frames = np.arange(task.nframes)
+    first = np.searchsorted(log.frame, frames)
+    valid = first < log.frame.size
+    scanframe = log.time[first[valid]] - task.frametimes[frames[valid]]
+    # the first frame is entered at t=0 by definition
+    scanframe = scanframe[1:]
+
+    # each sample's state is shown until the next one
+    durations = np.concatenate((np.diff(log.time), [0.]))
+    period = 1. / task.scan_hz
+    on_time = np.bincount(log.frame, weights=durations * log.photodiode,
+                          minlength=task.nframes)
+    duty = (on_time[:-1] - task.photodiodeontime) / period
+
+    def summary(err):
+        if not err.size:
+            return 0., 0.
+        return float(np.mean(err)), float(np.max(np.abs(err)))
+
+    results = {}
+    for name, err in (('onset', onset), ('scanframe', scanframe),
+                      ('duty', duty)):
+        results[name + '_mean'], results[name + '_maxabs'] = summary(err)
+    return results
+
+
+def registered_tasks(pattern='*'):
+    """ LazyTasks for every task that tadpydoodle would find """
+    root = os.path.join(os.path.dirname(__file__), os.pardir)
+    dirs = [os.path.join(root, 'base_tasks'), os.path.join(root, 'user_tasks')]
+    index = ti.TaskIndex(os.path.expanduser('~/.tadpydoodle/task_index'))
+    taskdict = ti.build_taskdict(index.update(dirs))
+    return [taskdict[name] for name in sorted(taskdict)
+            if fnmatch.fnmatch(name, pattern)]
+
+
+def run(tasks, seed=0):
+    rows = []
+    for task in tasks:
+        for distname, intervals in frame_distributions(seed):
+            row = {'task': task.taskname, 'distribution': distname}
+            try:
+                row.update(timing_errors(
+                    *simulate(task, frame_intervals=intervals)))
+                row['error'] = ''
+            except Exception:
+                row['error'] = traceback.format_exc().splitlines()[-1]
+            rows.append(row)
+    return rows
+
+
+FIELDS = ['task', 'distribution',
+          'onset_mean', 'onset_maxabs',
+          'scanframe_mean', 'scanframe_maxabs',
+          'duty_mean', 'duty_maxabs', 'error']
+
+
+def compare(rows, baseline, tolerance):
+    """
+    list of (task, distribution, metric, old, new) regressions. A task that
+    has a baseline entry but now raises is reported with metric 'error'.
+    """
+    regressions = []
+    for row in rows:
+        old = baseline.get(row['task'], {}).get(row['distribution'])
+        if old is None:
+            continue
+        if row['error']:
+            regressions.append((row['task'], row['distribution'],
+                                'error', None, row['error']))
+            continue
+        for metric in FIELDS[2:-1]:
+            if not metric.endswith('maxabs'):
+                continue
+            if row[metric] > old[metric] + tolerance:
+                regressions.append((row['task'], row['distribution'],
+                                    metric, old[metric], row[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Stimulus timing accuracy benchmark')
+    parser.add_argument('--tasks', default='*',
+                        help='only benchmark tasknames matching this glob')
+    parser.add_argument('--out', default='-', help='CSV output path')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='JSON baseline to compare with')
+    parser.add_argument('--save-baseline', help='save results as JSON')
+    parser.add_argument('--tolerance', type=float, default=1E-3,
+                        help='allowed increase in max. abs. error')
+    args = parser.parse_args(argv)
+
+    rows = run(registered_tasks(args.tasks), args.seed)
+
+    out = sys.stdout if args.out == '-' else open(args.out, 'wb')
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    if out is not sys.stdout:
+        out.close()
+
+    if args.save_baseline:
+        baseline = {}
+        for row in rows:
+            if not row['error']:
+                baseline.setdefault(row['task'], {})[row['distribution']] = \
+                    dict((kk, row[kk]) for kk in FIELDS[2:-1])
+        with open(args.save_baseline, 'w') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(rows, baseline, args.tolerance)
+        for task, dist, metric, old, new in regressions:
+            if metric == 'error':
+                sys.stderr.write('REGRESSION %s [%s] now fails: %s\n'
+                                 % (task, dist, new))
+            else:
+                sys.stderr.write('REGRESSION %s [%s] %s: %.6f -> %.6f\n'
+                                 % (task, dist, metric, old, new))
+        status = int(bool(regressions))
+
+    failed = [row for row in rows if row['error']]
+    for row in failed:
+        sys.stderr.write('FAILED %s [%s]: %s\n'
+                         % (row['task'], row['distribution'], row['error']))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
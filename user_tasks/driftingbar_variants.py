@@ -71,6 +71,19 @@ class bars_2hz_2(bars2):
     taskname = 'bars_2hz_2'
     scan_hz = 2.
 
+
+class bars_ease_1(bars_2hz_1):
+    # accelerates from, and decelerates to, a standstill at either end
+    taskname = 'bars_ease_1'
+    sweep_profile = 'ease_in_out'
+
+
+class bars_apparent_motion_1(bars_2hz_1):
+    # jumps between 6 positions along the sweep rather than moving smoothly
+    taskname = 'bars_apparent_motion_1'
+    sweep_profile = 'stepwise'
+    sweep_steps = 6
+
 # dynamically generate 20 random permutations of the drifting bar directions
 for ii in xrange(20):
 
@@ -0,0 +1,73 @@
+"""
+Copyright 2013 Alistair Muldal & Timothy Lillicrap
+
+Tadpydoodle is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Tadpydoodle is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Tadpydoodle.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from base_tasks.task_classes import NoiseTexture
+
+##########################################################################
+# white noise stimulus classes
+# NB: in order to be displayed in tadpydoodle, stimuli must have a 'taskname'
+
+
+class binary_noise_1(NoiseTexture):
+
+    taskname = 'binary_noise_1'
+
+    # stimulus-specific parameters
+    noise_type = 'binary'
+    gridshape = (16, 16)
+    noise_hz = 10.
+    noise_seed = 0
+    noise_color = (0.5, 0.5, 0.5, 1.)
+    background_color = (0.5, 0.5, 0.5, 1.)
+
+    # stimulus timing
+    initblanktime = 2.
+    finalblanktime = 10.
+    interval = 30.
+    on_duration = 30.
+
+    # photodiode triggering parameters
+    scan_hz = 2.
+    photodiodeontime = 0.075
+
+    nstim = 4
+
+
+class sparse_ternary_noise_1(binary_noise_1):
+
+    taskname = 'sparse_ternary_noise_1'
+
+    noise_type = 'ternary'
+    sparseness = 0.05
+
+
+class gaussian_noise_1(binary_noise_1):
+
+    taskname = 'gaussian_noise_1'
+
+    noise_type = 'gaussian'
+    noise_sigma = 0.33
+
+
+# dynamically generate 20 different seeds of the binary noise stimulus
+for ii in xrange(20):
+
+    taskname = 'binary_noise_seed_%02i' % (ii + 1)
+    locals().update(
+        {taskname: type(taskname, (binary_noise_1,),
+                        {'noise_seed': ii + 1, 'taskname': taskname})}
+    )